@@ -1,11 +1,32 @@
+import asyncio
+import logging
 import gradio as gr
-from prompt_refiner import PromptRefiner
-from variables import models, explanation_markdown, metaprompt_list, examples
+from prompt_refiner import AsyncPromptRefiner, create_refiner, template_settings
+from metrics import start_metrics_server
+from queue_status import QueueMonitor
+from template_source import TemplateWatcher
+from logging_setup import setup_logging, new_request_id
+from variables import (
+    models, explanation_markdown, metaprompt_list, examples, stream_responses, metrics_host, metrics_port,
+    log_level, log_format, prompt_refiner_model, queue_max_size, route_concurrency, refine_concurrency,
+    apply_concurrency, queue_status_interval, templates_path, templates_reload_interval, template_store_path,
+    TemplateConfig, best_of_n_top_k, best_of_n_samples, best_of_n_judge
+)
 from custom_css import custom_css
 
+logger = logging.getLogger(__name__)
+
+
+# Templates from TEMPLATES_PATH are reloaded when they change; a TEMPLATE_STORE takes precedence and is not
+TEMPLATES_RELOADABLE = bool(templates_path and not template_store_path and templates_reload_interval > 0)
+
+# Button events run in separate Gradio concurrency groups, each with its own limit
+CONCURRENCY_GROUPS = {"route": "Routing", "refine": "Refining", "apply": "Applying"}
+
+
 class GradioInterface:
 
-    def __init__(self, prompt_refiner: PromptRefiner, custom_css):
+    def __init__(self, prompt_refiner: AsyncPromptRefiner, custom_css):
         self.prompt_refiner = prompt_refiner
         # Set default model to second-to-last in the list
         default_model = (
@@ -14,6 +35,7 @@ class GradioInterface:
         # meta_prompt_choice=metaprompt_list[0]
 
         with gr.Blocks(css=custom_css, theme=gr.themes.Default()) as self.interface:
+            self.queue_monitor = QueueMonitor(self.interface, CONCURRENCY_GROUPS)
             # CONTAINER 1
             with gr.Column(elem_classes=["container", "title-container"]):
                 gr.Markdown("# PROMPT++")
@@ -23,6 +45,15 @@ class GradioInterface:
                 gr.Markdown(
                     "Learn how to generate an improved version of your prompts."
                 )
+                if queue_status_interval > 0:
+                    queue_status = gr.Markdown()
+                    # Polled outside the queue so the status still updates when every slot is busy
+                    gr.Timer(queue_status_interval).tick(
+                        fn=self.queue_monitor.markdown,
+                        outputs=[queue_status],
+                        queue=False,
+                        show_progress="hidden",
+                    )
 
             # CONTAINER 2
             with gr.Column(elem_classes=["container", "input-container"]):
@@ -50,7 +81,36 @@ class GradioInterface:
                   elem_classes=["button-waiting"]
               )
                 with gr.Accordion("Metaprompt Explanation", open=False, visible=True):
-                    gr.Markdown(explanation_markdown)
+                    metaprompt_explanation = gr.Markdown(explanation_markdown)
+                with gr.Accordion("Compare Several Refinements", open=False, visible=True):
+                    with gr.Row():
+                        candidates_top_k = gr.Slider(
+                            minimum=1,
+                            maximum=max(2, min(5, len(metaprompt_list))),
+                            value=best_of_n_top_k,
+                            step=1,
+                            label="Suggested metaprompts",
+                        )
+                        candidates_samples = gr.Slider(
+                            minimum=1, maximum=4, value=best_of_n_samples, step=1, label="Samples per metaprompt"
+                        )
+                        candidates_judge = gr.Checkbox(value=best_of_n_judge, label="Rank with a judging call")
+                    candidates_button = gr.Button("Refine and Compare")
+                    candidates_table = gr.Dataframe(
+                        headers=["Rank", "Metaprompt", "Sample", "Score", "Seconds", "Refined prompt", "Judge's reason or error"],
+                        interactive=False,
+                        wrap=True,
+                    )
+                if TEMPLATES_RELOADABLE:
+                    # Pick up templates reloaded from TEMPLATES_PATH without a page refresh
+                    templates_version = gr.State(self.prompt_refiner.snapshot.version)
+                    gr.Timer(templates_reload_interval).tick(
+                        fn=self.refresh_templates,
+                        inputs=[templates_version, meta_prompt_choice],
+                        outputs=[templates_version, meta_prompt_choice, metaprompt_explanation],
+                        queue=False,
+                        show_progress="hidden",
+                    )
 
             with gr.Column(elem_classes=["container", "analysis-container"]):
                 gr.Markdown(" ")
@@ -126,10 +186,13 @@ class GradioInterface:
                 fn=self.automatic_metaprompt,
                 inputs=[prompt_text],
                 outputs=[MetaPrompt_analysis, meta_prompt_choice],
+                concurrency_limit=route_concurrency or None,
+                concurrency_id="route",
             ).then(
                 fn=lambda: None,
                 inputs=None,
                 outputs=None,
+                queue=False,
                 js="""
                   () => {
                       // Clear subsequent outputs
@@ -164,10 +227,13 @@ class GradioInterface:
                     explanation_of_refinements,
                     full_response_json,
                 ],
+                concurrency_limit=refine_concurrency or None,
+                concurrency_id="refine",
             ).then(
                 fn=lambda: None,
                 inputs=None,
                 outputs=None,
+                queue=False,
                 js="""
                   () => {
                       // Clear model outputs
@@ -193,6 +259,21 @@ class GradioInterface:
               """,
             )
 
+            # All candidates run at once; the best one fills the refined prompt for Apply Prompts
+            candidates_button.click(
+                fn=self.refine_candidates,
+                inputs=[prompt_text, candidates_top_k, candidates_samples, candidates_judge],
+                outputs=[
+                    candidates_table,
+                    prompt_evaluation,
+                    refined_prompt,
+                    explanation_of_refinements,
+                    full_response_json,
+                ],
+                concurrency_limit=refine_concurrency or None,
+                concurrency_id="refine",
+            )
+
             apply_button.click(
                 fn=self.apply_prompts,
                 inputs=[prompt_text, refined_prompt, apply_model],
@@ -203,10 +284,13 @@ class GradioInterface:
                     refined_output1,
                 ],
                 show_progress=True,  # Add this line
+                concurrency_limit=apply_concurrency or None,
+                concurrency_id="apply",
             ).then(
                 fn=lambda: None,
                 inputs=None,
                 outputs=None,
+                queue=False,
                 js="""
                   () => {
                       // Update button states
@@ -236,6 +320,7 @@ class GradioInterface:
                 fn=lambda: None,
                 inputs=None,
                 outputs=None,
+                queue=False,
                 js="""
                   () => {
                       // Clear all outputs
@@ -262,8 +347,21 @@ class GradioInterface:
               """,
             )
 
-    def automatic_metaprompt(self, prompt: str) -> tuple:
+    def refresh_templates(self, version: int, meta_prompt_choice: str) -> tuple:
+        """Update the metaprompt choices when the refiner's templates have been reloaded"""
+        snapshot = self.prompt_refiner.snapshot
+        if snapshot.version == version:
+            return version, gr.update(), gr.update()
+        choices = list(snapshot.meta_prompts)
+        return (
+            snapshot.version,
+            gr.update(choices=choices, value=meta_prompt_choice if meta_prompt_choice in choices else choices[0]),
+            "".join(f"- **{key}**: {value}\n" for key, value in snapshot.metaprompt_explanations.items()),
+        )
+
+    async def automatic_metaprompt(self, prompt: str) -> tuple:
         """Handle automatic metaprompt selection with progress updates"""
+        new_request_id()
         try:
             if not prompt.strip():
                 gr.Warning("Please enter a prompt to analyze.")
@@ -271,7 +369,7 @@ class GradioInterface:
 
             gr.Info("Analyzing prompt to select best refinement method...")
             metaprompt_analysis, recommended_key = (
-                self.prompt_refiner.automatic_metaprompt(prompt)
+                await self.prompt_refiner.automatic_metaprompt(prompt)
             )
             gr.Info("Analysis complete!")
             return metaprompt_analysis, recommended_key
@@ -281,93 +379,179 @@ class GradioInterface:
             gr.Warning(error_message)
             return error_message, None
 
-    def refine_prompt(self, prompt: str, meta_prompt_choice: str) -> tuple:
-        """Handle manual prompt refinement with progress updates"""
+    async def refine_prompt(self, prompt: str, meta_prompt_choice: str):
+        """Handle manual prompt refinement, streaming the refined prompt as it is generated"""
+        new_request_id()
         try:
             if not prompt.strip():
                 gr.Warning("No prompt provided.")
-                return ("No prompt provided.", "", "", {})
+                yield ("No prompt provided.", "", "", {})
+                return
 
             gr.Info("Refining prompt...")
-            result = self.prompt_refiner.refine_prompt(prompt, meta_prompt_choice)
+            if stream_responses:
+                async for result in self.prompt_refiner.refine_prompt_stream(
+                    prompt, meta_prompt_choice
+                ):
+                    yield result
+            else:
+                result = await self.prompt_refiner.refine_prompt(prompt, meta_prompt_choice)
+                yield (
+                    result[0],  # initial_prompt_evaluation
+                    result[1],  # refined_prompt
+                    result[2],  # explanation_of_refinements
+                    result[3],  # full_response
+                )
             gr.Info("Refinement complete!")
+        except Exception as e:
+            error_message = f"Error in refine_prompt: {str(e)}"
+            gr.Warning(error_message)
+            yield error_message, "", "", {}
+
+    async def refine_candidates(self, prompt: str, top_k: float, samples: float, judge: bool) -> tuple:
+        """Refine with several metaprompts and samples at once, show every candidate and keep the best"""
+        new_request_id()
+        try:
+            if not prompt.strip():
+                gr.Warning("No prompt provided.")
+                return [], "No prompt provided.", "", "", {}
+
+            gr.Info("Refining candidates...")
+            candidates = await self.prompt_refiner.refine_candidates(
+                prompt, top_k=int(top_k), samples=int(samples), judge=judge
+            )
+            # Failed candidates stay in the table, unranked, with their error as the reason
+            rows = [
+                [
+                    "failed" if candidate.failed else rank,
+                    candidate.metaprompt,
+                    candidate.sample + 1,
+                    None if candidate.failed else round(candidate.score, 3),
+                    round(candidate.seconds, 1),
+                    candidate.refined_prompt,
+                    candidate.reason,
+                ]
+                for rank, candidate in enumerate(candidates, 1)
+            ]
+            best = candidates[0]
+            failed = sum(candidate.failed for candidate in candidates)
+            if failed == len(candidates):
+                gr.Warning(f"All {failed} candidates failed: {best.reason}")
+                return rows, best.initial_prompt_evaluation, "", "", {}
+            if failed:
+                gr.Warning(f"{failed} of {len(candidates)} candidates failed and were not ranked; see the table.")
+            gr.Info("Comparison complete!")
             return (
-                result[0],  # initial_prompt_evaluation
-                result[1],  # refined_prompt
-                result[2],  # explanation_of_refinements
-                result[3],  # full_response
+                rows,
+                best.initial_prompt_evaluation,
+                best.refined_prompt,
+                best.explanation_of_refinements,
+                best.full_response,
             )
         except Exception as e:
-            error_message = f"Error in refine_prompt: {str(e)}"
+            error_message = f"Error in refine_candidates: {str(e)}"
             gr.Warning(error_message)
-            return error_message, "", "", {}
+            return [], error_message, "", "", {}
 
-    def apply_prompts(
+    async def apply_prompts(
         self, original_prompt: str, refined_prompt: str, model: str
-    ) -> tuple:
-        """Apply both original and refined prompts to the selected model with improved error handling"""
+    ):
+        """Apply both original and refined prompts to the selected model concurrently, updating each pane as soon as its output is ready"""
+        new_request_id()
         try:
             if not original_prompt or not refined_prompt:
-                return (
+                yield (
                     "Please provide both original and refined prompts.",
                     "Please provide both original and refined prompts.",
                     "Please provide both original and refined prompts.",
                     "Please provide both original and refined prompts.",
                 )
+                return
 
             if not model:
-                return (
+                yield (
                     "Please select a model.",
                     "Please select a model.",
                     "Please select a model.",
                     "Please select a model.",
                 )
-
-            # Apply prompts with progress updates
-            gr.Info("Processing original prompt...")
-            original_output = self.prompt_refiner.apply_prompt(original_prompt, model)
-
-            gr.Info("Processing refined prompt...")
-            refined_output = self.prompt_refiner.apply_prompt(refined_prompt, model)
-
-            # Ensure we have string outputs
-            original_output = (
-                str(original_output)
-                if original_output is not None
-                else "No output generated"
-            )
-            refined_output = (
-                str(refined_output)
-                if refined_output is not None
-                else "No output generated"
-            )
+                return
+
+            # Send both prompts at once; the user waits for the slower one, not the sum
+            gr.Info("Processing original and refined prompts...")
+            updates = asyncio.Queue()
+
+            async def run(side: str, prompt: str):
+                try:
+                    if stream_responses:
+                        async for output in self.prompt_refiner.apply_prompt_stream(
+                            prompt, model
+                        ):
+                            await updates.put((side, output))
+                    else:
+                        await updates.put(
+                            (side, await self.prompt_refiner.apply_prompt(prompt, model))
+                        )
+                finally:
+                    await updates.put((side, None))
+
+            tasks = [
+                asyncio.create_task(run("original", original_prompt)),
+                asyncio.create_task(run("refined", refined_prompt)),
+            ]
+            try:
+                running = len(tasks)
+                outputs = {"original": None, "refined": None}
+                while running:
+                    side, output = await updates.get()
+                    if output is None:
+                        running -= 1
+                        # Ensure we have string outputs
+                        if outputs[side] is not None:
+                            continue
+                        output = "No output generated"
+                    outputs[side] = str(output)
+                    if side == "original":
+                        # Original Prompt Output tab and Comparison tab - original
+                        yield outputs[side], gr.update(), outputs[side], gr.update()
+                    else:
+                        # Refined Prompt Output tab and Comparison tab - refined
+                        yield gr.update(), outputs[side], gr.update(), outputs[side]
+            finally:
+                for task in tasks:
+                    task.cancel()
 
             gr.Info("Processing complete!")
-            return (
-                original_output,  # For Original Prompt Output tab
-                refined_output,  # For Refined Prompt Output tab
-                original_output,  # For Comparison tab - original
-                refined_output,  # For Comparison tab - refined
-            )
 
         except Exception as e:
             error_message = f"Error in apply_prompts: {str(e)}"
             gr.Warning(error_message)  # Show error in UI
-            return (error_message, error_message, error_message, error_message)
+            yield (error_message, error_message, error_message, error_message)
 
     def launch(self, share=False):
-        """Launch the Gradio interface"""
-        self.interface.launch(share=share)
+        """Launch the Gradio interface, rejecting new events at once when the queue is full"""
+        self.interface.queue(max_size=queue_max_size or None).launch(share=share)
 
 
 if __name__ == '__main__':
-    from variables import api_endpoint, api_key, meta_prompts, metaprompt_explanations
+    setup_logging(log_level, json_format=log_format == "json")
+    logger.info("Metaprompts: %s", metaprompt_list)
+    logger.info("prompt_refiner_model used: %s", prompt_refiner_model)
 
     # Initialize the prompt refiner with OpenAI-compatible API endpoint
-    prompt_refiner = PromptRefiner(
-        api_endpoint, api_key, meta_prompts, metaprompt_explanations
-    )
+    prompt_refiner = create_refiner(AsyncPromptRefiner)
+    if TEMPLATES_RELOADABLE:
+        def reload_templates(prompt_data):
+            snapshot = prompt_refiner.set_templates(**template_settings(TemplateConfig(prompt_data=prompt_data)))
+            logger.info("Reloaded %d templates from %s (version %d)", len(snapshot.meta_prompts), templates_path,
+                        snapshot.version)
+
+        TemplateWatcher(templates_path, templates_reload_interval).start(reload_templates)
 
     # Create and launch the Gradio interface
     gradio_interface = GradioInterface(prompt_refiner, custom_css)
+    if metrics_port:
+        prompt_refiner.metrics.add_collector(gradio_interface.queue_monitor.collect)
+        start_metrics_server(prompt_refiner.metrics, metrics_port, metrics_host)
+        logger.info("Serving metrics on http://%s:%d/metrics", metrics_host, metrics_port)
     gradio_interface.launch(share=False)
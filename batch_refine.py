@@ -0,0 +1,253 @@
+"""Refine a JSONL corpus of prompts against one or more metaprompts.
+
+Usage:
+    python batch_refine.py prompts.jsonl -o refined.jsonl -m comprehensive_multistage -c 16
+
+Each input line is either a JSON object with a prompt field (and optionally an
+id) or a bare JSON string. Results are appended to the output file as they
+finish, one line per (prompt, metaprompt) pair. The output file doubles as the
+checkpoint: rerunning the same command skips every pair already written
+without an error.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import tenacity
+
+from load_shedding import OverloadedError
+from logging_setup import new_request_id, setup_logging
+from prompt_refiner import AsyncPromptRefiner, create_refiner
+from variables import log_format, log_level
+
+logger = logging.getLogger(__name__)
+
+
+def read_prompts(path: str, prompt_field: str = "prompt", id_field: str = "id") -> Iterator[Tuple[str, str]]:
+    """Yield (id, prompt) pairs from a JSONL file; ids default to the line number.
+
+    A line that is not valid JSON or has no string prompt is logged and
+    skipped, so one bad record cannot stop a run or its resumes.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning("Skipping %s line %d: invalid JSON (%s)", path, line_number, e)
+                continue
+            if isinstance(record, str):
+                yield str(line_number), record
+            elif isinstance(record, dict) and isinstance(record.get(prompt_field), str):
+                yield str(record.get(id_field, line_number)), record[prompt_field]
+            else:
+                logger.warning("Skipping %s line %d: no %r string field", path, line_number, prompt_field)
+
+
+async def refine_one(
+    refiner: AsyncPromptRefiner,
+    prompt: str,
+    metaprompt: str,
+    use_cache: bool = True,
+    overload_retries: int = 5,
+) -> Tuple[Tuple[str, str, str, dict], Optional[str]]:
+    """Refine one prompt, returning the refine_prompt result and an error message or None.
+
+    Requests shed as overloaded are retried with jittered exponential
+    backoff, since the backend only asked us to slow down. A response
+    without a refined prompt, such as one that could not be parsed, is
+    redrawn once without the cache and is an error if it is still empty,
+    so a resumed run tries it again.
+    """
+    retrying = tenacity.AsyncRetrying(
+        retry=tenacity.retry_if_exception_type(OverloadedError),
+        wait=tenacity.wait_random_exponential(multiplier=1, max=30),
+        stop=tenacity.stop_after_attempt(overload_retries + 1),
+        reraise=True,
+    )
+    result: Tuple[str, str, str, dict] = ("", "", "", {})
+    try:
+        for cached in ((True, False) if use_cache else (False,)):
+            async for attempt in retrying:
+                with attempt:
+                    result = await refiner.refine_prompt(prompt, metaprompt, use_cache=cached, raise_errors=True)
+            if result[1].strip():
+                return result, None
+    except Exception as e:
+        return (f"Error: {str(e)}", "", "", {}), f"Error: {str(e)}"
+    return result, result[0] or "No refined prompt in the response"
+
+
+def load_checkpoint(path: str) -> Set[Tuple[str, str]]:
+    """Return the (id, metaprompt) pairs already refined successfully in an output file."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by a crash is simply redone
+            if not record.get("error"):
+                done.add((record["id"], record["metaprompt"]))
+    return done
+
+
+def drop_partial_line(path: str, block_size: int = 65536) -> None:
+    """Truncate a record left half-written by a crash, so new records start on a line of their own."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        if not end:
+            return
+        f.seek(end - 1)
+        if f.read(1) == b"\n":
+            return
+        position = end
+        while position > 0:
+            start = max(0, position - block_size)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        logger.warning("Dropping a partial record at the end of %s", path)
+        f.truncate(position)
+
+
+async def refine_batch(
+    refiner: AsyncPromptRefiner,
+    prompts: Iterable[Tuple[str, str]],
+    metaprompts: List[str],
+    output_path: str,
+    concurrency: int = 8,
+    use_cache: bool = True,
+    report_interval: float = 10.0,
+) -> Dict[str, Any]:
+    """Refine every prompt with every metaprompt, appending results to output_path.
+
+    At most `concurrency` refinements are in flight at once. Pairs already in
+    output_path are skipped, so an interrupted run can be resumed by calling
+    this again with the same arguments. Returns throughput statistics.
+    """
+    drop_partial_line(output_path)
+    done = load_checkpoint(output_path)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    stats = {"completed": 0, "errors": 0, "skipped": 0}
+    start = time.perf_counter()
+    last_report = start
+
+    with open(output_path, "a", encoding="utf-8") as output:
+
+        def report(final: bool = False) -> None:
+            elapsed = time.perf_counter() - start
+            rate = stats["completed"] / elapsed if elapsed else 0.0
+            label = "done" if final else "progress"
+            print(
+                f"[{label}] {stats['completed']} refined, {stats['errors']} errors, "
+                f"{stats['skipped']} skipped in {elapsed:.1f}s ({rate:.2f} prompts/s)",
+                file=sys.stderr,
+            )
+
+        async def worker() -> None:
+            nonlocal last_report
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                prompt_id, prompt, metaprompt = item
+                new_request_id()
+                started = time.perf_counter()
+                (evaluation, refined, explanation, full_response), error = await refine_one(
+                    refiner, prompt, metaprompt, use_cache=use_cache
+                )
+                output.write(json.dumps({
+                    "id": prompt_id,
+                    "metaprompt": metaprompt,
+                    "prompt": prompt,
+                    "initial_prompt_evaluation": evaluation if not error else "",
+                    "refined_prompt": refined,
+                    "explanation_of_refinements": explanation,
+                    "error": error,
+                    "elapsed": round(time.perf_counter() - started, 3),
+                }, ensure_ascii=False) + "\n")
+                output.flush()
+
+                stats["errors" if error else "completed"] += 1
+                now = time.perf_counter()
+                if now - last_report >= report_interval:
+                    last_report = now
+                    report()
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            for prompt_id, prompt in prompts:
+                for metaprompt in metaprompts:
+                    if (prompt_id, metaprompt) in done:
+                        stats["skipped"] += 1
+                        continue
+                    await queue.put((prompt_id, prompt, metaprompt))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+        report(final=True)
+
+    elapsed = time.perf_counter() - start
+    stats["elapsed"] = elapsed
+    stats["prompts_per_second"] = stats["completed"] / elapsed if elapsed else 0.0
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Refine a JSONL corpus of prompts in parallel.")
+    parser.add_argument("input", help="JSONL file of prompts")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file to append results to (also the resume checkpoint)")
+    parser.add_argument("-m", "--metaprompt", action="append", dest="metaprompts",
+                        help="metaprompt key to refine with; repeat for several (default: all loaded templates)")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="maximum refinements in flight")
+    parser.add_argument("--prompt-field", default="prompt", help="field holding the prompt in each input object")
+    parser.add_argument("--id-field", default="id", help="field holding the prompt id in each input object")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the response cache")
+    args = parser.parse_args(argv)
+
+    setup_logging(log_level, json_format=log_format == "json")
+    refiner = create_refiner(AsyncPromptRefiner)
+    metaprompts = args.metaprompts or list(refiner.meta_prompts)
+    unknown = [key for key in metaprompts if key not in refiner.meta_prompts]
+    if unknown:
+        parser.error(f"unknown metaprompt(s): {', '.join(unknown)}")
+
+    async def run() -> Dict[str, Any]:
+        try:
+            return await refine_batch(
+                refiner,
+                read_prompts(args.input, args.prompt_field, args.id_field),
+                metaprompts,
+                args.output,
+                concurrency=args.concurrency,
+                use_cache=not args.no_cache,
+            )
+        finally:
+            await refiner.close()
+
+    stats = asyncio.run(run())
+    sys.exit(1 if stats["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Check multi-endpoint load balancing offline against local stub servers.
+
+Usage: python benchmarks/bench_endpoints.py [--requests N] [--concurrency C]
+
+Three stub backends are started: a fast one, a slow one and one that answers
+every request with 503. The run shows the fast backend taking most of the
+load, the broken one being ejected, and, once it is repaired, the broken
+backend coming back into rotation after the ejection period.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from endpoint_pool import EndpointPool  # noqa: E402
+from prompt_refiner import AsyncPromptRefiner  # noqa: E402
+from mock_server import MockServer  # noqa: E402
+
+
+async def run_phase(refiner, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            return await refiner.apply_prompt(f"prompt {i} {time.time()}", "mock", use_cache=False)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    errors = sum(1 for result in results if result.startswith("Error"))
+    return elapsed, errors
+
+
+def print_servers(label, servers, pool, elapsed, requests, errors):
+    print(f"\n{label}: {requests} requests in {elapsed:.2f}s ({requests / elapsed:.1f} req/s), {errors} errors")
+    print(f"{'backend':<10}{'served':>8}{'failures':>10}{'ejected':>9}{'latency':>10}")
+    for (name, server), state in zip(servers, pool.snapshot()):
+        latency = f"{state['latency'] * 1000:.0f}ms" if state["latency"] is not None else "-"
+        print(f"{name:<10}{server.requests:>8}{state['failures']:>10}{str(state['ejected']):>9}{latency:>10}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--eject-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    servers = [
+        ("fast", MockServer(latency=0.02).start()),
+        ("slow", MockServer(latency=0.2).start()),
+        ("broken", MockServer(latency=0.01, status=503).start()),
+    ]
+    pool = EndpointPool([server.url for _, server in servers], eject_after=3, eject_seconds=args.eject_seconds)
+    refiner = AsyncPromptRefiner(pool, None, {}, {})
+    try:
+        elapsed, errors = await run_phase(refiner, args.requests, args.concurrency)
+        print_servers("Phase 1 (broken backend failing)", servers, pool, elapsed, args.requests, errors)
+
+        servers[2][1].status = None
+        await asyncio.sleep(args.eject_seconds)
+        before = [server.requests for _, server in servers]
+        elapsed, errors = await run_phase(refiner, args.requests, args.concurrency)
+        for (_, server), count in zip(servers, before):
+            server.requests -= count
+        print_servers("Phase 2 (broken backend repaired)", servers, pool, elapsed, args.requests, errors)
+    finally:
+        await refiner.close()
+        for _, server in servers:
+            server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
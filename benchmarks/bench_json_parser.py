@@ -0,0 +1,112 @@
+"""Per-response parse time of json_parser.extract_json against the legacy regex pipeline.
+
+Usage: python benchmarks/bench_json_parser.py [--repeat N]
+
+The legacy functions below are a copy of PromptRefiner._clean_json_string and the
+JSON branch of _parse_response as they were before the single-pass scanner, kept
+here only as a baseline.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_parser import extract_json  # noqa: E402
+
+
+def legacy_clean_json_string(content):
+    content = content.strip()
+    content = re.sub(r'\s+', ' ', content)
+    content = content.replace('•', '-')
+    content = content.replace('\\"', '"')
+    content = re.sub(r'(?<!\\)\\n', ' ', content)
+    content = re.sub(r',(\s*[}\]])', r'\1', content)
+    content = content.strip()
+    content = re.sub(r'\s+', ' ', content)
+    if content.count('{') > content.count('}'):
+        content += '}'
+    return content
+
+
+def legacy_parse_with_regex(content):
+    output = {}
+    for key in ["explanation_of_refinements", "initial_prompt_evaluation", "refined_prompt"]:
+        match = re.search(rf'"{key}":\s*"(.*?)"(?:,|\}})', content, re.DOTALL)
+        output[key] = match.group(1).strip() if match else ""
+    return output
+
+
+def legacy_parse(response_content):
+    json_match = re.search(r'<json>\s*(.*?)\s*</json>', response_content, re.DOTALL)
+    if not json_match:
+        return legacy_parse_with_regex(response_content)
+    json_str = legacy_clean_json_string(json_match.group(1))
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError:
+        json_str = re.sub(r'([{,])\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*:', r'\1"\2":', json_str)
+        try:
+            return legacy_parse('<json>' + json.dumps(json.loads(json_str)) + '</json>')
+        except json.JSONDecodeError:
+            return legacy_parse_with_regex(response_content)
+
+
+def make_response(size_kb, malformed):
+    """Build a model-style response of roughly size_kb kilobytes."""
+    paragraph = (
+        "You are an expert assistant. Explain the topic step by step, cite sources, "
+        "and use **markdown** headings.\nInclude \"quoted\" terms and a list:\n- item one\n- item two\n"
+    )
+    body = paragraph * max(1, size_kb * 1024 // len(paragraph))
+    refinements = [f"Refinement {i}: clarified scope and output format" for i in range(50)]
+    payload = json.dumps(
+        {
+            "initial_prompt_evaluation": "The prompt is vague about audience and format.",
+            "refined_prompt": body,
+            "explanation_of_refinements": refinements,
+        },
+        indent=2,
+    )
+    if malformed:
+        # Unquoted keys, a trailing comma and a missing closing brace
+        payload = payload.replace('"initial_prompt_evaluation":', "initial_prompt_evaluation:")
+        payload = payload.replace('"explanation_of_refinements":', "explanation_of_refinements:")
+        payload = payload.rstrip().rstrip("}").rstrip() + ",\n"
+    return f"Here is my analysis.\n\n<json>\n{payload}\n</json>\n"
+
+
+def time_call(fn, text, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per sample (best is reported)")
+    args = parser.parse_args()
+
+    print(f"{'sample':<22}{'size':>9}{'legacy ms':>12}{'scanner ms':>12}{'speedup':>9}  scanner ok")
+    for size_kb in (30, 60, 100):
+        for malformed in (False, True):
+            text = make_response(size_kb, malformed)
+            legacy_ms = time_call(legacy_parse, text, args.repeat)
+            scanner_ms = time_call(extract_json, text, args.repeat)
+            parsed = extract_json(text)
+            ok = isinstance(parsed, dict) and parsed.get("refined_prompt", "").startswith("You are")
+            name = f"{size_kb}KB {'malformed' if malformed else 'clean'}"
+            print(
+                f"{name:<22}{len(text) / 1024:>7.1f}KB{legacy_ms:>12.3f}{scanner_ms:>12.3f}"
+                f"{legacy_ms / scanner_ms:>8.1f}x  {ok}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Parse time and fallback path of PromptRefiner._parse_response over a fixed corpus.
+
+Usage: python benchmarks/bench_parser.py [--repeat N] [--update]
+
+benchmarks/parser_corpus/ holds real and synthetic model outputs, one file per
+case. manifest.json describes each case and records the parse path it takes
+(json, regex or error) and the start of the refined prompt it yields. The
+harness times every sample and flags any that no longer match the manifest,
+so the parser can be made faster without silently changing what it
+recovers. It exits with status 1 if anything changed. Pass --update to
+accept the current results as the new manifest.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_refiner import PromptRefiner  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus")
+MANIFEST_PATH = os.path.join(CORPUS_DIR, "manifest.json")
+PREFIX_LENGTH = 60
+
+
+def time_parse(refiner, text, repeat):
+    """Return (median seconds per parse, result, path)."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result, path = refiner._parse_response_detailed(text)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result, path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200, help="parses per sample; the median is reported")
+    parser.add_argument("--update", action="store_true", help="rewrite manifest.json with the current results")
+    args = parser.parse_args()
+
+    with open(MANIFEST_PATH, encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+    # Parsing never touches the network; the endpoint is only needed to build the refiner
+    refiner = PromptRefiner("http://127.0.0.1:9/v1/chat/completions", None, {}, {})
+
+    changed = 0
+    total = 0.0
+    print(f"{'sample':<32}{'bytes':>8}{'path':>7}{'median':>11}  status")
+    for name, expected in manifest.items():
+        with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as sample:
+            # _process_refine_response strips the content before parsing
+            text = sample.read().strip()
+        seconds, result, path = time_parse(refiner, text, args.repeat)
+        total += seconds
+        prefix = result["refined_prompt"][:PREFIX_LENGTH]
+        status = "ok"
+        if path != expected.get("path") or prefix != expected.get("refined_prompt_prefix"):
+            changed += 1
+            status = f"CHANGED (was {expected.get('path')}: {expected.get('refined_prompt_prefix', '')[:24]!r}...)"
+        print(f"{name:<32}{len(text.encode('utf-8')):>8}{path:>7}{seconds * 1e6:>9.1f}µs  {status}")
+        expected.update(path=path, refined_prompt_prefix=prefix)
+
+    print(f"\n{len(manifest)} samples, {total * 1e3:.3f}ms for one pass over the corpus, {changed} changed")
+    refiner.close()
+
+    if args.update:
+        with open(MANIFEST_PATH, "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, ensure_ascii=False)
+            manifest_file.write("\n")
+        print(f"Updated {MANIFEST_PATH}")
+    elif changed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
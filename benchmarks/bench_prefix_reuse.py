@@ -0,0 +1,90 @@
+"""Time to first token with and without prefix reuse against a stub server that models a KV prefix cache.
+
+Usage: python benchmarks/bench_prefix_reuse.py [--requests N] [--prefill-per-kb S] [--template-kb K]
+
+In the default message layout the user prompt is spliced into the middle of
+the metaprompt, so only the text before the placeholder can be served from a
+backend's prefix cache. With prefix_reuse the metaprompt is a static system
+message and the user prompt comes last, so the whole metaprompt is reused.
+The stub server charges --prefill-per-kb seconds for every KB of prompt it
+has not seen as a prefix before. The benchmark streams refinements of
+distinct prompts in both layouts and compares the time to the first content
+delta. --template-kb pads each metaprompt to roughly that size, to model the
+multi-KB templates usually loaded through PROMPT_TEMPLATES.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_server import MockServer  # noqa: E402
+from prompt_refiner import AsyncPromptRefiner  # noqa: E402
+from templates import PROMPT_PLACEHOLDER  # noqa: E402
+from variables import meta_prompts, metaprompt_explanations  # noqa: E402
+
+FILLER = "- Keep every instruction specific, testable and free of filler words.\n"
+
+
+def padded_templates(target_kb):
+    if not target_kb:
+        return dict(meta_prompts)
+    templates = {}
+    for key, template in meta_prompts.items():
+        missing = max(0, int(target_kb * 1024) - len(template))
+        head, marker, tail = template.partition(PROMPT_PLACEHOLDER)
+        # Pad after the placeholder, where most of a real metaprompt's instructions sit
+        templates[key] = head + marker + "\n" + FILLER * (missing // len(FILLER) + 1) + tail
+    return templates
+
+
+async def measure(prefix_reuse, templates, args):
+    ttfts = []
+    with MockServer(latency=args.latency, prefill_per_kb=args.prefill_per_kb) as server:
+        refiner = AsyncPromptRefiner(server.url, None, templates, metaprompt_explanations, prefix_reuse=prefix_reuse)
+        keys = list(templates)
+        try:
+            for i in range(args.requests):
+                _, messages = refiner._build_refine_messages(f"Prompt number {i}: write about topic {i * 7919}", keys[i % len(keys)])
+                started = time.perf_counter()
+                first = None
+                # Drain the whole stream so the stub never writes to a closed socket
+                async for _ in refiner._stream_api_request(messages, "mock", use_cache=False):
+                    first = first or time.perf_counter() - started
+                ttfts.append(first)
+        finally:
+            await refiner.close()
+    return ttfts
+
+
+def summary(ttfts):
+    ordered = sorted(ttfts)
+    return statistics.mean(ordered), ordered[len(ordered) // 2], ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.01, help="stub fixed delay before each response")
+    parser.add_argument("--prefill-per-kb", type=float, default=0.02, help="stub seconds per uncached prompt KB")
+    parser.add_argument("--template-kb", type=float, default=6.0, help="pad metaprompts to about this size (0 keeps them)")
+    args = parser.parse_args()
+
+    templates = padded_templates(args.template_kb)
+    sizes = ", ".join(f"{len(t) / 1024:.1f} KB" for t in templates.values())
+    print(f"{len(templates)} metaprompt(s) ({sizes}), {args.requests} streamed refinements per layout, "
+          f"prefill {args.prefill_per_kb * 1000:.0f}ms/KB, fixed latency {args.latency * 1000:.0f}ms")
+    print(f"{'layout':<16}{'mean TTFT':>11}{'p50':>10}{'p95':>10}")
+    results = {}
+    for label, prefix_reuse in (("prompt inline", False), ("prefix reuse", True)):
+        mean, p50, p95 = summary(await measure(prefix_reuse, templates, args))
+        results[label] = mean
+        print(f"{label:<16}{mean * 1000:>9.1f}ms{p50 * 1000:>8.1f}ms{p95 * 1000:>8.1f}ms")
+    print(f"\nPrefix reuse cuts mean time to first token by {1 - results['prefix reuse'] / results['prompt inline']:.0%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,216 @@
+"""Measure the refiner's own overhead against a local stub LLM server.
+
+Usage: python benchmarks/bench_refiner.py [--operations refine,route,apply,compare] [--concurrency 1,8,32]
+                                          [--requests N] [--latency S] [--stream] [--malformed-rate R]
+
+Each operation is driven through AsyncPromptRefiner at every concurrency
+level against benchmarks/mock_server.py. Every call is a cache miss and no
+local router is used, so each one makes a real HTTP round trip. The report
+gives p50/p95/p99 latency, and the overhead column is p50 minus the stub's
+configured latency: the time spent in this project rather than in the
+model (with --token-delay it also includes the simulated generation time).
+compare runs refine_candidates with every loaded metaprompt and two samples
+each, so its overhead shows what the concurrent fan-out adds over one call.
+Throughput, errors and memory are reported too. Each row is appended
+to --output as a JSON line tagged with the git commit, so runs on different
+commits can be compared. --compare prints the change against the latest
+matching row from another commit.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_server import MockServer  # noqa: E402
+from prompt_refiner import AsyncPromptRefiner  # noqa: E402
+from variables import meta_prompts, metaprompt_explanations  # noqa: E402
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "bench_refiner.jsonl")
+
+
+def git_revision():
+    """Return (short commit sha, whether the work tree has uncommitted changes)."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return sha, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def call(refiner, operation, prompt, stream, metaprompt):
+    """Run one operation; return (time to first output, error flag)."""
+    started = time.perf_counter()
+    if operation == "route":
+        analysis, _ = await refiner.automatic_metaprompt(prompt, use_cache=False)
+        return time.perf_counter() - started, analysis.startswith("Error")
+    if operation == "compare":
+        candidates = await refiner.refine_candidates(prompt, samples=2, meta_prompt_choices=list(refiner.meta_prompts),
+                                                     use_cache=False)
+        return time.perf_counter() - started, any(candidate.failed for candidate in candidates)
+    if operation == "refine":
+        if stream:
+            first = None
+            async for result in refiner.refine_prompt_stream(prompt, metaprompt, use_cache=False):
+                first = first or time.perf_counter() - started
+            return first, result[0].startswith("Error")
+        result = await refiner.refine_prompt(prompt, metaprompt, use_cache=False)
+        return time.perf_counter() - started, result[0].startswith("Error")
+    if stream:
+        first = None
+        async for output in refiner.apply_prompt_stream(prompt, "mock", use_cache=False):
+            first = first or time.perf_counter() - started
+        return first, output.startswith("Error")
+    output = await refiner.apply_prompt(prompt, "mock", use_cache=False)
+    return time.perf_counter() - started, output.startswith("Error")
+
+
+async def run_level(refiner, operation, requests, concurrency, stream, metaprompt, trace_memory):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, first_outputs, errors = [], [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            first, failed = await call(refiner, operation, f"Benchmark prompt {i} at {started}", stream, metaprompt)
+            latencies.append(time.perf_counter() - started)
+            first_outputs.append(first)
+            errors += failed
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    heap_peak = None
+    if trace_memory:
+        heap_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+
+    latencies.sort()
+    first_outputs.sort()
+    return {
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "first_output_p50": percentile(first_outputs, 0.50) if stream else None,
+        "throughput": requests / elapsed if elapsed else 0.0,
+        "errors": errors,
+        "elapsed": elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "heap_peak_mb": heap_peak,
+    }
+
+
+def previous_result(path, record):
+    """Latest row in path for the same benchmark configuration from a different commit."""
+    if not os.path.exists(path):
+        return None
+    keys = ("operation", "concurrency", "requests", "latency", "token_delay", "stream", "malformed_rate")
+    match = None
+    with open(path, encoding="utf-8") as results:
+        for line in results:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if row.get("commit") != record["commit"] and all(row.get(k) == record[k] for k in keys):
+                match = row
+    return match
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--operations", default="refine,route,apply", help="comma-separated: refine, route, apply, compare")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="calls per operation and concurrency level")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub seconds before each response starts")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="stub seconds between streamed chunks")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of refinements sent as broken JSON")
+    parser.add_argument("--stream", action="store_true", help="use the streaming refine/apply methods")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also report the Python heap peak (tracemalloc slows every call)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSONL file results are appended to")
+    parser.add_argument("--compare", action="store_true", help="show the change from the last run on another commit")
+    args = parser.parse_args()
+
+    operations = [op.strip() for op in args.operations.split(",") if op.strip()]
+    unknown = [op for op in operations if op not in ("refine", "route", "apply", "compare")]
+    if unknown:
+        parser.error(f"unknown operation(s): {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+    commit, dirty = git_revision()
+    metaprompt = next(iter(meta_prompts))
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+
+    print(f"commit {commit}{' (dirty)' if dirty else ''}, stub latency {args.latency * 1000:.0f}ms, "
+          f"{'streaming' if args.stream else 'non-streaming'}, malformed rate {args.malformed_rate:.0%}")
+    print(f"{'operation':<10}{'conc':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'overhead':>10}"
+          f"{'req/s':>9}{'errors':>8}{'rss MB':>9}" + ("  vs previous p50" if args.compare else ""))
+
+    with MockServer(latency=args.latency, token_delay=args.token_delay, malformed_rate=args.malformed_rate, seed=0) as server:
+        refiner = AsyncPromptRefiner(server.url, None, meta_prompts, metaprompt_explanations)
+        try:
+            for operation in operations:
+                for concurrency in levels:
+                    stats = await run_level(refiner, operation, args.requests, concurrency, args.stream,
+                                            metaprompt, args.trace_memory)
+                    record = {
+                        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                        "commit": commit,
+                        "dirty": dirty,
+                        "python": platform.python_version(),
+                        "operation": operation,
+                        "concurrency": concurrency,
+                        "requests": args.requests,
+                        "latency": args.latency,
+                        "token_delay": args.token_delay,
+                        "stream": args.stream,
+                        "malformed_rate": args.malformed_rate,
+                        **stats,
+                        "overhead_p50": stats["p50"] - args.latency,
+                    }
+                    comparison = ""
+                    if args.compare:
+                        previous = previous_result(args.output, record)
+                        if previous:
+                            change = (record["p50"] - previous["p50"]) / previous["p50"] if previous["p50"] else 0.0
+                            comparison = f"  {change:+.1%} vs {previous['commit']}"
+                    print(f"{operation:<10}{concurrency:>6}{stats['p50'] * 1000:>8.1f}ms{stats['p95'] * 1000:>8.1f}ms"
+                          f"{stats['p99'] * 1000:>8.1f}ms{record['overhead_p50'] * 1000:>8.1f}ms"
+                          f"{stats['throughput']:>9.1f}{stats['errors']:>8}{stats['peak_rss_mb']:>9.1f}{comparison}")
+                    with open(args.output, "a", encoding="utf-8") as results:
+                        results.write(json.dumps(record) + "\n")
+        finally:
+            await refiner.close()
+    print(f"Results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""Startup time, memory and lookup latency of a large template library, as JSON and as a TemplateStore.
+
+Usage: python benchmarks/bench_template_store.py [--templates N] [--template-kb K] [--lookups N] [--hot-size N]
+
+Generates N synthetic templates of about K KB each. It then measures:
+- Loading them the way PROMPT_TEMPLATES is loaded: parse the JSON, build
+  the UI lists and compile every template.
+- Opening the same library from a SQLite TemplateStore, which reads only
+  the metadata.
+Memory is the Python heap still held after loading, measured with
+tracemalloc. Lookups draw template keys from a skewed distribution, so a
+small hot set serves most of them, and report the mean time per lookup and
+the hot-set hit rate.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from template_store import TemplateStore  # noqa: E402
+from templates import compile_templates  # noqa: E402
+from variables import TemplateConfig  # noqa: E402
+
+
+def make_library(count, template_kb):
+    body = "- Follow this guideline carefully and state every assumption explicitly.\n"
+    padding = body * max(1, int(template_kb * 1024) // len(body))
+    return {
+        f"template_{i:05d}": {
+            "template": f"Metaprompt {i}.\n\nInitial Prompt: [Insert initial prompt here]\n\n{padding}",
+            "description": f"Refines prompts about topic {i}",
+            "examples": [f"Write about topic {i}"],
+        }
+        for i in range(count)
+    }
+
+
+def measure(load):
+    """Return (result, seconds, MB of heap still allocated after load)."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = load()
+    seconds = time.perf_counter() - started
+    held = tracemalloc.get_traced_memory()[0] / (1024 * 1024)
+    tracemalloc.stop()
+    return result, seconds, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--templates", type=int, default=5000)
+    parser.add_argument("--template-kb", type=float, default=4.0)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--hot-size", type=int, default=64)
+    args = parser.parse_args()
+
+    library = make_library(args.templates, args.template_kb)
+    templates_json = json.dumps(library)
+    keys = list(library)
+    rng = random.Random(0)
+    # Most traffic goes to a few popular templates
+    lookups = [keys[min(len(keys) - 1, int(rng.paretovariate(1.2)) - 1)] for _ in range(args.lookups)]
+
+    def load_json():
+        config = TemplateConfig(templates_json=templates_json)
+        return config, compile_templates(config.meta_prompts), config.metaprompt_list, config.examples
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "templates.sqlite")
+        TemplateStore.build(path, library)
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        del library
+
+        (_, compiled, _, _), json_seconds, json_mb = measure(load_json)
+
+        def load_store():
+            store = TemplateStore(path, hot_size=args.hot_size)
+            # The UI lists come from the metadata index alone
+            config = TemplateConfig(prompt_data=store.index)
+            return store, config.metaprompt_list, config.examples
+
+        (store, _, _), store_seconds, store_mb = measure(load_store)
+
+        started = time.perf_counter()
+        for key in lookups:
+            compiled[key].render(prompt="hello")
+        dict_lookup = (time.perf_counter() - started) / len(lookups)
+        started = time.perf_counter()
+        for key in lookups:
+            store.compiled(key).render(prompt="hello")
+        store_lookup = (time.perf_counter() - started) / len(lookups)
+        stats = store.stats()
+        store.close()
+
+    print(f"{args.templates} templates of ~{args.template_kb:g} KB ({len(templates_json) / (1024 * 1024):.1f} MB JSON, "
+          f"{size_mb:.1f} MB SQLite), hot set {args.hot_size}")
+    print(f"{'source':<16}{'startup':>10}{'heap MB':>10}{'lookup':>11}")
+    print(f"{'JSON':<16}{json_seconds * 1000:>8.1f}ms{json_mb:>10.1f}{dict_lookup * 1e6:>9.2f}µs")
+    print(f"{'TemplateStore':<16}{store_seconds * 1000:>8.1f}ms{store_mb:>10.1f}{store_lookup * 1e6:>9.2f}µs")
+    lookups_total = stats["hits"] + stats["misses"]
+    print(f"\nHot-set hit rate {stats['hits'] / lookups_total:.1%} over {lookups_total} lookups")
+
+
+if __name__ == "__main__":
+    main()
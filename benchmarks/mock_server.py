@@ -0,0 +1,242 @@
+"""Local stand-in for an OpenAI-compatible /v1/chat/completions server.
+
+Used by the benchmarks to exercise PromptRefiner offline. Start one from code
+with MockServer(...).start(), or from the shell:
+
+    python benchmarks/mock_server.py --port 11434 --latency 0.5 --token-delay 0.01 --malformed-rate 0.2
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+DEFAULT_REFINEMENT = (
+    "<json>\n"
+    "{\n"
+    '  "initial_prompt_evaluation": "The prompt is clear but lacks an output format.",\n'
+    '  "refined_prompt": "Explain the topic step by step for a general audience, ending with a short summary.",\n'
+    '  "explanation_of_refinements": "Added audience, structure and an explicit output format."\n'
+    "}\n"
+    "</json>"
+)
+
+# Refinements with the kinds of damage models produce; each takes a different parse path
+MALFORMED_REFINEMENTS = (
+    # Trailing commas
+    '{"initial_prompt_evaluation": "Vague.", "refined_prompt": "List three causes of inflation, with sources.",'
+    ' "explanation_of_refinements": "Asked for a count and sources.",}',
+    # Unquoted keys
+    '{initial_prompt_evaluation: "Vague.", refined_prompt: "List three causes of inflation, with sources.",'
+    ' explanation_of_refinements: "Asked for a count and sources."}',
+    # Cut off before the closing brace
+    'Here is the result:\n{"initial_prompt_evaluation": "Vague.", "refined_prompt": "List three causes of'
+    ' inflation, with sources.", "explanation_of_refinements": "Asked for a count',
+    # No JSON object at all; only the regex fallback finds the fields
+    '"initial_prompt_evaluation": "Vague.", "refined_prompt": "List three causes of inflation.",'
+    ' "explanation_of_refinements": "Asked for a count."',
+)
+
+DEFAULT_ROUTER = json.dumps({
+    "recommended_metaprompt": {
+        "key": "OpenAI Meta Prompt",
+        "name": "OpenAI Meta Prompt",
+        "description": "General purpose refinement",
+        "explanation": "The prompt is a general task.",
+        "similar_sample": "Write a story about a magical forest",
+        "customized_sample": "Write a short story about a city garden",
+    },
+    "alternative_recommendation": {"key": "", "name": "None", "explanation": "No close alternative."},
+})
+
+DEFAULT_COMPLETION = (
+    "## Answer\n\nHere is a short, well structured markdown answer to the prompt, with a list:\n\n"
+    "- first point\n- second point\n- third point\n"
+)
+
+
+class _BenchmarkHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Benchmarks open dozens of connections at once; with the default listen backlog of 5
+    # the kernel drops the extra SYNs and the client only retries them a second later
+    request_queue_size = 128
+
+
+class MockServer:
+    """Threaded stub server answering chat completions with canned content.
+
+    latency is the delay before the response starts and token_delay the pause
+    between streamed chunks. Without an explicit content the reply suits the
+    request: router JSON for the metaprompt router, markdown for applied
+    prompts, and otherwise a refinement, which is replaced by one of
+    MALFORMED_REFINEMENTS with probability malformed_rate. status, when set,
+    makes every request fail with that HTTP status instead.
+
+    prefill_per_kb simulates prompt processing: each request pays that many
+    seconds per KB of prompt not covered by the longest prefix it shares with
+    one of the last `prefix_slots` prompts, like a server's KV prefix cache.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 content: Optional[str] = None, status: Optional[int] = None,
+                 token_delay: float = 0.0, malformed_rate: float = 0.0, seed: Optional[int] = None,
+                 prefill_per_kb: float = 0.0, prefix_slots: int = 8):
+        self.latency = latency
+        self.content = content
+        self.status = status
+        self.token_delay = token_delay
+        self.malformed_rate = malformed_rate
+        self.prefill_per_kb = prefill_per_kb
+        self.prefix_slots = prefix_slots
+        self.requests = 0
+        self._prefixes = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _BenchmarkHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def prefill_seconds(self, payload: Dict[str, Any]) -> float:
+        """Simulated prompt processing time, charging only for the uncached part of the prompt."""
+        if not self.prefill_per_kb:
+            return 0.0
+        prompt = "".join(f"<{m.get('role')}>{m.get('content', '')}" for m in payload.get("messages", []))
+        with self._lock:
+            cached = max((len(os.path.commonprefix((prompt, seen))) for seen in self._prefixes), default=0)
+            self._prefixes = ([prompt] + [seen for seen in self._prefixes if seen != prompt])[:self.prefix_slots]
+        return (len(prompt) - cached) / 1024 * self.prefill_per_kb
+
+    def content_for(self, payload: Dict[str, Any]) -> str:
+        """Pick the reply content for a chat completion request."""
+        if self.content is not None:
+            return self.content
+        system = next((m.get("content", "") for m in payload.get("messages", []) if m.get("role") == "system"), "")
+        if "Prompt Selection" in system:
+            return DEFAULT_ROUTER
+        if "markdown formatting expert" in system:
+            return DEFAULT_COMPLETION
+        with self._lock:
+            malformed = self._random.random() < self.malformed_rate
+            return self._random.choice(MALFORMED_REFINEMENTS) if malformed else DEFAULT_REFINEMENT
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes; without this Nagle plus delayed ACKs add ~40ms
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.requests += 1
+                delay = server.latency + server.prefill_seconds(payload)
+                if delay:
+                    time.sleep(delay)
+                if server.status is not None:
+                    self._send_json(server.status, {"error": {"message": "mock failure"}})
+                    return
+                content = server.content_for(payload)
+                usage = {
+                    "prompt_tokens": len(json.dumps(payload.get("messages", []))) // 4,
+                    "completion_tokens": len(content) // 4,
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                if payload.get("stream"):
+                    include_usage = (payload.get("stream_options") or {}).get("include_usage")
+                    self._send_stream(content, usage if include_usage else None)
+                else:
+                    self._send_json(200, {
+                        "object": "chat.completion",
+                        "model": payload.get("model", "mock"),
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": usage,
+                    })
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, content, usage=None):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for start in range(0, len(content), 16):
+                    if start and server.token_delay:
+                        time.sleep(server.token_delay)
+                    self._write_event({"choices": [{"index": 0, "delta": {"content": content[start:start + 16]}}]})
+                if usage is not None:
+                    self._write_event({"choices": [], "usage": usage})
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+
+            def _write_event(self, body):
+                self._write_chunk(f"data: {json.dumps(body)}\n\n".encode("utf-8"))
+
+            def _write_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a stub OpenAI-compatible chat completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response starts")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of refinements sent as broken JSON")
+    parser.add_argument("--prefill-per-kb", type=float, default=0.0,
+                        help="seconds per KB of prompt not covered by the simulated prefix cache")
+    parser.add_argument("--status", type=int, help="fail every request with this HTTP status")
+    args = parser.parse_args()
+
+    server = MockServer(args.host, args.port, latency=args.latency, status=args.status,
+                        token_delay=args.token_delay, malformed_rate=args.malformed_rate,
+                        prefill_per_kb=args.prefill_per_kb)
+    print(f"Serving {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import math
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+from json_parser import extract_json
+from local_router import tokenize
+from templates import PROMPT_PLACEHOLDER
+
+# Markdown headings, bullets and numbered steps: the structure a good refinement adds
+_STRUCTURE_RE = re.compile(r"^\s*(#{1,6}\s|[-*•]\s|\d+[.)]\s)", re.MULTILINE)
+
+
+class Candidate(NamedTuple):
+    """One refinement produced by a metaprompt, with its ranking score."""
+    metaprompt: str
+    sample: int
+    initial_prompt_evaluation: str
+    refined_prompt: str
+    explanation_of_refinements: str
+    full_response: dict
+    seconds: float
+    score: float = 0.0
+    reason: str = ""
+
+    @property
+    def failed(self) -> bool:
+        return not self.refined_prompt
+
+
+def score_locally(prompt: str, candidate: Candidate) -> float:
+    """Score a refinement from 0 to 1 without a model call.
+
+    It rewards refinements that keep the original prompt's terms, expand
+    it, add structure and explain their changes. Failed refinements and
+    ones that leave the template placeholder in place score 0. This is a
+    heuristic for choosing between candidates from the same prompt, not an
+    absolute measure of quality.
+    """
+    refined = candidate.refined_prompt
+    if candidate.failed or PROMPT_PLACEHOLDER in refined:
+        return 0.0
+    terms = set(tokenize(prompt))
+    coverage = len(terms.intersection(tokenize(refined))) / len(terms) if terms else 1.0
+    # Growing the prompt up to about 8x its length counts fully
+    expansion = min(1.0, math.log(max(len(refined) / max(len(prompt), 1), 1.0)) / math.log(8))
+    structure = min(1.0, len(_STRUCTURE_RE.findall(refined)) / 5)
+    explained = 1.0 if str(candidate.explanation_of_refinements).strip() else 0.0
+    return round(0.4 * coverage + 0.25 * expansion + 0.2 * structure + 0.15 * explained, 4)
+
+
+def build_judge_messages(prompt: str, candidates: List[Candidate]) -> List[Dict[str, str]]:
+    """Build one request asking the model to score every candidate refinement."""
+    listing = "\n\n".join(
+        f"<candidate id=\"{i}\">\n{candidate.refined_prompt}\n</candidate>"
+        for i, candidate in enumerate(candidates, 1)
+    )
+    return [
+        {
+            "role": "system",
+            "content": "You are an expert prompt engineer who compares refined versions of a prompt."
+        },
+        {
+            "role": "user",
+            "content": f"""Initial prompt:
+{prompt}
+
+Refined candidates:
+
+{listing}
+
+Score each candidate from 0 to 10 for how well it keeps the intent of the initial prompt while making it clearer, more specific and more useful to a language model. Reply only with JSON in this format:
+{{"scores": [{{"candidate": 1, "score": 7, "reason": "One short sentence"}}]}}"""
+        }
+    ]
+
+
+def parse_judge_scores(content: str, count: int) -> List[Optional[tuple]]:
+    """Return (score from 0 to 1, reason) per candidate from the judge's reply, None where it gave none."""
+    scores: List[Optional[tuple]] = [None] * count
+    result = extract_json(content)
+    entries = result.get("scores") if isinstance(result, dict) else result
+    for entry in entries if isinstance(entries, list) else []:
+        try:
+            index = int(entry["candidate"]) - 1
+            score = min(max(float(entry["score"]) / 10, 0.0), 1.0)
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= index < count:
+            scores[index] = (score, str(entry.get("reason", "")))
+    return scores
+
+
+def rank(candidates: List[Candidate]) -> List[Candidate]:
+    """Best score first, failed candidates last; faster candidates win ties."""
+    return sorted(candidates, key=lambda candidate: (candidate.failed, -candidate.score, candidate.seconds))
@@ -0,0 +1,108 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class Endpoint:
+    """One OpenAI-compatible backend and the load/health state the pool keeps for it."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.latency: Optional[float] = None  # exponentially weighted moving average, seconds
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "latency": self.latency,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejected": self.ejected_until > time.monotonic(),
+        }
+
+
+class EndpointPool:
+    """Spread requests across several backends.
+
+    Each request goes to the healthy endpoint with the lowest
+    (outstanding requests + 1) * average latency, which is least-outstanding
+    selection weighted by how fast each backend has been. An endpoint with no
+    latency sample yet is assumed to be as fast as the average, so a new or
+    recovered endpoint is tried straight away without being flooded. After
+    `eject_after` consecutive failures an endpoint is taken out of rotation for
+    `eject_seconds`. It is then tried again, and one success puts it fully
+    back in rotation. If every endpoint is ejected, the one due back soonest
+    is used rather than failing outright.
+    """
+
+    def __init__(self, urls: List[str], eject_after: int = 3, eject_seconds: float = 30.0, latency_alpha: float = 0.3):
+        if not urls:
+            raise ValueError("At least one endpoint is required")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.latency_alpha = latency_alpha
+        self.name = ",".join(urls)
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Endpoint:
+        """Pick an endpoint for a request and count it as outstanding until release()."""
+        with self._lock:
+            now = time.monotonic()
+            healthy = [endpoint for endpoint in self.endpoints if endpoint.ejected_until <= now]
+            if healthy:
+                known = [e.latency for e in healthy if e.latency is not None]
+                default_latency = sum(known) / len(known) if known else 0.0
+                endpoint = min(
+                    healthy,
+                    key=lambda e: (
+                        (e.outstanding + 1) * (default_latency if e.latency is None else e.latency),
+                        e.consecutive_failures,
+                        e.outstanding,
+                        e.requests,
+                    ),
+                )
+            else:
+                endpoint = min(self.endpoints, key=lambda e: e.ejected_until)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint, latency: Optional[float] = None, success: Optional[bool] = True) -> None:
+        """Record the outcome of a request started with acquire().
+
+        success is True for a 2xx response, False for an endpoint failure and
+        None when the request says nothing about the endpoint's health (it
+        was cancelled, or rejected with a 4xx). Only a success clears the
+        failure count and puts an ejected endpoint back in rotation.
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if success is None:
+                return
+            if success:
+                endpoint.consecutive_failures = 0
+                endpoint.ejected_until = 0.0
+                if latency is not None:
+                    if endpoint.latency is None:
+                        endpoint.latency = latency
+                    else:
+                        endpoint.latency += self.latency_alpha * (latency - endpoint.latency)
+                return
+
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.eject_after:
+                endpoint.ejected_until = time.monotonic() + self.eject_seconds
+                # Forget the old latency so the endpoint is probed as soon as it returns
+                endpoint.latency = None
+
+    def snapshot(self) -> List[Dict[str, object]]:
+        """Return the current load and health of every endpoint."""
+        with self._lock:
+            return [endpoint.snapshot() for endpoint in self.endpoints]
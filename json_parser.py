@@ -0,0 +1,284 @@
+import json
+import re
+from typing import Any, Optional, Tuple
+
+# One token per match: a (possibly unterminated) string, a structural character,
+# a bare word, a run of whitespace, or anything else (numbers, stray text).
+_TOKEN_RE = re.compile(
+    r'''
+      (?P<string>"[^"\\]*(?:\\.[^"\\]*)*(?:(?P<quote>")|(?P<dangling>\\)?\Z))
+    | (?P<open>[{\[])
+    | (?P<close>[}\]])
+    | (?P<comma>,)
+    | (?P<colon>:)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_\-]*)
+    | (?P<space>\s+)
+    | (?P<other>[^"{}\[\],:A-Za-z_\s]+)
+    ''',
+    re.DOTALL | re.VERBOSE,
+)
+
+_CLOSERS = {"{": "}", "[": "]"}
+_LITERALS = frozenset(("true", "false", "null"))
+
+
+def find_json_span(text: str) -> Optional[Tuple[int, int]]:
+    """Locate the JSON payload: the <json> block if present, otherwise from the first brace."""
+    start = text.find("<json>")
+    if start != -1:
+        start += len("<json>")
+        end = text.find("</json>", start)
+        return start, end if end != -1 else len(text)
+    start = text.find("{")
+    if start == -1:
+        return None
+    return start, len(text)
+
+
+def repair_json(text: str, start: int = 0, end: Optional[int] = None) -> Optional[str]:
+    """Rewrite text[start:end] into parseable JSON in a single left-to-right pass.
+
+    Trailing commas are dropped, bare object keys are quoted, an unterminated
+    string is closed and any containers still open at the end are balanced.
+    Text before the first brace and after the top-level value is ignored.
+    Returns None when there is no object or array to repair.
+    """
+    end = len(text) if end is None else end
+    out = []
+    stack = []
+    expect_key = False
+    pending_comma = False
+
+    for match in _TOKEN_RE.finditer(text, start, end):
+        kind = match.lastgroup
+        token = match.group()
+
+        if not stack:
+            if kind == "string" and not out:
+                # A bare top-level string, possibly a nested JSON string
+                return _close_string(match)
+            if kind != "open":
+                continue  # skip leading prose until the first container opens
+        elif kind == "space":
+            out.append(token)
+            continue
+
+        if pending_comma:
+            pending_comma = False
+            if kind != "close":
+                out.append(",")
+
+        if kind == "open":
+            stack.append(token)
+            expect_key = token == "{"
+            out.append(token)
+        elif kind == "close":
+            if stack and _CLOSERS[stack[-1]] == token:
+                stack.pop()
+                out.append(token)
+            expect_key = False
+            if not stack:
+                break  # the top-level value is complete
+        elif kind == "comma":
+            pending_comma = True
+            expect_key = stack[-1] == "{"
+        elif kind == "colon":
+            out.append(token)
+            expect_key = False
+        elif kind == "string":
+            out.append(_close_string(match))
+        elif kind == "word":
+            if expect_key and stack[-1] == "{" and token not in _LITERALS:
+                out.append(f'"{token}"')
+            else:
+                out.append(token)
+        else:
+            out.append(token)
+
+    if not out:
+        return None
+    out.extend(_CLOSERS[opener] for opener in reversed(stack))
+    return "".join(out)
+
+
+def _close_string(match: "re.Match") -> str:
+    # Strings cut off by the end of the payload get their closing quote back,
+    # minus any half-written escape sequence
+    token = match.group()
+    if match.group("quote") is not None:
+        return token
+    if match.group("dangling") is not None:
+        token = token[:-1]
+    return token + '"'
+
+
+def extract_json(text: str) -> Optional[Any]:
+    """Find, repair and parse the JSON payload of a model response.
+
+    A payload that decodes to a string holding JSON (a nested JSON string) is
+    decoded once more. Returns None when no JSON can be recovered.
+    """
+    span = find_json_span(text)
+    if span is None:
+        return None
+    repaired = repair_json(text, *span)
+    if repaired is None:
+        return None
+    try:
+        parsed = json.loads(repaired, strict=False)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(parsed, str):
+        try:
+            parsed = json.loads(parsed, strict=False)
+        except json.JSONDecodeError:
+            pass
+    return parsed
+
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_STRUCTURAL = re.compile(r'[{}\[\]":,]')
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", '"': '"', "\\": "\\", "/": "/"}
+
+
+class IncrementalFieldParser:
+    """Track the values of top-level JSON string fields while a response streams in.
+
+    Each chunk passed to feed() is scanned once, with state (open containers,
+    string and escape position, the current key) carried over to the next chunk,
+    so feeding the whole response is linear in its size no matter how many
+    chunks it arrives in. value() returns the decoded text of a field so far,
+    which is what the UI shows while the <json> block is still being written.
+    It builds a new string of the whole field, so calling it after every
+    chunk is quadratic in the field length; callers should throttle it.
+    """
+
+    def __init__(self, fields: Tuple[str, ...] = ("refined_prompt",)):
+        self.fields = tuple(fields)
+        self._parts = {field: [] for field in self.fields}
+        self._values = {field: "" for field in self.fields}
+        self._complete = set()
+        self._stack = []
+        self._in_string = False
+        self._capture = None  # field whose value string is being read
+        self._key_parts = None  # characters of a string that may turn out to be a key
+        self._last_string = None
+        self._key = None
+        self._pending = ""  # escape sequence split across chunks
+        self._high_surrogate = None  # first half of a \uXXXX\uXXXX pair, waiting for the second
+
+    def feed(self, chunk: str) -> bool:
+        """Consume the next chunk; return True if any tracked value grew."""
+        text = self._pending + chunk if self._pending else chunk
+        self._pending = ""
+        changed = False
+        pos, length = 0, len(text)
+
+        while pos < length:
+            if self._in_string:
+                match = _STRING_SPECIAL.search(text, pos)
+                end = match.start() if match else length
+                if end > pos:
+                    changed |= self._emit(text[pos:end])
+                if match is None:
+                    break
+                if text[end] == '"':
+                    self._end_string()
+                    pos = end + 1
+                    continue
+                # Backslash escape; wait for the rest if it was cut off
+                if end + 1 >= length or (text[end + 1] == "u" and end + 6 > length):
+                    self._pending = text[end:]
+                    break
+                escape = text[end + 1]
+                pos = end + 6 if escape == "u" else end + 2
+                if escape != "u":
+                    changed |= self._emit(_ESCAPES.get(escape, escape))
+                    continue
+                try:
+                    code = int(text[end + 2:end + 6], 16)
+                except ValueError:
+                    continue
+                if 0xD800 <= code <= 0xDBFF:
+                    # Hold the high half of a surrogate pair, even across chunks, until its low half arrives
+                    changed |= self._emit("")
+                    self._high_surrogate = code
+                elif 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+                    high, self._high_surrogate = self._high_surrogate, None
+                    changed |= self._emit(chr(0x10000 + ((high - 0xD800) << 10) + (code - 0xDC00)))
+                else:
+                    changed |= self._emit("\ufffd" if 0xDC00 <= code <= 0xDFFF else chr(code))
+            else:
+                match = _STRUCTURAL.search(text, pos)
+                if match is None:
+                    break
+                char = match.group()
+                pos = match.end()
+                if char == '"':
+                    if self._stack:  # quotes in the prose around the JSON are ignored
+                        self._start_string()
+                elif char in "{[":
+                    self._stack.append(char)
+                    self._key = None
+                elif char in "}]":
+                    if self._stack:
+                        self._stack.pop()
+                    self._key = None
+                elif char == ":":
+                    if self._at_top_level():
+                        self._key = self._last_string
+                    self._last_string = None
+                else:  # ","
+                    self._key = None
+                    self._last_string = None
+
+        return changed
+
+    def value(self, field: str = "refined_prompt") -> str:
+        """Return the decoded value of field received so far."""
+        parts = self._parts[field]
+        if len(parts) > 1:
+            self._values[field] = "".join(parts)
+            parts[:] = [self._values[field]]
+        elif parts:
+            self._values[field] = parts[0]
+        return self._values[field]
+
+    def is_complete(self, field: str = "refined_prompt") -> bool:
+        """Return True once the closing quote of field's value has been seen."""
+        return field in self._complete
+
+    def _at_top_level(self) -> bool:
+        return len(self._stack) == 1 and self._stack[0] == "{"
+
+    def _start_string(self) -> None:
+        self._in_string = True
+        if self._key in self._parts and self._at_top_level():
+            self._capture = self._key
+        elif self._at_top_level():
+            self._key_parts = []
+        self._key = None
+
+    def _emit(self, piece: str) -> bool:
+        if self._high_surrogate is not None:
+            # A lone surrogate can't be encoded as UTF-8, so it becomes a replacement character
+            self._high_surrogate = None
+            piece = "\ufffd" + piece
+        if not piece:
+            return False
+        if self._capture is not None:
+            self._parts[self._capture].append(piece)
+            return True
+        if self._key_parts is not None:
+            self._key_parts.append(piece)
+        return False
+
+    def _end_string(self) -> None:
+        self._emit("")
+        self._in_string = False
+        if self._capture is not None:
+            self._complete.add(self._capture)
+            self._capture = None
+        elif self._key_parts is not None:
+            self._last_string = "".join(self._key_parts)
+            self._key_parts = None
@@ -0,0 +1,236 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+
+class OverloadedError(Exception):
+    """A request was shed before reaching the LLM backend."""
+
+
+class CircuitOpenError(OverloadedError):
+    """The circuit breaker is open because the backend keeps failing."""
+
+
+class ConcurrencyLimitError(OverloadedError):
+    """No concurrency slot became free within the wait timeout."""
+
+
+class CircuitBreaker:
+    """Fail fast while the LLM backend is unhealthy.
+
+    After `failure_threshold` consecutive failures the circuit opens and every
+    call is rejected for `recovery_timeout` seconds. It then goes half-open and
+    lets `half_open_max_calls` probe requests through. One success closes the
+    circuit again; a failure reopens it for another recovery period.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a request may be sent now."""
+        with self._lock:
+            if self.state == self.OPEN:
+                retry_in = self._opened_at + self.recovery_timeout - time.monotonic()
+                if retry_in > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(
+                        f"LLM backend is unavailable after repeated failures; retrying it in {math.ceil(retry_in)}s"
+                    )
+                self.state = self.HALF_OPEN
+                self._probes = 0
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_max_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError("LLM backend is recovering; a probe request is already in flight")
+                self._probes += 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        """Give back a half-open probe slot for a call that ended without a verdict."""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "rejected": self.rejected,
+            }
+
+
+class _Waiter:
+    """A caller queued for a concurrency slot; wake() is called once a slot is handed to it."""
+    __slots__ = ("granted", "wake")
+
+    def __init__(self, wake: Callable[[], None]):
+        self.granted = False
+        self.wake = wake
+
+
+def _set_done(future: "asyncio.Future") -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit on requests in flight to the LLM backend.
+
+    The limit grows by one per limit-worth of fast completions (additive
+    increase). It is multiplied by `backoff` (multiplicative decrease) when a
+    request is rejected as overloaded, times out, or takes longer than
+    `tolerance` times the baseline latency. The baseline tracks the fastest
+    recent completions. Decreases happen at most once per baseline latency, so
+    one burst of slow responses does not collapse the limit. Requests over the
+    limit wait in arrival order for a slot, for at most `wait_timeout`
+    seconds; only then are they shed, so a burst is smoothed out while a
+    backend that stays saturated still sheds load.
+    """
+
+    def __init__(self, initial_limit: int = 8, min_limit: int = 1, max_limit: int = 64,
+                 tolerance: float = 3.0, backoff: float = 0.7, wait_timeout: float = 30.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.wait_timeout = wait_timeout
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.in_flight = 0
+        self.rejected = 0
+        self.baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self._waiters: "deque[_Waiter]" = deque()
+        self._lock = threading.Lock()
+
+    def _try_take(self) -> bool:
+        # Callers already waiting go first
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def _grant(self) -> None:
+        """Hand free slots to waiting callers in arrival order."""
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            self.in_flight += 1
+            waiter.wake()
+
+    def _reject(self, waiter: _Waiter, timeout: float) -> None:
+        self._waiters.remove(waiter)
+        self.rejected += 1
+        raise ConcurrencyLimitError(
+            f"LLM backend is at its concurrency limit ({int(self.limit)} requests in flight, "
+            f"no slot free within {timeout:g}s); try again shortly"
+        )
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        """Take a slot, waiting up to timeout (default wait_timeout) seconds, or raise ConcurrencyLimitError."""
+        timeout = self.wait_timeout if timeout is None else timeout
+        with self._lock:
+            if self._try_take():
+                return
+            event = threading.Event()
+            waiter = _Waiter(event.set)
+            self._waiters.append(waiter)
+        event.wait(timeout)
+        with self._lock:
+            if not waiter.granted:
+                self._reject(waiter, timeout)
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> None:
+        """Like acquire, but waits without blocking the event loop."""
+        timeout = self.wait_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._try_take():
+                return
+            future = loop.create_future()
+            waiter = _Waiter(lambda: loop.call_soon_threadsafe(_set_done, future))
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait({future}, timeout=timeout)
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    self.in_flight -= 1
+                    self._grant()
+                else:
+                    self._waiters.remove(waiter)
+            raise
+        with self._lock:
+            if not waiter.granted:
+                self._reject(waiter, timeout)
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False) -> None:
+        """Return a slot, adjusting the limit from the request's outcome.
+
+        Pass the latency of a successful request, overloaded=True for a 429/503
+        or timeout, and neither for outcomes that say nothing about load.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self._adjust(latency, overloaded)
+            self._grant()
+
+    def _adjust(self, latency: Optional[float], overloaded: bool) -> None:
+        if overloaded:
+            self._decrease()
+            return
+        if latency is None:
+            return
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            # Let the baseline drift up slowly so it follows a slower model
+            self.baseline += 0.01 * (latency - self.baseline)
+        if latency > self.baseline * self.tolerance:
+            self._decrease()
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < (self.baseline or 0.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "waiting": len(self._waiters),
+                "rejected": self.rejected,
+                "baseline_latency": self.baseline,
+            }
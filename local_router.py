@@ -0,0 +1,133 @@
+import math
+import re
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional
+
+if TYPE_CHECKING:
+    import numpy as np
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be but by can do for from how i in into is it its me my of on or our "
+    "so that the their them then there these this to us was we what when where which who why "
+    "will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase text and split it into index terms, dropping stopwords."""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS]
+
+
+class RouterMatch(NamedTuple):
+    key: str
+    score: float
+    confidence: float
+    alternative_key: Optional[str]
+    alternative_score: float
+    similar_sample: str
+
+
+class LocalMetapromptRouter:
+    """BM25 index over each template's description and examples.
+
+    The index is built once from prompt_data; scoring a prompt is a handful of
+    NumPy adds over precomputed postings, so it runs in well under a millisecond
+    and lets automatic_metaprompt skip the LLM router when the winner is clear.
+    Confidence is the winner's relative margin over the runner-up, scaled by
+    the share of the prompt's terms the winning template contains.
+    """
+
+    def __init__(self, prompt_data: Dict[str, dict], min_confidence: float = 0.3, k1: float = 1.5, b: float = 0.75):
+        # NumPy is imported here rather than at module level so importing the refiner stays fast
+        import numpy as np
+
+        self.min_confidence = min_confidence
+        self.keys = list(prompt_data.keys())
+        self.examples = {
+            key: [
+                example[0] if isinstance(example, list) else example
+                for example in data.get("examples", [])
+            ]
+            for key, data in prompt_data.items()
+        }
+
+        documents = []
+        for key, data in prompt_data.items():
+            text = " ".join([key, data.get("name", ""), data.get("description", "")] + self.examples[key])
+            documents.append(Counter(tokenize(text)))
+        self._vocabularies = [frozenset(doc) for doc in documents]
+
+        n_docs = len(documents)
+        lengths = np.array([sum(doc.values()) for doc in documents], dtype=np.float32)
+        avg_length = float(lengths.mean()) if n_docs and lengths.sum() else 1.0
+        norms = k1 * (1 - b + b * lengths / avg_length)
+
+        postings: Dict[str, List[tuple]] = {}
+        for doc_id, doc in enumerate(documents):
+            for term, freq in doc.items():
+                postings.setdefault(term, []).append((doc_id, freq))
+
+        # Precompute the full BM25 contribution of each (term, document) pair
+        self._postings: Dict[str, tuple] = {}
+        for term, entries in postings.items():
+            doc_ids = np.array([doc_id for doc_id, _ in entries], dtype=np.intp)
+            freqs = np.array([freq for _, freq in entries], dtype=np.float32)
+            idf = math.log(1 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            weights = idf * freqs * (k1 + 1) / (freqs + norms[doc_ids])
+            self._postings[term] = (doc_ids, weights.astype(np.float32))
+
+    def score(self, prompt: str) -> "np.ndarray":
+        """Return the BM25 score of every template for the prompt."""
+        import numpy as np
+
+        scores = np.zeros(len(self.keys), dtype=np.float32)
+        for term in tokenize(prompt):
+            posting = self._postings.get(term)
+            if posting is not None:
+                doc_ids, weights = posting
+                scores[doc_ids] += weights
+        return scores
+
+    def route(self, prompt: str) -> Optional[RouterMatch]:
+        """Return the best template for the prompt, or None when nothing matches."""
+        if not self.keys:
+            return None
+        scores = self.score(prompt)
+        order = (-scores).argsort()
+        best = int(order[0])
+        best_score = float(scores[best])
+        if best_score <= 0:
+            return None
+
+        alternative_key, alternative_score = None, 0.0
+        if len(order) > 1:
+            alternative_key = self.keys[int(order[1])]
+            alternative_score = float(scores[int(order[1])])
+
+        # A clear margin only counts as far as the winner explains the prompt: one incidental
+        # shared term in a long prompt wins by a wide margin but says little about intent
+        terms = set(tokenize(prompt))
+        coverage = len(terms & self._vocabularies[best]) / len(terms)
+        key = self.keys[best]
+        return RouterMatch(
+            key=key,
+            score=best_score,
+            confidence=coverage * (best_score - alternative_score) / best_score,
+            alternative_key=alternative_key,
+            alternative_score=alternative_score,
+            similar_sample=self._closest_example(key, prompt),
+        )
+
+    def select(self, prompt: str) -> Optional[RouterMatch]:
+        """Return the best match only if it clears the confidence threshold."""
+        match = self.route(prompt)
+        if match is None or match.confidence < self.min_confidence:
+            return None
+        return match
+
+    def _closest_example(self, key: str, prompt: str) -> str:
+        terms = set(tokenize(prompt))
+        examples = self.examples.get(key) or [""]
+        return max(examples, key=lambda example: len(terms.intersection(tokenize(example))))
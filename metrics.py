@@ -0,0 +1,263 @@
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from load_shedding import OverloadedError
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+# (metric name, type, help, [(labels, value), ...]) as returned by collectors
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels, as Prometheus expects."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts with a final +Inf slot, sum)
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def count(self, **labels: str) -> int:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    bucket_labels = _format_labels({**labels, "le": _format_value(bound)})
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total[0])}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """A set of counters and histograms, plus collectors that report gauges when scraped."""
+
+    def __init__(self):
+        self._metrics: List[object] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        """Register a callable returning metric families that are read at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class CallTracker:
+    """Context manager timing one LLM call, its retries and time to first token.
+
+    The outcome label comes from how the block exits: ok, shed (OverloadedError),
+    cancelled (GeneratorExit, CancelledError) or error.
+    """
+
+    def __init__(self, metrics: "RefinerMetrics", mode: str):
+        self.metrics = metrics
+        self.mode = mode
+        self.attempts = 1
+        self._started = 0.0
+        self._first_token = False
+
+    def __enter__(self) -> "CallTracker":
+        self._started = time.perf_counter()
+        return self
+
+    def first_token(self) -> None:
+        if not self._first_token:
+            self._first_token = True
+            self.metrics.ttft_seconds.observe(time.perf_counter() - self._started)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            outcome = "ok"
+        elif issubclass(exc_type, OverloadedError):
+            outcome = "shed"
+        elif not issubclass(exc_type, Exception):
+            outcome = "cancelled"
+        else:
+            outcome = "error"
+        duration = time.perf_counter() - self._started
+        self.metrics.request_seconds.observe(duration, mode=self.mode, outcome=outcome)
+        logger.info(
+            "LLM %s call %s in %.3fs (%d attempt%s)", self.mode, outcome, duration, self.attempts,
+            "" if self.attempts == 1 else "s",
+            extra={"mode": self.mode, "outcome": outcome, "duration_s": round(duration, 6), "attempts": self.attempts},
+        )
+        if self.attempts > 1:
+            self.metrics.retries.inc(self.attempts - 1, mode=self.mode)
+        if outcome in ("shed", "error"):
+            self.metrics.errors.inc(stage=self.mode if outcome == "error" else "shed")
+
+
+class RefinerMetrics(MetricsRegistry):
+    """The hot-path instruments of a PromptRefiner."""
+
+    def __init__(self):
+        super().__init__()
+        self.request_seconds = self.histogram(
+            "prompt_refiner_llm_request_seconds",
+            "LLM call latency including retries, by mode (complete or stream) and outcome.",
+            ("mode", "outcome"),
+        )
+        self.ttft_seconds = self.histogram(
+            "prompt_refiner_llm_time_to_first_token_seconds",
+            "Time from starting a streaming LLM call to its first content delta.",
+        )
+        self.parse_seconds = self.histogram(
+            "prompt_refiner_parse_seconds",
+            "Time spent parsing a refinement response, by parse path.",
+            ("path",),
+            FAST_BUCKETS,
+        )
+        self.validation_seconds = self.histogram(
+            "prompt_refiner_validation_seconds",
+            "Time spent validating a parsed refinement with LLMResponse.",
+            buckets=FAST_BUCKETS,
+        )
+        self.retries = self.counter(
+            "prompt_refiner_llm_retries_total", "LLM attempts beyond the first, by mode.", ("mode",)
+        )
+        self.parses = self.counter(
+            "prompt_refiner_parse_total", "Refinement responses parsed, by path (json, regex or error).", ("path",)
+        )
+        self.errors = self.counter(
+            "prompt_refiner_errors_total",
+            "Failures by stage (complete, stream, shed, parse, validation).",
+            ("stage",),
+        )
+        self.tokens = self.counter(
+            "prompt_refiner_llm_tokens_total", "Tokens reported in API usage, by type (prompt or completion).", ("type",)
+        )
+
+    def track_call(self, mode: str) -> CallTracker:
+        """Return a context manager that times one LLM call."""
+        return CallTracker(self, mode)
+
+    def record_usage(self, usage: Optional[Dict[str, object]]) -> None:
+        """Count the token usage reported by an API response, if any."""
+        if not isinstance(usage, dict):
+            return
+        for kind in ("prompt", "completion"):
+            count = usage.get(f"{kind}_tokens")
+            if isinstance(count, (int, float)):
+                self.tokens.inc(count, type=kind)
+
+
+def start_metrics_server(registry: MetricsRegistry, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve registry.render() at /metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    return server
@@ -1,12 +1,49 @@
+import asyncio
+import contextvars
+import importlib.util
 import json
+import logging
 import re
-from typing import Optional, Dict, Any, Union, List, Tuple
-from pydantic import BaseModel, Field, field_validator
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from typing import Optional, Dict, Any, Union, List, Mapping, NamedTuple, Tuple, Iterator, AsyncIterator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 import httpx
-from variables import *
-from metaprompt_router import metaprompt_router
+from variables import (
+    TemplateConfig, template_config, api_endpoints, api_key, endpoint_eject_after, endpoint_eject_seconds, prompt_refiner_model,
+    http_max_connections, http_max_keepalive_connections, http_keepalive_expiry, http2_enabled,
+    http_connect_timeout, http_read_timeout, http_write_timeout, http_pool_timeout,
+    retry_max_attempts, retry_base_delay, retry_max_delay, retry_deadline,
+    breaker_failure_threshold, breaker_recovery_timeout, concurrency_initial_limit, concurrency_min_limit,
+    concurrency_max_limit, concurrency_latency_tolerance, concurrency_wait_timeout, prefix_reuse, llm_keep_alive, llm_cache_prompt,
+    cache_enabled, cache_max_entries, cache_ttl, cache_path, cache_sampled, coalesce_requests,
+    local_router_enabled, local_router_min_confidence, router_compact
+)
+from metaprompt_router import get_metaprompt_router
+from response_cache import ResponseCache
+from local_router import LocalMetapromptRouter
+from endpoint_pool import EndpointPool
+from retry_policy import RetryPolicy, StreamInterruptedError
+from load_shedding import CircuitBreaker, AdaptiveConcurrencyLimiter, OverloadedError
+from single_flight import SingleFlight
+from metrics import RefinerMetrics
+from templates import CompiledTemplate, compile_templates
+from template_store import TemplateStore
+from candidates import Candidate, build_judge_messages, parse_judge_scores, rank, score_locally
+from json_parser import extract_json, find_json_span, IncrementalFieldParser
+
+logger = logging.getLogger(__name__)
+
+# Stands in for the initial prompt when the metaprompt is sent as a static system message
+PROMPT_IN_USER_MESSAGE = "(the initial prompt is given in the user message)"
+
 
 class LLMResponse(BaseModel):
+    # Build the validator on first use instead of at import
+    model_config = ConfigDict(defer_build=True)
+
     initial_prompt_evaluation: str = Field(..., description="Evaluation of the initial prompt")
     refined_prompt: str = Field(..., description="The refined version of the prompt")
     explanation_of_refinements: Union[str, List[str]] = Field(..., description="Explanation of the refinements made")
@@ -31,135 +68,512 @@ class LLMResponse(BaseModel):
                    for item in v if isinstance(item, str)]
         return v
 
+class PoolWaitStats:
+    """Time requests spend waiting for a connection from the HTTP pool."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "count": self.count,
+                "total_seconds": self.total_seconds,
+                "mean_seconds": self.total_seconds / self.count if self.count else 0.0,
+                "max_seconds": self.max_seconds,
+            }
+
+
+class TemplateSnapshot(NamedTuple):
+    """One consistent set of templates and the routing state built from them.
+
+    A refiner swaps in a whole new snapshot when its templates are reloaded.
+    A call reads the snapshot once, so it finishes on the templates it
+    started with.
+    """
+    version: int
+    meta_prompts: Mapping[str, str]
+    templates: Mapping[str, CompiledTemplate]
+    metaprompt_explanations: Dict[str, str]
+    router_prompt: str
+    router_template: CompiledTemplate
+    router: Optional[LocalMetapromptRouter]
+
+
 class PromptRefiner:
-    def __init__(self, api_endpoint: str, api_key: Optional[str], meta_prompts: dict, metaprompt_explanations: dict):
-        self.api_endpoint = api_endpoint
+    # Least seconds between partial results yielded while a refinement or applied prompt streams
+    stream_update_interval = 0.05
+
+    def __init__(self, api_endpoint: Union[str, List[str], EndpointPool], api_key: Optional[str], meta_prompts: dict, metaprompt_explanations: dict,
+                 cache: Optional[ResponseCache] = None, router: Optional[LocalMetapromptRouter] = None,
+                 router_prompt: Optional[str] = None, limits: Optional[httpx.Limits] = None,
+                 timeout: Optional[httpx.Timeout] = None, http2: bool = False,
+                 retry_policy: Optional[RetryPolicy] = None, breaker: Optional[CircuitBreaker] = None,
+                 limiter: Optional[AdaptiveConcurrencyLimiter] = None, single_flight: Optional[SingleFlight] = None,
+                 prefix_reuse: bool = False, keep_alive: Optional[str] = None, cache_prompt: Optional[bool] = None):
+        if isinstance(api_endpoint, EndpointPool):
+            self.endpoints = api_endpoint
+        else:
+            self.endpoints = EndpointPool([api_endpoint] if isinstance(api_endpoint, str) else list(api_endpoint))
+        self.api_endpoint = self.endpoints.endpoints[0].url
         self.api_key = api_key
-        self.client = httpx.Client(timeout=120)
-        self.meta_prompts = meta_prompts
-        self.metaprompt_explanations = metaprompt_explanations
+        self.limits = limits or httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        self.timeout = timeout or httpx.Timeout(120)
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requested but the h2 package is not installed (pip install 'httpx[http2]'); using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.pool_wait = PoolWaitStats()
+        self.metrics = RefinerMetrics()
+        self.metrics.add_collector(self._collect_metrics)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker
+        self.limiter = limiter
+        self.client = self._create_client()
+        # Send each metaprompt as a static system message with the user prompt last,
+        # so backends with prefix (KV) caching reuse the metaprompt across requests
+        self.prefix_reuse = prefix_reuse
+        self.keep_alive = keep_alive
+        self.cache_prompt = cache_prompt
+        self.cache = cache
+        self.single_flight = single_flight
+        self._templates_lock = threading.Lock()
+        self.snapshot: Optional[TemplateSnapshot] = None
+        self.set_templates(meta_prompts, metaprompt_explanations, router_prompt=router_prompt, router=router)
+
+    def set_templates(self, meta_prompts: Mapping[str, str], metaprompt_explanations: dict, router_prompt: Optional[str] = None,
+                      router: Optional[LocalMetapromptRouter] = None) -> TemplateSnapshot:
+        """Swap in a new set of templates; calls already running keep the previous set."""
+        # Without an explicit router prompt, describe the loaded templates from their explanations
+        router_prompt = router_prompt or get_metaprompt_router(
+            {key: {"description": explanation} for key, explanation in metaprompt_explanations.items()},
+            compact=True
+        )
+        with self._templates_lock:
+            self.snapshot = TemplateSnapshot(
+                version=self.snapshot.version + 1 if self.snapshot else 1,
+                meta_prompts=meta_prompts,
+                # A store compiles each template when it is first used
+                templates=(
+                    meta_prompts.compiled_templates if isinstance(meta_prompts, TemplateStore)
+                    else compile_templates(meta_prompts)
+                ),
+                metaprompt_explanations=metaprompt_explanations,
+                router_prompt=router_prompt,
+                router_template=CompiledTemplate(router_prompt),
+                router=router,
+            )
+        return self.snapshot
 
-    def _make_api_request(self, messages: List[Dict[str, str]], model: str, temperature: float = 0.8, max_tokens: int = 3000) -> Dict:
-        """Make a request to the OpenAI-compatible API endpoint with retry logic."""
+    @property
+    def meta_prompts(self) -> Mapping[str, str]:
+        return self.snapshot.meta_prompts
+
+    @property
+    def templates(self) -> Mapping[str, CompiledTemplate]:
+        return self.snapshot.templates
+
+    @property
+    def metaprompt_explanations(self) -> Dict[str, str]:
+        return self.snapshot.metaprompt_explanations
+
+    @property
+    def router(self) -> Optional[LocalMetapromptRouter]:
+        return self.snapshot.router
+
+    @property
+    def router_prompt(self) -> str:
+        return self.snapshot.router_prompt
+
+    def _collect_metrics(self):
+        """Report pool, cache, load-shedding and endpoint state as gauges at scrape time."""
+        pool_wait = self.pool_wait.snapshot()
+        yield ("prompt_refiner_http_pool_wait_seconds_total", "counter",
+               "Total time requests waited for an HTTP connection.", [({}, pool_wait["total_seconds"])])
+        yield ("prompt_refiner_http_pool_waits_total", "counter",
+               "Requests that took a connection from the HTTP pool.", [({}, pool_wait["count"])])
+        yield ("prompt_refiner_http_pool_wait_max_seconds", "gauge",
+               "Longest wait for an HTTP connection.", [({}, pool_wait["max_seconds"])])
+        if self.cache is not None:
+            cache = self.cache.stats()
+            yield ("prompt_refiner_cache_lookups_total", "counter", "Response cache lookups by result.",
+                   [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])])
+            yield ("prompt_refiner_cache_entries", "gauge", "Responses held in memory by the cache.",
+                   [({}, cache["entries"])])
+        if isinstance(self.meta_prompts, TemplateStore):
+            store = self.meta_prompts.stats()
+            yield ("prompt_refiner_template_loads_total", "counter", "Template lookups by whether the text was in memory.",
+                   [({"result": "hit"}, store["hits"]), ({"result": "miss"}, store["misses"])])
+            yield ("prompt_refiner_templates_in_memory", "gauge", "Templates held in the store's hot set.",
+                   [({}, store["hot"])])
+        if self.single_flight is not None:
+            flights = self.single_flight.stats()
+            yield ("prompt_refiner_coalesced_calls_total", "counter",
+                   "Calls served by an identical request already in flight.", [({}, flights["saved"])])
+        if self.breaker is not None:
+            breaker = self.breaker.snapshot()
+            yield ("prompt_refiner_circuit_open", "gauge", "1 while the circuit breaker is not closed.",
+                   [({"state": breaker["state"]}, int(breaker["state"] != CircuitBreaker.CLOSED))])
+            yield ("prompt_refiner_circuit_rejected_total", "counter", "Calls rejected by the circuit breaker.",
+                   [({}, breaker["rejected"])])
+        if self.limiter is not None:
+            limiter = self.limiter.snapshot()
+            yield ("prompt_refiner_concurrency_limit", "gauge", "Current adaptive concurrency limit.",
+                   [({}, limiter["limit"])])
+            yield ("prompt_refiner_concurrency_in_flight", "gauge", "LLM requests in flight.",
+                   [({}, limiter["in_flight"])])
+            yield ("prompt_refiner_concurrency_waiting", "gauge", "LLM requests waiting for a concurrency slot.",
+                   [({}, limiter["waiting"])])
+            yield ("prompt_refiner_concurrency_rejected_total", "counter", "Calls rejected by the concurrency limiter.",
+                   [({}, limiter["rejected"])])
+        endpoints = self.endpoints.snapshot()
+        yield ("prompt_refiner_endpoint_outstanding", "gauge", "Requests in flight per endpoint.",
+               [({"endpoint": e["url"]}, e["outstanding"]) for e in endpoints])
+        yield ("prompt_refiner_endpoint_latency_seconds", "gauge", "Moving average latency per endpoint.",
+               [({"endpoint": e["url"]}, e["latency"]) for e in endpoints])
+        yield ("prompt_refiner_endpoint_failures_total", "counter", "Failed attempts per endpoint.",
+               [({"endpoint": e["url"]}, e["failures"]) for e in endpoints])
+        yield ("prompt_refiner_endpoint_ejected", "gauge", "1 while an endpoint is out of rotation.",
+               [({"endpoint": e["url"]}, int(e["ejected"])) for e in endpoints])
+
+    def _create_client(self) -> httpx.Client:
+        """Create the HTTP client used for API requests."""
+        return httpx.Client(limits=self.limits, timeout=self.timeout, http2=self.http2)
+
+    def _pool_wait_tracer(self):
+        """Return an httpcore trace hook that records how long the request waited for a connection.
+
+        The pool hands out a connection before the first traced event (connecting a
+        new socket or sending headers on a reused one), so the time until that
+        event is the pool wait.
+        """
+        started = time.perf_counter()
+        recorded = False
+
+        def trace(event_name: str, info: Dict[str, Any]) -> None:
+            nonlocal recorded
+            if not recorded:
+                recorded = True
+                self.pool_wait.record(time.perf_counter() - started)
+
+        return trace
+
+    def _build_headers(self) -> Dict[str, str]:
+        """Build the request headers, including the optional API key."""
         headers = {"Content-Type": "application/json"}
         if self.api_key:
             headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
 
+    def _build_payload(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int) -> Dict[str, Any]:
+        """Build the chat completion request body, with any model residency and prompt cache hints."""
         payload = {
             "model": model,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens
         }
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive  # Ollama: how long to keep the model loaded
+        if self.cache_prompt is not None:
+            payload["cache_prompt"] = self.cache_prompt  # llama.cpp server: reuse the KV cache of a matching prefix
+        return payload
 
-        max_retries = 3
-        retry_delay = 1.0
-        last_error = None
+    def _is_endpoint_failure(self, error: Exception) -> bool:
+        """Whether an error says the backend is unhealthy, as opposed to a bad request."""
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code >= 500
+        return True
 
-        for attempt in range(max_retries):
+    def _admit(self) -> None:
+        """Wait for a concurrency slot; shed the attempt with an OverloadedError if the circuit is open or none frees up in time."""
+        if self.breaker is not None:
+            self.breaker.before_call()
+        if self.limiter is not None:
             try:
-                response = self.client.post(
-                    self.api_endpoint,
-                    headers=headers,
-                    json=payload,
-                    timeout=120  # Explicit timeout
-                )
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPError as e:
-                last_error = e
-                if attempt < max_retries - 1:  # Don't sleep on the last attempt
-                    import time
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                continue
+                self.limiter.acquire()
+            except OverloadedError:
+                if self.breaker is not None:
+                    self.breaker.release_probe()
+                raise
+
+    def _settle(self, latency: Optional[float] = None, error: Optional[BaseException] = None) -> None:
+        """Report an admitted attempt's outcome to the circuit breaker and concurrency limiter.
+
+        An attempt with neither a latency nor an error (cancelled before the
+        response arrived) counts as no verdict either way.
+        """
+        status = error.response.status_code if isinstance(error, httpx.HTTPStatusError) else None
+        overloaded = status in (429, 503) or isinstance(error, httpx.TimeoutException)
+        if self.breaker is not None:
+            if error is not None and self._is_endpoint_failure(error):
+                self.breaker.record_failure()
+            elif (error is None and latency is None) or status == 429:
+                self.breaker.release_probe()
+            else:
+                self.breaker.record_success()
+        if self.limiter is not None:
+            self.limiter.release(None if error is not None else latency, overloaded=overloaded)
+
+    def _request_keys(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int,
+                      use_cache: bool) -> Tuple[Optional[str], Optional[str]]:
+        """Return the (response cache, single-flight) keys for a request; None where that layer does not apply.
+
+        Both are the same hash of the request, but use_cache=False opts out of
+        sharing an in-flight response as well as a stored one. Sampled
+        requests are only stored if the cache accepts their temperature, so
+        asking again gives a new draw.
+        """
+        if not use_cache or (self.cache is None and self.single_flight is None):
+            return None, None
+        key = ResponseCache.make_key(self.endpoints.name, model, messages, temperature, max_tokens)
+        cached = self.cache is not None and self.cache.accepts(temperature)
+        return (key if cached else None), (key if self.single_flight is not None else None)
+
+    def _completion_from_content(self, content: str) -> Dict[str, Any]:
+        """Wrap streamed content in the shape of a non-streaming chat completion."""
+        return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+    def _make_api_request(self, messages: List[Dict[str, str]], model: str, temperature: float = 0.8, max_tokens: int = 3000,
+                          use_cache: bool = True) -> Dict:
+        """Make a request to the OpenAI-compatible API endpoint.
+
+        Repeats are served from the response cache, and identical concurrent
+        requests share one upstream call through the single-flight layer.
+        """
+        cache_key, flight_key = self._request_keys(messages, model, temperature, max_tokens, use_cache)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        payload = self._build_payload(messages, model, temperature, max_tokens)
+        if flight_key is not None:
+            return self.single_flight.do(flight_key, lambda: self._fetch(payload, cache_key))
+        return self._fetch(payload, cache_key)
+
+    def _fetch(self, payload: Dict[str, Any], cache_key: Optional[str]) -> Dict:
+        """Send a request and store the response in the cache."""
+        response = self._send_request(payload)
+        if cache_key is not None:
+            self.cache.set(cache_key, response)
+        return response
+
+    def _send_request(self, payload: Dict[str, Any]) -> Dict:
+        """Send a chat completion request, retrying as the retry policy allows."""
+        headers = self._build_headers()
+        retrying = self.retry_policy.retrying()
+        with self.metrics.track_call("complete") as call:
+            try:
+                for attempt in retrying:
+                    with attempt:
+                        call.attempts = attempt.retry_state.attempt_number
+                        timeout = self.retry_policy.attempt_timeout(self.timeout, attempt.retry_state)
+                        result = self._send_once(payload, headers, timeout)
+                        self.metrics.record_usage(result.get("usage"))
+                        return result
+            except OverloadedError:
+                raise
             except Exception as e:
-                last_error = e
-                break
+                attempts = retrying.statistics.get('attempt_number', 1)
+                logger.error("API request failed after %d attempts: %s", attempts, e)
+                raise Exception(f"API request failed after {attempts} attempts. Last error: {str(e)}") from e
+
+    def _send_once(self, payload: Dict[str, Any], headers: Dict[str, str], timeout: httpx.Timeout) -> Dict:
+        """Send one attempt to the endpoint chosen by the endpoint pool."""
+        self._admit()
+        endpoint = self.endpoints.acquire()
+        request_started = time.perf_counter()
+        try:
+            response = self.client.post(
+                endpoint.url,
+                headers=headers,
+                json=payload,
+                timeout=timeout,
+                extensions={"trace": self._pool_wait_tracer()}
+            )
+            response.raise_for_status()
+            result = response.json()
+        except Exception as e:
+            self.endpoints.release(endpoint, success=False if self._is_endpoint_failure(e) else None)
+            self._settle(error=e)
+            raise
+        latency = time.perf_counter() - request_started
+        self.endpoints.release(endpoint, latency)
+        self._settle(latency)
+        return result
 
-        error_msg = f"API request failed after {max_retries} attempts. Last error: {str(last_error)}"
-        print(error_msg)  # Log the error
-        raise Exception(error_msg)
+    def _parse_stream_line(self, line: str) -> Tuple[bool, str]:
+        """Parse one server-sent event line into (done, content delta), recording any token usage."""
+        line = line.strip()
+        if not line.startswith("data:"):
+            return False, ""
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return True, ""
+        chunk = json.loads(data)
+        self.metrics.record_usage(chunk.get("usage"))
+        choices = chunk.get("choices") or []
+        if not choices:
+            return False, ""
+        delta = choices[0].get("delta") or {}
+        return False, delta.get("content") or ""
 
-    def _clean_json_string(self, content: str) -> str:
-        """Clean and prepare JSON string for parsing."""
+    def _stream_api_request(self, messages: List[Dict[str, str]], model: str, temperature: float = 0.8, max_tokens: int = 3000,
+                            use_cache: bool = True) -> Iterator[str]:
+        """Stream content deltas from the OpenAI-compatible API endpoint.
+
+        A cache hit, or the result of an identical request already in flight, is
+        replayed as a single delta; a completed stream is stored in the cache in
+        the same shape as a non-streaming response.
+        """
+        cache_key, flight_key = self._request_keys(messages, model, temperature, max_tokens, use_cache)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached["choices"][0]["message"]["content"]
+                return
+        if flight_key is not None:
+            leader, shared = self.single_flight.join(flight_key)
+            if not leader:
+                yield shared["choices"][0]["message"]["content"]
+                return
+
+        payload = self._build_payload(messages, model, temperature, max_tokens)
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+        parts = []
+        try:
+            for delta in self._send_stream_request(payload):
+                parts.append(delta)
+                yield delta
+            completion = self._completion_from_content("".join(parts))
+            if cache_key is not None:
+                self.cache.set(cache_key, completion)
+        except BaseException as e:
+            if flight_key is not None:
+                self.single_flight.land(flight_key, error=e)
+            raise
+        if flight_key is not None:
+            self.single_flight.land(flight_key, completion)
+
+    def _send_stream_request(self, payload: Dict[str, Any]) -> Iterator[str]:
+        """Send a streaming chat completion request and yield content deltas.
+
+        Failures are retried like _send_request, but only until the first delta
+        has been yielded; after that they surface as StreamInterruptedError.
+        """
+        headers = self._build_headers()
+        retrying = self.retry_policy.retrying()
+        with self.metrics.track_call("stream") as call:
+            try:
+                for attempt in retrying:
+                    with attempt:
+                        call.attempts = attempt.retry_state.attempt_number
+                        timeout = self.retry_policy.attempt_timeout(self.timeout, attempt.retry_state)
+                        for delta in self._stream_once(payload, headers, timeout):
+                            call.first_token()
+                            yield delta
+                        return
+            except (StreamInterruptedError, OverloadedError):
+                raise
+            except Exception as e:
+                attempts = retrying.statistics.get('attempt_number', 1)
+                logger.error("API stream failed after %d attempts: %s", attempts, e)
+                raise Exception(f"API stream failed after {attempts} attempts. Last error: {str(e)}") from e
+
+    def _stream_once(self, payload: Dict[str, Any], headers: Dict[str, str], timeout: httpx.Timeout) -> Iterator[str]:
+        """Stream one attempt from the endpoint chosen by the endpoint pool."""
+        started = False
+        self._admit()
+        endpoint = self.endpoints.acquire()
+        request_started = time.perf_counter()
+        latency = None
+        # True once the endpoint answered 2xx, False if it failed, None when there is no health signal
+        healthy = None
+        error = None
         try:
-            # First, normalize the content
-            content = content.strip()
-
-            # Handle common JSON formatting issues
-            content = re.sub(r'\s+', ' ', content)  # Normalize whitespace
-            content = content.replace('•', '-')  # Handle bullet points
-            content = content.replace('\\"', '"')  # Handle escaped quotes
-            content = re.sub(r'(?<!\\)\\n', ' ', content)  # Handle unescaped newlines
-            content = re.sub(r',(\s*[}\]])', r'\1', content)  # Remove trailing commas
-
-            # Basic cleanup
-            content = content.strip()
-            content = re.sub(r'\s+', ' ', content)  # Normalize whitespace
-
-            # Simple brace balancing
-            open_braces = content.count('{')
-            close_braces = content.count('}')
-            if open_braces > close_braces:
-                content += '}'
-
-            return content
+            with self.client.stream(
+                "POST",
+                endpoint.url,
+                headers=headers,
+                json=payload,
+                timeout=timeout,
+                extensions={"trace": self._pool_wait_tracer()}
+            ) as response:
+                response.raise_for_status()
+                latency = time.perf_counter() - request_started
+                healthy = True
+                for line in response.iter_lines():
+                    done, delta = self._parse_stream_line(line)
+                    if done:
+                        break
+                    if delta:
+                        started = True
+                        yield delta
+        except GeneratorExit:
+            # The consumer stopped reading; that says nothing more about the endpoint
+            raise
         except Exception as e:
-            print(f"Error cleaning JSON string: {str(e)}")
-            return content
+            if self._is_endpoint_failure(e):
+                healthy = False
+            error = e
+            if started:
+                raise StreamInterruptedError(f"Stream interrupted: {str(e)}") from e
+            raise
+        finally:
+            self.endpoints.release(endpoint, latency, healthy)
+            self._settle(latency, error)
 
     def _parse_response(self, response_content: str) -> dict:
         """Parse the LLM response with enhanced error handling."""
+        started = time.perf_counter()
+        result, path = self._parse_response_detailed(response_content)
+        duration = time.perf_counter() - started
+        self.metrics.parse_seconds.observe(duration, path=path)
+        self.metrics.parses.inc(path=path)
+        logger.debug("Parsed response via %s in %.2fms", path, duration * 1000,
+                     extra={"parse_path": path, "duration_s": round(duration, 6)})
+        if path == "error":
+            self.metrics.errors.inc(stage="parse")
+        return result
+
+    def _parse_response_detailed(self, response_content: str) -> Tuple[dict, str]:
+        """Parse the LLM response, returning the result and the path taken: json, regex or error."""
         try:
-            # First try to find JSON within tags
-            json_match = re.search(r'<json>\s*(.*?)\s*</json>', response_content, re.DOTALL)
-            if json_match:
-                json_str = self._clean_json_string(json_match.group(1))
-                try:
-                    # Try to parse the cleaned JSON string
-                    parsed_json = json.loads(json_str)
-                    print(f"Initial JSON parse: {parsed_json}")
-
-                    # Handle nested JSON strings
-                    if isinstance(parsed_json, str):
-                        try:
-                            parsed_json = json.loads(parsed_json)
-                            print(f"Nested JSON parse: {parsed_json}")
-                        except json.JSONDecodeError:
-                            pass  # Keep the string value if it's not valid JSON
-
-                    prompt_analysis = f"""
-                    #### Original prompt analysis
-                    - {parsed_json.get("initial_prompt_evaluation", "")}
-                    """
-                    explanation_of_refinements = f"""
-                    #### Refinement Explanation
-                    - {parsed_json.get("explanation_of_refinements", "")}
-                    """
-                    return {
-                        "initial_prompt_evaluation": prompt_analysis,
-                        "refined_prompt": parsed_json.get("refined_prompt", ""),
-                        "explanation_of_refinements": explanation_of_refinements,
-                        "response_content": parsed_json
-                    }
-                except json.JSONDecodeError as e:
-                    print(f"JSON parse error: {str(e)}")
-                    print(f"Problematic JSON string: {json_str}")
-                    # If JSON parsing fails, try to fix common issues
-                    json_str = re.sub(r'([{,])\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*:', r'\1"\2":', json_str)
-                    try:
-                        parsed_json = json.loads(json_str)
-                        print(f"Fixed JSON parse: {parsed_json}")
-                        return self._parse_response(json.dumps(parsed_json))
-                    except json.JSONDecodeError:
-                        return self._parse_with_regex(response_content)
-
-            return self._parse_with_regex(response_content)
+            parsed_json = extract_json(response_content)
+            if isinstance(parsed_json, dict):
+                logger.debug("Initial JSON parse: %s", parsed_json)
+                prompt_analysis = f"""
+                #### Original prompt analysis
+                - {parsed_json.get("initial_prompt_evaluation", "")}
+                """
+                explanation_of_refinements = f"""
+                #### Refinement Explanation
+                - {parsed_json.get("explanation_of_refinements", "")}
+                """
+                return {
+                    "initial_prompt_evaluation": prompt_analysis,
+                    "refined_prompt": parsed_json.get("refined_prompt", ""),
+                    "explanation_of_refinements": explanation_of_refinements,
+                    "response_content": parsed_json
+                }, "json"
+
+            result = self._parse_with_regex(response_content)
+            return result, "error" if "error" in result["response_content"] else "regex"
 
         except Exception as e:
-            print(f"Error parsing response: {str(e)}")
-            return self._create_error_dict(str(e))
+            logger.warning("Error parsing response: %s", e)
+            return self._create_error_dict(str(e)), "error"
 
     def _parse_with_regex(self, content: str) -> dict:
         """Parse content using regex when JSON parsing fails."""
@@ -185,10 +599,10 @@ class PromptRefiner:
                 output[key] = match.group(1).strip() if match else ""
 
             output["response_content"] = {"raw_content": content}
-            print(content)
+            logger.debug("Parsed raw content with regex fallback: %s", content)
             return output
         except Exception as e:
-            print(f"Error in regex parsing: {str(e)}")
+            logger.warning("Error in regex parsing: %s", e)
             return self._create_error_dict(str(e))
 
     def _create_error_dict(self, error_message: str) -> dict:
@@ -200,158 +614,773 @@ class PromptRefiner:
             "response_content": {"error": error_message}
         }
 
-    def automatic_metaprompt(self, prompt: str) -> Tuple[str, str]:
+    def _build_router_messages(self, prompt: str, snapshot: Optional[TemplateSnapshot] = None) -> List[Dict[str, str]]:
+        """Build the messages used to ask the router for a metaprompt."""
+        router_template = (snapshot or self.snapshot).router_template
+        system = "You are an AI Prompt Selection Assistant that helps choose the most appropriate metaprompt based on the user's query."
+        if self.prefix_reuse:
+            return [
+                {"role": "system", "content": f"{system}\n\n{router_template.render(prompt=PROMPT_IN_USER_MESSAGE)}"},
+                {"role": "user", "content": prompt}
+            ]
+        return [
+            {
+                "role": "system",
+                "content": system
+            },
+            {
+                "role": "user",
+                "content": router_template.render(prompt=prompt)
+            }
+        ]
+
+    def _process_router_response(self, router_response: Dict, snapshot: Optional[TemplateSnapshot] = None) -> Tuple[str, str]:
+        """Turn the router API response into the metaprompt analysis and recommended key."""
+        meta_prompts = (snapshot or self.snapshot).meta_prompts
+        router_content = router_response["choices"][0]["message"]["content"].strip()
+        if find_json_span(router_content) is None:
+            raise ValueError("No JSON found in router response")
+
+        router_result = extract_json(router_content)
+        if not isinstance(router_result, dict):
+            raise ValueError("Failed to parse router response")
+        logger.debug("Router JSON parse: %s", router_result)
+
+        # Safely get the recommended key with fallback
+        recommended_key = (router_result.get("recommended_metaprompt", {})
+                         .get("key", next(iter(meta_prompts))))
+
+        # Check if the recommended key exists in available metaprompts
+        if recommended_key not in meta_prompts:
+            # Fallback to default if recommended doesn't exist
+            recommended_key = next(iter(meta_prompts))
+            router_result["recommended_metaprompt"]["name"] = "Default Template"
+            router_result["recommended_metaprompt"]["description"] = "Fallback to default template as recommended template is not available"
+
+        metaprompt_analysis = f"""
+        #### Selected MetaPrompt
+        - **Primary Choice**: {router_result["recommended_metaprompt"]["name"]}
+        - *Description*: {router_result["recommended_metaprompt"]["description"]}
+        - *Why This Choice*: {router_result["recommended_metaprompt"]["explanation"]}
+        - *Similar Sample*: {router_result["recommended_metaprompt"]["similar_sample"]}
+        - *Customized Sample*: {router_result["recommended_metaprompt"]["customized_sample"]}
+
+        #### Alternative Option
+        - **Secondary Choice**: {router_result["alternative_recommendation"]["name"]}
+        - *Why Consider This*: {router_result["alternative_recommendation"]["explanation"]}
+        """
+
+        return metaprompt_analysis, recommended_key
+
+    def _route_locally(self, prompt: str, snapshot: Optional[TemplateSnapshot] = None) -> Optional[Tuple[str, str]]:
+        """Pick a metaprompt with the local router, or return None to defer to the LLM router."""
+        snapshot = snapshot or self.snapshot
+        if snapshot.router is None:
+            return None
+        match = snapshot.router.select(prompt)
+        if match is None or match.key not in snapshot.meta_prompts:
+            return None
+
+        alternative = ""
+        if match.alternative_key:
+            alternative = f"""
+        #### Alternative Option
+        - **Secondary Choice**: {match.alternative_key}
+        - *Why Consider This*: Next closest match to the template descriptions and examples (score {match.alternative_score:.2f})
+        """
+
+        metaprompt_analysis = f"""
+        #### Selected MetaPrompt
+        - **Primary Choice**: {match.key}
+        - *Description*: {snapshot.metaprompt_explanations.get(match.key, "")}
+        - *Why This Choice*: Closest match to the template descriptions and examples (score {match.score:.2f}, confidence {match.confidence:.0%})
+        - *Similar Sample*: {match.similar_sample}
+        """ + alternative
+
+        return metaprompt_analysis, match.key
+
+    def automatic_metaprompt(self, prompt: str, use_cache: bool = True) -> Tuple[str, str]:
         """Automatically select the most appropriate metaprompt."""
         try:
-            router_messages = [
-                {
-                    "role": "system",
-                    "content": "You are an AI Prompt Selection Assistant that helps choose the most appropriate metaprompt based on the user's query."
-                },
-                {
-                    "role": "user",
-                    "content": metaprompt_router.replace("[Insert initial prompt here]", prompt)
-                }
-            ]
+            snapshot = self.snapshot
+            local_choice = self._route_locally(prompt, snapshot)
+            if local_choice is not None:
+                return local_choice
 
             router_response = self._make_api_request(
-                messages=router_messages,
+                messages=self._build_router_messages(prompt, snapshot),
                 model=prompt_refiner_model,
-                temperature=0.2
+                temperature=0.2,
+                use_cache=use_cache
             )
+            return self._process_router_response(router_response, snapshot)
+
+        except Exception as e:
+            return f"Error in automatic metaprompt: {str(e)}", ""
 
-            router_content = router_response["choices"][0]["message"]["content"].strip()
-            json_match = re.search(r'<json>(.*?)</json>', router_content, re.DOTALL)
+    def _build_refine_messages(self, prompt: str, meta_prompt_choice: str) -> Tuple[str, List[Dict[str, str]]]:
+        """Resolve the metaprompt choice and build the refinement messages."""
+        # Get the template or fall back to default
+        templates = self.snapshot.templates
+        selected_meta_prompt = templates.get(meta_prompt_choice)
+        if not selected_meta_prompt:
+            # Fallback to first available template
+            meta_prompt_choice = next(iter(templates))
+            selected_meta_prompt = templates[meta_prompt_choice]
 
-            if not json_match:
-                raise ValueError("No JSON found in router response")
+        system = 'You are an expert at refining and extending prompts.'
+        if self.prefix_reuse:
+            return meta_prompt_choice, [
+                {"role": "system", "content": f"{system}\n\n{selected_meta_prompt.render(prompt=PROMPT_IN_USER_MESSAGE)}"},
+                {"role": "user", "content": prompt}
+            ]
+        messages = [
+            {
+                "role": "system",
+                "content": system
+            },
+            {
+                "role": "user",
+                "content": selected_meta_prompt.render(prompt=prompt)
+            }
+        ]
+        return meta_prompt_choice, messages
 
-            # Clean and parse the JSON with multiple attempts
-            json_str = self._clean_json_string(json_match.group(1))
-            print(f"Cleaned JSON string: {json_str}")
+    def _process_refine_response(self, prompt: str, meta_prompt_choice: str, content: str) -> Tuple[str, str, str, dict]:
+        """Parse and validate the refinement response content."""
+        result = self._parse_response(content.strip())
+        started = time.perf_counter()
+        try:
+            llm_response = LLMResponse(**result)
+        except Exception:
+            self.metrics.errors.inc(stage="validation")
+            raise
+        finally:
+            self.metrics.validation_seconds.observe(time.perf_counter() - started)
+        llm_response_dico = {}
+        llm_response_dico['initial_prompt'] = prompt
+        llm_response_dico['meta_prompt'] = meta_prompt_choice
+        llm_response_dico = llm_response_dico | llm_response.dict()
 
-            try:
-                router_result = json.loads(json_str)
-            except json.JSONDecodeError as e:
-                print(f"Initial JSON parse error: {str(e)}")
-                print(f"Error position: char {e.pos}")
-                print(f"Problem section: {json_str[max(0, e.pos-20):min(len(json_str), e.pos+20)]}")
-
-                # Simple retry with brace balancing
-                try:
-                    # Count braces and add missing closing brace if needed
-                    open_braces = json_str.count('{')
-                    close_braces = json_str.count('}')
-                    if open_braces > close_braces:
-                        json_str += '}'
-
-                    print(f"Attempting to parse with brace balancing: {json_str}")
-                    router_result = json.loads(json_str)
-                except json.JSONDecodeError as e2:
-                    print(f"Parse attempt failed: {str(e2)}")
-                    raise ValueError(f"Failed to parse router response: {str(e)}")
-
-            # Safely get the recommended key with fallback
-            recommended_key = (router_result.get("recommended_metaprompt", {})
-                             .get("key", next(iter(self.meta_prompts))))
-
-            # Check if the recommended key exists in available metaprompts
-            if recommended_key not in self.meta_prompts:
-                # Fallback to default if recommended doesn't exist
-                recommended_key = next(iter(self.meta_prompts))
-                router_result["recommended_metaprompt"]["name"] = "Default Template"
-                router_result["recommended_metaprompt"]["description"] = "Fallback to default template as recommended template is not available"
-
-            metaprompt_analysis = f"""
-            #### Selected MetaPrompt
-            - **Primary Choice**: {router_result["recommended_metaprompt"]["name"]}
-            - *Description*: {router_result["recommended_metaprompt"]["description"]}
-            - *Why This Choice*: {router_result["recommended_metaprompt"]["explanation"]}
-            - *Similar Sample*: {router_result["recommended_metaprompt"]["similar_sample"]}
-            - *Customized Sample*: {router_result["recommended_metaprompt"]["customized_sample"]}
-
-            #### Alternative Option
-            - **Secondary Choice**: {router_result["alternative_recommendation"]["name"]}
-            - *Why Consider This*: {router_result["alternative_recommendation"]["explanation"]}
-            """
-
-            return metaprompt_analysis, recommended_key
+        return (
+            llm_response.initial_prompt_evaluation,
+            llm_response.refined_prompt,
+            llm_response.explanation_of_refinements,
+            llm_response_dico
+        )
 
-        except Exception as e:
-            return f"Error in automatic metaprompt: {str(e)}", ""
+    def refine_prompt(self, prompt: str, meta_prompt_choice: str, use_cache: bool = True,
+                      raise_errors: bool = False) -> Tuple[str, str, str, dict]:
+        """Refine the given prompt using the selected meta prompt.
 
-    def refine_prompt(self, prompt: str, meta_prompt_choice: str) -> Tuple[str, str, str, dict]:
-        """Refine the given prompt using the selected meta prompt."""
+        Failures are reported in the evaluation with an empty response dict,
+        unless raise_errors is set.
+        """
         try:
-            # Get the template or fall back to default
-            selected_meta_prompt = self.meta_prompts.get(meta_prompt_choice)
-            if not selected_meta_prompt:
-                # Fallback to first available template
-                meta_prompt_choice = next(iter(self.meta_prompts))
-                selected_meta_prompt = self.meta_prompts[meta_prompt_choice]
-
-            selected_meta_prompt_explanations = self.metaprompt_explanations.get(meta_prompt_choice)
-
-            messages = [
-                {
-                    "role": "system",
-                    "content": 'You are an expert at refining and extending prompts.'
-                },
-                {
-                    "role": "user",
-                    "content": selected_meta_prompt.replace("[Insert initial prompt here]", prompt)
-                }
-            ]
+            meta_prompt_choice, messages = self._build_refine_messages(prompt, meta_prompt_choice)
 
             response = self._make_api_request(
                 messages=messages,
                 model=prompt_refiner_model,
-                temperature=0.8
+                temperature=0.8,
+                use_cache=use_cache
+            )
+            return self._process_refine_response(
+                prompt, meta_prompt_choice, response["choices"][0]["message"]["content"]
             )
 
-            result = self._parse_response(response["choices"][0]["message"]["content"].strip())
-            llm_response = LLMResponse(**result)
-            llm_response_dico = {}
-            llm_response_dico['initial_prompt'] = prompt
-            llm_response_dico['meta_prompt'] = meta_prompt_choice
-            llm_response_dico = llm_response_dico | llm_response.dict()
-
+        except Exception as e:
+            if raise_errors:
+                raise
             return (
-                llm_response.initial_prompt_evaluation,
-                llm_response.refined_prompt,
-                llm_response.explanation_of_refinements,
-                llm_response_dico
+                f"Error: {str(e)}",
+                "",
+                "",
+                {}
             )
 
+    def refine_prompt_stream(self, prompt: str, meta_prompt_choice: str, use_cache: bool = True) -> Iterator[Tuple[str, str, str, dict]]:
+        """Refine the given prompt, yielding the partial refined prompt as tokens arrive.
+
+        Intermediate results, at most one per stream_update_interval seconds, only
+        carry the refined prompt; the last result is the same fully parsed tuple
+        that refine_prompt returns.
+        """
+        try:
+            meta_prompt_choice, messages = self._build_refine_messages(prompt, meta_prompt_choice)
+
+            parts = []
+            field_parser = IncrementalFieldParser(("refined_prompt",))
+            # value() copies the whole field, so only take it as often as the UI can show it
+            last_update = 0.0
+            for delta in self._stream_api_request(
+                messages=messages,
+                model=prompt_refiner_model,
+                temperature=0.8,
+                use_cache=use_cache
+            ):
+                parts.append(delta)
+                if field_parser.feed(delta) and time.perf_counter() - last_update >= self.stream_update_interval:
+                    last_update = time.perf_counter()
+                    yield "", field_parser.value("refined_prompt"), "", {}
+
+            yield self._process_refine_response(prompt, meta_prompt_choice, "".join(parts))
+
         except Exception as e:
-            return (
+            yield (
                 f"Error: {str(e)}",
                 "",
                 "",
                 {}
             )
 
-    def apply_prompt(self, prompt: str, model: str) -> str:
+    def _local_ranking(self, prompt: str, snapshot: TemplateSnapshot) -> List[str]:
+        """Template keys the local router scores above zero for the prompt, best first."""
+        if snapshot.router is None:
+            return []
+        scores = snapshot.router.score(prompt)
+        return [
+            snapshot.router.keys[i] for i in (-scores).argsort()
+            if scores[i] > 0 and snapshot.router.keys[i] in snapshot.meta_prompts
+        ]
+
+    def _router_keys(self, router_response: Dict, snapshot: TemplateSnapshot) -> List[str]:
+        """The recommended and alternative keys from an LLM router response that name loaded templates."""
+        router_result = extract_json(router_response["choices"][0]["message"]["content"])
+        keys = []
+        for field in ("recommended_metaprompt", "alternative_recommendation"):
+            choice = router_result.get(field) if isinstance(router_result, dict) else None
+            if isinstance(choice, dict) and choice.get("key") in snapshot.meta_prompts:
+                keys.append(choice["key"])
+        return keys
+
+    def _top_metaprompts(self, ranked: List[str], top_k: int, snapshot: TemplateSnapshot) -> List[str]:
+        """The first top_k distinct keys of ranked, padded with the other templates in their loaded order."""
+        keys: List[str] = []
+        for key in ranked + list(snapshot.meta_prompts):
+            if len(keys) >= top_k:
+                break
+            if key not in keys:
+                keys.append(key)
+        return keys
+
+    def _make_candidate(self, meta_prompt_choice: str, sample: int, result: Tuple[str, str, str, dict],
+                        seconds: float) -> Candidate:
+        evaluation, refined, explanation, full_response = result
+        return Candidate(
+            metaprompt=full_response.get("meta_prompt", meta_prompt_choice),
+            sample=sample,
+            initial_prompt_evaluation=evaluation,
+            refined_prompt=refined,
+            explanation_of_refinements=explanation if isinstance(explanation, str) else "\n".join(explanation),
+            full_response=full_response,
+            seconds=seconds,
+            # refine_prompt reports failures, including shed requests, in the evaluation
+            reason="" if refined else (evaluation or "No refined prompt in the response"),
+        )
+
+    def _fan_out_width(self, jobs: int) -> int:
+        """How many candidates to refine at once: all of them, but no more than the concurrency limit allows."""
+        if self.limiter is None:
+            return max(1, jobs)
+        return max(1, min(jobs, self.limiter.snapshot()["limit"]))
+
+    def _rank_candidates(self, prompt: str, candidates: List[Candidate], judge_content: Optional[str] = None) -> List[Candidate]:
+        """Score candidates locally, replace the scores the judge gave, and sort best first."""
+        scored = [candidate._replace(score=score_locally(prompt, candidate)) for candidate in candidates]
+        if judge_content is not None:
+            # The judge only saw the candidates that produced a refinement, in order
+            judged = [i for i, candidate in enumerate(scored) if not candidate.failed]
+            for i, verdict in zip(judged, parse_judge_scores(judge_content, len(judged))):
+                if verdict is not None:
+                    scored[i] = scored[i]._replace(score=verdict[0], reason=verdict[1])
+        return rank(scored)
+
+    def suggest_metaprompts(self, prompt: str, top_k: int = 2, use_cache: bool = True) -> List[str]:
+        """Return up to top_k metaprompt keys for the prompt, best first.
+
+        A confident local router match ranks them without a model call;
+        otherwise the LLM router's recommended and alternative choices come
+        first, followed by the local ranking and then the remaining templates.
+        """
+        snapshot = self.snapshot
+        ranked = self._local_ranking(prompt, snapshot)
+        if snapshot.router is None or snapshot.router.select(prompt) is None:
+            try:
+                router_response = self._make_api_request(
+                    messages=self._build_router_messages(prompt, snapshot),
+                    model=prompt_refiner_model,
+                    temperature=0.2,
+                    use_cache=use_cache
+                )
+                ranked = self._router_keys(router_response, snapshot) + ranked
+            except Exception as e:
+                logger.warning("Router call failed, ranking metaprompts locally: %s", e)
+        return self._top_metaprompts(ranked, top_k, snapshot)
+
+    def _refine_candidate(self, prompt: str, meta_prompt_choice: str, sample: int, use_cache: bool) -> Candidate:
+        started = time.perf_counter()
+        # Only the first sample may be served from the cache; the others must be new draws
+        result = self.refine_prompt(prompt, meta_prompt_choice, use_cache=use_cache and sample == 0)
+        return self._make_candidate(meta_prompt_choice, sample, result, time.perf_counter() - started)
+
+    def _judge_candidates(self, prompt: str, candidates: List[Candidate], use_cache: bool) -> Optional[str]:
+        """Ask the model to score the successful candidates in one call; None if there is nothing to compare."""
+        refined = [candidate for candidate in candidates if not candidate.failed]
+        if len(refined) < 2:
+            return None
+        try:
+            response = self._make_api_request(
+                messages=build_judge_messages(prompt, refined),
+                model=prompt_refiner_model,
+                temperature=0.0,
+                use_cache=use_cache
+            )
+            return response["choices"][0]["message"]["content"]
+        except Exception as e:
+            logger.warning("Judge call failed, keeping local scores: %s", e)
+            return None
+
+    def refine_candidates(self, prompt: str, top_k: int = 2, samples: int = 1,
+                          meta_prompt_choices: Optional[List[str]] = None, judge: bool = False,
+                          use_cache: bool = True) -> List[Candidate]:
+        """Refine the prompt with several metaprompts and samples at once and rank the results, best first.
+
+        Refinements run concurrently, up to the current concurrency limit, so
+        this usually takes about as long as the slowest one. Candidates are
+        scored locally, or by one judging call when judge is set. Candidates
+        that failed, for example because they were shed, are ranked last with
+        the error as their reason.
+        """
+        keys = list(meta_prompt_choices) if meta_prompt_choices else self.suggest_metaprompts(prompt, top_k, use_cache)
+        jobs = [(key, sample) for key in keys for sample in range(max(1, samples))]
+        # Worker threads log under the caller's request ID
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=self._fan_out_width(len(jobs))) as pool:
+            candidates = list(pool.map(
+                lambda job: context.copy().run(self._refine_candidate, prompt, job[0], job[1], use_cache), jobs
+            ))
+        judge_content = self._judge_candidates(prompt, candidates, use_cache) if judge else None
+        return self._rank_candidates(prompt, candidates, judge_content)
+
+    def _build_apply_messages(self, prompt: str) -> List[Dict[str, str]]:
+        """Build the messages used to run a prompt on the chosen model."""
+        return [
+            {
+                "role": "system",
+                "content": "You are a markdown formatting expert."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+
+    def apply_prompt(self, prompt: str, model: str, use_cache: bool = True) -> str:
         """Apply formatting to the prompt using the specified model."""
         try:
             if not prompt or not model:
                 return "Error: Prompt and model are required"
 
-            messages = [
-                {
-                    "role": "system",
-                    "content": "You are a markdown formatting expert."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-
             response = self._make_api_request(
+                messages=self._build_apply_messages(prompt),
+                model=model,
+                temperature=0.8,
+                use_cache=use_cache
+            )
+
+            result = response["choices"][0]["message"]["content"].strip()
+            return f"""{result}"""
+
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    def apply_prompt_stream(self, prompt: str, model: str, use_cache: bool = True) -> Iterator[str]:
+        """Apply the prompt using the specified model, yielding the output generated so far.
+
+        Partial outputs come at most once per stream_update_interval seconds;
+        the last one is always the complete output.
+        """
+        try:
+            if not prompt or not model:
+                yield "Error: Prompt and model are required"
+                return
+
+            parts = []
+            # Each update re-sends the whole output, so send it only as often as the UI can show it
+            last_update = 0.0
+            for delta in self._stream_api_request(
+                messages=self._build_apply_messages(prompt),
+                model=model,
+                temperature=0.8,
+                use_cache=use_cache
+            ):
+                parts.append(delta)
+                if time.perf_counter() - last_update >= self.stream_update_interval:
+                    last_update = time.perf_counter()
+                    yield "".join(parts)
+
+            yield "".join(parts).strip()
+
+        except Exception as e:
+            yield f"Error: {str(e)}"
+
+    def close(self) -> None:
+        """Close the underlying HTTP client."""
+        self.client.close()
+
+
+class AsyncPromptRefiner(PromptRefiner):
+    """PromptRefiner variant whose API calls are coroutines on httpx.AsyncClient.
+
+    Message building and response parsing are shared with PromptRefiner; only the
+    network-bound methods are overridden, so a single event loop can keep many
+    refinements in flight without tying up a thread per request.
+    """
+
+    def _create_client(self) -> httpx.AsyncClient:
+        """Create the async HTTP client used for API requests."""
+        return httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=self.http2)
+
+    def _pool_wait_tracer(self):
+        """Return an async httpcore trace hook that records the pool wait."""
+        started = time.perf_counter()
+        recorded = False
+
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            nonlocal recorded
+            if not recorded:
+                recorded = True
+                self.pool_wait.record(time.perf_counter() - started)
+
+        return trace
+
+    async def _admit(self) -> None:
+        """Wait for a concurrency slot without blocking the event loop; shed like PromptRefiner._admit."""
+        if self.breaker is not None:
+            self.breaker.before_call()
+        if self.limiter is not None:
+            try:
+                await self.limiter.acquire_async()
+            except (OverloadedError, asyncio.CancelledError):
+                if self.breaker is not None:
+                    self.breaker.release_probe()
+                raise
+
+    async def _make_api_request(self, messages: List[Dict[str, str]], model: str, temperature: float = 0.8, max_tokens: int = 3000,
+                                use_cache: bool = True) -> Dict:
+        """Make a request to the OpenAI-compatible API endpoint, sharing the cache and in-flight requests."""
+        cache_key, flight_key = self._request_keys(messages, model, temperature, max_tokens, use_cache)
+        if cache_key is not None:
+            cached = await self.cache.get_async(cache_key)
+            if cached is not None:
+                return cached
+
+        payload = self._build_payload(messages, model, temperature, max_tokens)
+        if flight_key is not None:
+            return await self.single_flight.do_async(flight_key, lambda: self._fetch(payload, cache_key))
+        return await self._fetch(payload, cache_key)
+
+    async def _fetch(self, payload: Dict[str, Any], cache_key: Optional[str]) -> Dict:
+        """Send a request and store the response in the cache."""
+        response = await self._send_request(payload)
+        if cache_key is not None:
+            await self.cache.set_async(cache_key, response)
+        return response
+
+    async def _send_request(self, payload: Dict[str, Any]) -> Dict:
+        """Send a chat completion request, retrying as the retry policy allows."""
+        headers = self._build_headers()
+        retrying = self.retry_policy.async_retrying()
+        with self.metrics.track_call("complete") as call:
+            try:
+                async for attempt in retrying:
+                    with attempt:
+                        call.attempts = attempt.retry_state.attempt_number
+                        timeout = self.retry_policy.attempt_timeout(self.timeout, attempt.retry_state)
+                        result = await self._send_once(payload, headers, timeout)
+                        self.metrics.record_usage(result.get("usage"))
+                        return result
+            except OverloadedError:
+                raise
+            except Exception as e:
+                attempts = retrying.statistics.get('attempt_number', 1)
+                logger.error("API request failed after %d attempts: %s", attempts, e)
+                raise Exception(f"API request failed after {attempts} attempts. Last error: {str(e)}") from e
+
+    async def _send_once(self, payload: Dict[str, Any], headers: Dict[str, str], timeout: httpx.Timeout) -> Dict:
+        """Send one attempt to the endpoint chosen by the endpoint pool."""
+        await self._admit()
+        endpoint = self.endpoints.acquire()
+        request_started = time.perf_counter()
+        try:
+            response = await self.client.post(
+                endpoint.url,
+                headers=headers,
+                json=payload,
+                timeout=timeout,
+                extensions={"trace": self._pool_wait_tracer()}
+            )
+            response.raise_for_status()
+            result = response.json()
+        except asyncio.CancelledError:
+            self.endpoints.release(endpoint, success=None)
+            self._settle()
+            raise
+        except Exception as e:
+            self.endpoints.release(endpoint, success=False if self._is_endpoint_failure(e) else None)
+            self._settle(error=e)
+            raise
+        latency = time.perf_counter() - request_started
+        self.endpoints.release(endpoint, latency)
+        self._settle(latency)
+        return result
+
+    async def _stream_api_request(self, messages: List[Dict[str, str]], model: str, temperature: float = 0.8, max_tokens: int = 3000,
+                                  use_cache: bool = True) -> AsyncIterator[str]:
+        """Stream content deltas from the OpenAI-compatible API endpoint, replaying cache hits and shared requests."""
+        cache_key, flight_key = self._request_keys(messages, model, temperature, max_tokens, use_cache)
+        if cache_key is not None:
+            cached = await self.cache.get_async(cache_key)
+            if cached is not None:
+                yield cached["choices"][0]["message"]["content"]
+                return
+        if flight_key is not None:
+            leader, shared = await self.single_flight.join_async(flight_key)
+            if not leader:
+                yield shared["choices"][0]["message"]["content"]
+                return
+
+        payload = self._build_payload(messages, model, temperature, max_tokens)
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+        parts = []
+        try:
+            async with aclosing(self._send_stream_request(payload)) as stream:
+                async for delta in stream:
+                    parts.append(delta)
+                    yield delta
+            completion = self._completion_from_content("".join(parts))
+            if cache_key is not None:
+                await self.cache.set_async(cache_key, completion)
+        except BaseException as e:
+            if flight_key is not None:
+                self.single_flight.land(flight_key, error=e)
+            raise
+        if flight_key is not None:
+            self.single_flight.land(flight_key, completion)
+
+    async def _send_stream_request(self, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """Send a streaming chat completion request and yield content deltas."""
+        headers = self._build_headers()
+        retrying = self.retry_policy.async_retrying()
+        with self.metrics.track_call("stream") as call:
+            try:
+                async for attempt in retrying:
+                    with attempt:
+                        call.attempts = attempt.retry_state.attempt_number
+                        timeout = self.retry_policy.attempt_timeout(self.timeout, attempt.retry_state)
+                        async with aclosing(self._stream_once(payload, headers, timeout)) as stream:
+                            async for delta in stream:
+                                call.first_token()
+                                yield delta
+                        return
+            except (StreamInterruptedError, OverloadedError):
+                raise
+            except Exception as e:
+                attempts = retrying.statistics.get('attempt_number', 1)
+                logger.error("API stream failed after %d attempts: %s", attempts, e)
+                raise Exception(f"API stream failed after {attempts} attempts. Last error: {str(e)}") from e
+
+    async def _stream_once(self, payload: Dict[str, Any], headers: Dict[str, str], timeout: httpx.Timeout) -> AsyncIterator[str]:
+        """Stream one attempt from the endpoint chosen by the endpoint pool."""
+        started = False
+        await self._admit()
+        endpoint = self.endpoints.acquire()
+        request_started = time.perf_counter()
+        latency = None
+        # True once the endpoint answered 2xx, False if it failed, None when there is no health signal
+        healthy = None
+        error = None
+        try:
+            async with self.client.stream(
+                "POST",
+                endpoint.url,
+                headers=headers,
+                json=payload,
+                timeout=timeout,
+                extensions={"trace": self._pool_wait_tracer()}
+            ) as response:
+                response.raise_for_status()
+                latency = time.perf_counter() - request_started
+                healthy = True
+                async for line in response.aiter_lines():
+                    done, delta = self._parse_stream_line(line)
+                    if done:
+                        break
+                    if delta:
+                        started = True
+                        yield delta
+        except (GeneratorExit, asyncio.CancelledError):
+            # The consumer stopped reading; that says nothing more about the endpoint
+            raise
+        except Exception as e:
+            if self._is_endpoint_failure(e):
+                healthy = False
+            error = e
+            if started:
+                raise StreamInterruptedError(f"Stream interrupted: {str(e)}") from e
+            raise
+        finally:
+            self.endpoints.release(endpoint, latency, healthy)
+            self._settle(latency, error)
+
+    async def automatic_metaprompt(self, prompt: str, use_cache: bool = True) -> Tuple[str, str]:
+        """Automatically select the most appropriate metaprompt."""
+        try:
+            snapshot = self.snapshot
+            local_choice = self._route_locally(prompt, snapshot)
+            if local_choice is not None:
+                return local_choice
+
+            router_response = await self._make_api_request(
+                messages=self._build_router_messages(prompt, snapshot),
+                model=prompt_refiner_model,
+                temperature=0.2,
+                use_cache=use_cache
+            )
+            return self._process_router_response(router_response, snapshot)
+
+        except Exception as e:
+            return f"Error in automatic metaprompt: {str(e)}", ""
+
+    async def refine_prompt(self, prompt: str, meta_prompt_choice: str, use_cache: bool = True,
+                            raise_errors: bool = False) -> Tuple[str, str, str, dict]:
+        """Refine the given prompt using the selected meta prompt; see PromptRefiner.refine_prompt."""
+        try:
+            meta_prompt_choice, messages = self._build_refine_messages(prompt, meta_prompt_choice)
+
+            response = await self._make_api_request(
+                messages=messages,
+                model=prompt_refiner_model,
+                temperature=0.8,
+                use_cache=use_cache
+            )
+            return self._process_refine_response(
+                prompt, meta_prompt_choice, response["choices"][0]["message"]["content"]
+            )
+
+        except Exception as e:
+            if raise_errors:
+                raise
+            return (
+                f"Error: {str(e)}",
+                "",
+                "",
+                {}
+            )
+
+    async def refine_prompt_stream(self, prompt: str, meta_prompt_choice: str, use_cache: bool = True) -> AsyncIterator[Tuple[str, str, str, dict]]:
+        """Refine the given prompt, yielding the partial refined prompt as tokens arrive."""
+        try:
+            meta_prompt_choice, messages = self._build_refine_messages(prompt, meta_prompt_choice)
+
+            parts = []
+            field_parser = IncrementalFieldParser(("refined_prompt",))
+            # value() copies the whole field, so only take it as often as the UI can show it
+            last_update = 0.0
+            async with aclosing(self._stream_api_request(
                 messages=messages,
+                model=prompt_refiner_model,
+                temperature=0.8,
+                use_cache=use_cache
+            )) as stream:
+                async for delta in stream:
+                    parts.append(delta)
+                    if field_parser.feed(delta) and time.perf_counter() - last_update >= self.stream_update_interval:
+                        last_update = time.perf_counter()
+                        yield "", field_parser.value("refined_prompt"), "", {}
+
+            yield self._process_refine_response(prompt, meta_prompt_choice, "".join(parts))
+
+        except Exception as e:
+            yield (
+                f"Error: {str(e)}",
+                "",
+                "",
+                {}
+            )
+
+    async def suggest_metaprompts(self, prompt: str, top_k: int = 2, use_cache: bool = True) -> List[str]:
+        """Return up to top_k metaprompt keys for the prompt, best first."""
+        snapshot = self.snapshot
+        ranked = self._local_ranking(prompt, snapshot)
+        if snapshot.router is None or snapshot.router.select(prompt) is None:
+            try:
+                router_response = await self._make_api_request(
+                    messages=self._build_router_messages(prompt, snapshot),
+                    model=prompt_refiner_model,
+                    temperature=0.2,
+                    use_cache=use_cache
+                )
+                ranked = self._router_keys(router_response, snapshot) + ranked
+            except Exception as e:
+                logger.warning("Router call failed, ranking metaprompts locally: %s", e)
+        return self._top_metaprompts(ranked, top_k, snapshot)
+
+    async def _refine_candidate(self, prompt: str, meta_prompt_choice: str, sample: int, use_cache: bool) -> Candidate:
+        started = time.perf_counter()
+        # Only the first sample may be served from the cache; the others must be new draws
+        result = await self.refine_prompt(prompt, meta_prompt_choice, use_cache=use_cache and sample == 0)
+        return self._make_candidate(meta_prompt_choice, sample, result, time.perf_counter() - started)
+
+    async def _judge_candidates(self, prompt: str, candidates: List[Candidate], use_cache: bool) -> Optional[str]:
+        """Ask the model to score the successful candidates in one call; None if there is nothing to compare."""
+        refined = [candidate for candidate in candidates if not candidate.failed]
+        if len(refined) < 2:
+            return None
+        try:
+            response = await self._make_api_request(
+                messages=build_judge_messages(prompt, refined),
+                model=prompt_refiner_model,
+                temperature=0.0,
+                use_cache=use_cache
+            )
+            return response["choices"][0]["message"]["content"]
+        except Exception as e:
+            logger.warning("Judge call failed, keeping local scores: %s", e)
+            return None
+
+    async def refine_candidates(self, prompt: str, top_k: int = 2, samples: int = 1,
+                                meta_prompt_choices: Optional[List[str]] = None, judge: bool = False,
+                                use_cache: bool = True) -> List[Candidate]:
+        """Refine the prompt with several metaprompts and samples concurrently and rank the results, best first."""
+        keys = (
+            list(meta_prompt_choices) if meta_prompt_choices
+            else await self.suggest_metaprompts(prompt, top_k, use_cache)
+        )
+        jobs = [(key, sample) for key in keys for sample in range(max(1, samples))]
+        slots = asyncio.Semaphore(self._fan_out_width(len(jobs)))
+
+        async def refine(key: str, sample: int) -> Candidate:
+            async with slots:
+                return await self._refine_candidate(prompt, key, sample, use_cache)
+
+        candidates = await asyncio.gather(*(refine(key, sample) for key, sample in jobs))
+        judge_content = await self._judge_candidates(prompt, candidates, use_cache) if judge else None
+        return self._rank_candidates(prompt, candidates, judge_content)
+
+    async def apply_prompt(self, prompt: str, model: str, use_cache: bool = True) -> str:
+        """Apply formatting to the prompt using the specified model."""
+        try:
+            if not prompt or not model:
+                return "Error: Prompt and model are required"
+
+            response = await self._make_api_request(
+                messages=self._build_apply_messages(prompt),
                 model=model,
-                temperature=0.8
+                temperature=0.8,
+                use_cache=use_cache
             )
 
             result = response["choices"][0]["message"]["content"].strip()
@@ -359,3 +1388,96 @@ class PromptRefiner:
 
         except Exception as e:
             return f"Error: {str(e)}"
+
+    async def apply_prompt_stream(self, prompt: str, model: str, use_cache: bool = True) -> AsyncIterator[str]:
+        """Apply the prompt using the specified model, yielding the output generated so far."""
+        try:
+            if not prompt or not model:
+                yield "Error: Prompt and model are required"
+                return
+
+            parts = []
+            # Each update re-sends the whole output, so send it only as often as the UI can show it
+            last_update = 0.0
+            async with aclosing(self._stream_api_request(
+                messages=self._build_apply_messages(prompt),
+                model=model,
+                temperature=0.8,
+                use_cache=use_cache
+            )) as stream:
+                async for delta in stream:
+                    parts.append(delta)
+                    if time.perf_counter() - last_update >= self.stream_update_interval:
+                        last_update = time.perf_counter()
+                        yield "".join(parts)
+
+            yield "".join(parts).strip()
+
+        except Exception as e:
+            yield f"Error: {str(e)}"
+
+    async def close(self) -> None:
+        """Close the underlying HTTP client."""
+        await self.client.aclose()
+
+
+def template_settings(config: TemplateConfig) -> Dict[str, Any]:
+    """Templates and routing built from a TemplateConfig, as keyword arguments for PromptRefiner.set_templates."""
+    return {
+        "meta_prompts": config.meta_prompts,
+        "metaprompt_explanations": config.metaprompt_explanations,
+        "router_prompt": get_metaprompt_router(config.prompt_data, compact=router_compact),
+        "router": (
+            LocalMetapromptRouter(config.prompt_data, min_confidence=local_router_min_confidence)
+            if local_router_enabled
+            else None
+        ),
+    }
+
+
+def create_refiner(refiner_class=AsyncPromptRefiner):
+    """Build a refiner configured from the environment settings in variables.py."""
+    response_cache = (
+        ResponseCache(max_entries=cache_max_entries, ttl=cache_ttl, path=cache_path, cache_sampled=cache_sampled)
+        if cache_enabled
+        else None
+    )
+    return refiner_class(
+        EndpointPool(api_endpoints, eject_after=endpoint_eject_after, eject_seconds=endpoint_eject_seconds),
+        api_key,
+        cache=response_cache,
+        single_flight=SingleFlight() if coalesce_requests else None,
+        prefix_reuse=prefix_reuse,
+        keep_alive=llm_keep_alive,
+        cache_prompt=llm_cache_prompt,
+        **template_settings(template_config),
+        limits=httpx.Limits(
+            max_connections=http_max_connections,
+            max_keepalive_connections=http_max_keepalive_connections,
+            keepalive_expiry=http_keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(
+            connect=http_connect_timeout,
+            read=http_read_timeout,
+            write=http_write_timeout,
+            pool=http_pool_timeout,
+        ),
+        http2=http2_enabled,
+        retry_policy=RetryPolicy(
+            max_attempts=retry_max_attempts,
+            base_delay=retry_base_delay,
+            max_delay=retry_max_delay,
+            deadline=retry_deadline,
+        ),
+        breaker=CircuitBreaker(
+            failure_threshold=breaker_failure_threshold,
+            recovery_timeout=breaker_recovery_timeout,
+        ) if breaker_failure_threshold > 0 else None,
+        limiter=AdaptiveConcurrencyLimiter(
+            initial_limit=concurrency_initial_limit,
+            min_limit=concurrency_min_limit,
+            max_limit=concurrency_max_limit,
+            tolerance=concurrency_latency_tolerance,
+            wait_timeout=concurrency_wait_timeout,
+        ) if concurrency_max_limit > 0 else None,
+    )
@@ -0,0 +1,83 @@
+import math
+import time
+from typing import Dict, List, Optional
+
+
+class QueueMonitor:
+    """Read-only view of a Gradio app's event queue, per concurrency group.
+
+    Gradio keeps one queue per concurrency_id. For each group this reports
+    the events waiting, the events running, the group's limit, how long the
+    oldest waiting event has been queued, and an estimate of the wait for a
+    new arrival from Gradio's average run time of the group's functions.
+    The queue has no public API for this, so it is read defensively: if a
+    Gradio release changes its internals the snapshot is empty rather than
+    breaking the app.
+    """
+
+    def __init__(self, blocks, groups: Optional[Dict[str, str]] = None):
+        self.blocks = blocks
+        # concurrency_id -> label shown in the UI; other groups are reported under their id
+        self.groups = dict(groups or {})
+
+    def snapshot(self) -> List[dict]:
+        """Queue state per concurrency group, configured groups first."""
+        queue = getattr(self.blocks, "_queue", None)
+        try:
+            event_queues = dict(queue.event_queue_per_concurrency_id)
+            enqueued = queue.event_analytics
+            run_times = queue.process_time_per_fn
+        except AttributeError:
+            return []
+        now = time.time()
+        order = list(self.groups) + sorted(set(event_queues) - set(self.groups))
+        snapshot = []
+        for concurrency_id in order:
+            event_queue = event_queues.get(concurrency_id)
+            if event_queue is None:
+                continue
+            waiting = list(event_queue.queue)
+            oldest = min((enqueued.get(event._id, {}).get("time", now) for event in waiting), default=None)
+            averages = [run_times[event.fn].avg_time for event in waiting if event.fn in run_times]
+            average = max(averages) if averages else max(
+                (timing.avg_time for fn, timing in run_times.items() if fn.concurrency_id == concurrency_id),
+                default=None
+            )
+            limit = event_queue.concurrency_limit
+            snapshot.append({
+                "group": self.groups.get(concurrency_id, concurrency_id),
+                "waiting": len(waiting),
+                "running": event_queue.current_concurrency,
+                "limit": limit,
+                "oldest_wait_seconds": now - oldest if oldest is not None else 0.0,
+                # With every slot busy, a new event waits about one run per `limit` events ahead of it
+                "estimated_wait_seconds": (
+                    math.ceil((len(waiting) + 1) / limit) * average
+                    if average is not None and limit and event_queue.current_concurrency >= limit else 0.0
+                ),
+            })
+        return snapshot
+
+    def markdown(self) -> str:
+        """One status line per group for the UI."""
+        snapshot = self.snapshot()
+        if not snapshot:
+            return ""
+        lines = []
+        for group in snapshot:
+            line = f"**{group['group']}**: {group['running']}/{group['limit'] or '∞'} running, {group['waiting']} waiting"
+            if group["waiting"]:
+                line += (f", oldest {group['oldest_wait_seconds']:.1f}s,"
+                         f" expect ~{group['estimated_wait_seconds']:.0f}s")
+            lines.append(line)
+        return "Queue — " + " · ".join(lines)
+
+    def collect(self):
+        """Metric families for MetricsRegistry.add_collector."""
+        snapshot = self.snapshot()
+        yield ("gradio_queue_waiting", "gauge", "UI events waiting for a worker slot.",
+               [({"group": g["group"]}, g["waiting"]) for g in snapshot])
+        yield ("gradio_queue_running", "gauge", "UI events running.",
+               [({"group": g["group"]}, g["running"]) for g in snapshot])
+        yield ("gradio_queue_oldest_wait_seconds", "gauge", "How long the oldest waiting UI event has been queued.",
+               [({"group": g["group"]}, g["oldest_wait_seconds"]) for g in snapshot])
@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+
+
+class ResponseCache:
+    """Content-addressed cache for chat completion responses.
+
+    Entries are keyed by a hash of everything that determines the request
+    (endpoint, model, messages, temperature, max_tokens). A bounded in-memory
+    LRU sits in front of an optional SQLite file, so repeated demo and
+    regression runs survive restarts. The cache is thread-safe; async code
+    uses get_async and set_async, which do the SQLite work in a thread.
+
+    Responses sampled at a temperature above zero are only cached with
+    cache_sampled, since serving them again would repeat one draw instead
+    of producing a new one.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: Optional[float] = 3600.0, path: Optional[str] = None,
+                 cache_sampled: bool = False):
+        self.max_entries = max_entries
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self.path = path
+        self.cache_sampled = cache_sampled
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, created REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(endpoint: str, model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+        """Hash the request parameters into a stable cache key."""
+        material = json.dumps(
+            [endpoint, model, messages, temperature, max_tokens],
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def accepts(self, temperature: float) -> bool:
+        """Whether responses sampled at this temperature are cached."""
+        return self.cache_sampled or temperature <= 0
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            created, value = entry
+            if not self._expired(created):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        return None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached response for key, or None on a miss."""
+        with self._lock:
+            value = self._get_memory(key)
+            if value is not None:
+                return value
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT created, value FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    created, raw = row
+                    if not self._expired(created):
+                        value = json.loads(raw)
+                        self._remember(key, created, value)
+                        self.hits += 1
+                        return value
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    async def get_async(self, key: str) -> Optional[Dict[str, Any]]:
+        """Like get, but reads SQLite in a thread so the event loop is not blocked."""
+        if self._db is None:
+            return self.get(key)
+        with self._lock:
+            value = self._get_memory(key)
+        if value is not None:
+            return value
+        return await asyncio.to_thread(self.get, key)
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Store a response under key in memory and, if configured, on disk."""
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, value)
+            self._write(key, created, value)
+
+    async def set_async(self, key: str, value: Dict[str, Any]) -> None:
+        """Like set, but writes SQLite in a thread so the event loop is not blocked."""
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, value)
+        if self._db is not None:
+            await asyncio.to_thread(self._write_locked, key, created, value)
+
+    def _write_locked(self, key: str, created: float, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._write(key, created, value)
+
+    def _write(self, key: str, created: float, value: Dict[str, Any]) -> None:
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, created, value) VALUES (?, ?, ?)",
+                (key, created, json.dumps(value, ensure_ascii=False)),
+            )
+            self._db.commit()
+
+    def _remember(self, key: str, created: float, value: Dict[str, Any]) -> None:
+        self._entries[key] = (created, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every entry from memory and disk and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the current in-memory size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+    def close(self) -> None:
+        """Close the on-disk store, if any."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,119 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+import tenacity
+
+
+class StreamInterruptedError(Exception):
+    """A streaming response failed after content had already been delivered; never retried."""
+
+
+class RetryPolicy:
+    """When and how long to wait before retrying an LLM API call.
+
+    Only transport errors and retryable statuses (408, 425, 429 and 5xx
+    gateway/overload codes) are retried; other 4xx responses fail at once.
+    Waits use decorrelated jitter, so clients that failed together do not retry
+    together, and a Retry-After header on 429/503 replaces the jittered delay.
+    Every call has a deadline budget: no retry is started that could not begin
+    before the deadline, and attempt_timeout() shrinks each attempt's timeouts
+    to what is left of it. retrying() and async_retrying() return tenacity
+    controllers, so the same policy drives the sync and async clients.
+    """
+
+    RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 20.0,
+                 deadline: Optional[float] = 300.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline if deadline and deadline > 0 else None
+
+    def is_retryable(self, error: BaseException) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in self.RETRYABLE_STATUSES
+        return isinstance(error, httpx.TransportError)
+
+    def retry_after(self, error: Optional[BaseException]) -> Optional[float]:
+        """Seconds requested by a Retry-After header on a 429/503 response, if any."""
+        if not isinstance(error, httpx.HTTPStatusError) or error.response.status_code not in (429, 503):
+            return None
+        value = error.response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def remaining(self, retry_state: tenacity.RetryCallState) -> Optional[float]:
+        """Seconds left in the call's deadline budget, or None without a deadline."""
+        if self.deadline is None:
+            return None
+        return self.deadline - (time.monotonic() - retry_state.start_time)
+
+    def attempt_timeout(self, timeout: httpx.Timeout, retry_state: tenacity.RetryCallState) -> httpx.Timeout:
+        """Cap each phase of timeout at the time left in the deadline budget."""
+        remaining = self.remaining(retry_state)
+        if remaining is None:
+            return timeout
+        remaining = max(remaining, 0.001)
+
+        def cap(value: Optional[float]) -> float:
+            return remaining if value is None else min(value, remaining)
+
+        return httpx.Timeout(
+            connect=cap(timeout.connect),
+            read=cap(timeout.read),
+            write=cap(timeout.write),
+            pool=cap(timeout.pool),
+        )
+
+    def _stop(self, retry_state: tenacity.RetryCallState) -> bool:
+        if retry_state.attempt_number >= self.max_attempts:
+            return True
+        remaining = self.remaining(retry_state)
+        if remaining is None:
+            return False
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        # Don't retry if the server has asked us to wait past the deadline
+        return remaining <= 0 or (self.retry_after(error) or 0.0) > remaining
+
+    def _make_wait(self):
+        previous = self.base_delay
+
+        def wait(retry_state: tenacity.RetryCallState) -> float:
+            nonlocal previous
+            error = retry_state.outcome.exception() if retry_state.outcome else None
+            retry_after = self.retry_after(error)
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, self.base_delay)
+            else:
+                delay = min(self.max_delay, random.uniform(self.base_delay, previous * 3))
+                previous = delay
+            remaining = self.remaining(retry_state)
+            if remaining is not None:
+                delay = min(delay, max(remaining, 0.0))
+            return delay
+
+        return wait
+
+    def _retry(self, retry_state: tenacity.RetryCallState) -> bool:
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        return error is not None and self.is_retryable(error)
+
+    def retrying(self) -> tenacity.Retrying:
+        """Return a tenacity controller for one synchronous call."""
+        return tenacity.Retrying(stop=self._stop, wait=self._make_wait(), retry=self._retry, reraise=True)
+
+    def async_retrying(self) -> tenacity.AsyncRetrying:
+        """Return a tenacity controller for one asynchronous call."""
+        return tenacity.AsyncRetrying(stop=self._stop, wait=self._make_wait(), retry=self._retry, reraise=True)
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class FlightAbandoned(Exception):
+    """The caller leading a shared request went away before it finished."""
+
+
+class SingleFlight:
+    """Share one in-flight request among concurrent callers with the same key.
+
+    The first caller for a key becomes the leader and makes the request; callers
+    that arrive while it is in flight wait for the leader's result, or its
+    error, instead of sending an identical request. If the leader is cancelled
+    or its stream is abandoned, a waiting caller takes over as the new leader.
+    Results are shared through concurrent.futures.Future, so the same instance
+    serves threads and event loops.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.saved = 0
+        self._flights: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _enter(self, key: str) -> Tuple[bool, Future]:
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.saved += 1
+                return False, flight
+            flight = self._flights[key] = Future()
+            return True, flight
+
+    def _retry_as_leader(self) -> None:
+        # The abandoned wait was not a saved call after all
+        with self._lock:
+            self.calls -= 1
+            self.saved -= 1
+
+    def join(self, key: str) -> Tuple[bool, Any]:
+        """Return (True, None) if the caller must make the request and land() it, else (False, shared result)."""
+        while True:
+            leader, flight = self._enter(key)
+            if leader:
+                return True, None
+            try:
+                return False, flight.result()
+            except FlightAbandoned:
+                self._retry_as_leader()
+
+    async def join_async(self, key: str) -> Tuple[bool, Any]:
+        """Asynchronous join(); waiting callers do not block the event loop."""
+        while True:
+            leader, flight = self._enter(key)
+            if leader:
+                return True, None
+            try:
+                # shield() keeps a cancelled waiter from cancelling the shared future
+                return False, await asyncio.shield(asyncio.wrap_future(flight))
+            except FlightAbandoned:
+                self._retry_as_leader()
+
+    def land(self, key: str, result: Any = None, error: Optional[BaseException] = None) -> None:
+        """Publish the leader's result or error to the callers waiting on key."""
+        with self._lock:
+            flight = self._flights.pop(key)
+        if error is None:
+            flight.set_result(result)
+        elif isinstance(error, Exception):
+            flight.set_exception(error)
+        else:
+            # GeneratorExit, CancelledError and the like: let a waiter retry
+            flight.set_exception(FlightAbandoned())
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Call fn() unless an identical call is in flight, in which case share its result."""
+        leader, result = self.join(key)
+        if not leader:
+            return result
+        try:
+            result = fn()
+        except BaseException as e:
+            self.land(key, error=e)
+            raise
+        self.land(key, result)
+        return result
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Asynchronous do() for coroutine functions."""
+        leader, result = await self.join_async(key)
+        if not leader:
+            return result
+        try:
+            result = await fn()
+        except BaseException as e:
+            self.land(key, error=e)
+            raise
+        self.land(key, result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """Return how many calls were made and how many were served by another caller's request."""
+        with self._lock:
+            return {"calls": self.calls, "saved": self.saved, "in_flight": len(self._flights)}
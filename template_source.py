@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_EXTENSIONS = (".json", ".yaml", ".yml")
+
+
+class TemplateLoadError(ValueError):
+    """A template file or directory could not be read or holds no valid templates."""
+
+
+def _read_file(path: str) -> object:
+    with open(path, encoding="utf-8") as source:
+        if path.endswith(".json"):
+            return json.load(source)
+        try:
+            import yaml
+        except ImportError:
+            raise TemplateLoadError(f"{path}: reading YAML templates needs PyYAML (pip install pyyaml)") from None
+        return yaml.safe_load(source)
+
+
+def _template_files(path: str) -> List[str]:
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.endswith(TEMPLATE_EXTENSIONS) and not name.startswith(".")
+        )
+    return [path]
+
+
+def load_templates(path: str) -> Dict[str, dict]:
+    """Load templates from a JSON or YAML file, or from every such file in a directory.
+
+    A file holds either a mapping of template keys to templates, in the same
+    shape as PROMPT_TEMPLATES, or a single template (a mapping with a
+    "template" field) whose key is the file name without its extension.
+    Files in a directory are read in name order; a later key replaces an
+    earlier one.
+    """
+    prompt_data: Dict[str, dict] = {}
+    for file_path in _template_files(path):
+        try:
+            data = _read_file(file_path)
+        except (OSError, ValueError) as e:
+            raise TemplateLoadError(f"{file_path}: {e}") from e
+        if isinstance(data, dict) and isinstance(data.get("template"), str):
+            data = {os.path.splitext(os.path.basename(file_path))[0]: data}
+        if not isinstance(data, dict):
+            raise TemplateLoadError(f"{file_path}: expected a mapping of template keys to templates")
+        for key, template in data.items():
+            if not isinstance(template, dict) or not isinstance(template.get("template"), str):
+                raise TemplateLoadError(f"{file_path}: template {key!r} has no \"template\" text")
+            prompt_data[str(key)] = template
+    if not prompt_data:
+        raise TemplateLoadError(f"{path}: no templates found")
+    return prompt_data
+
+
+class TemplateWatcher:
+    """Reload templates from a file or directory when it changes.
+
+    Each poll only stats the files: the templates are re-read when a file's
+    modification time or size changes, or when a file is added or removed.
+    If the new files cannot be loaded, for example because an editor is
+    halfway through saving, the previous templates stay in use and the load
+    is retried when the files change again.
+    """
+
+    def __init__(self, path: str, interval: float = 2.0):
+        self.path = path
+        self.interval = interval
+        self._signature = self._stat()
+        self._failed_signature: Optional[Tuple[Tuple[str, int, int], ...]] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _stat(self) -> Tuple[Tuple[str, int, int], ...]:
+        signature = []
+        try:
+            for file_path in _template_files(self.path):
+                stat = os.stat(file_path)
+                signature.append((file_path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            pass
+        return tuple(signature)
+
+    def poll(self) -> Optional[Dict[str, dict]]:
+        """Return the reloaded templates if the source changed, otherwise None."""
+        signature = self._stat()
+        if signature == self._signature or signature == self._failed_signature:
+            return None
+        try:
+            prompt_data = load_templates(self.path)
+        except TemplateLoadError as e:
+            # Warn once per failed version of the files, not on every poll
+            self._failed_signature = signature
+            logger.warning("Keeping the current templates: %s", e)
+            return None
+        self._signature = signature
+        return prompt_data
+
+    def start(self, on_change: Callable[[Dict[str, dict]], None]) -> threading.Thread:
+        """Poll in a daemon thread, calling on_change with each new set of templates."""
+        def run():
+            while not self._stop.wait(self.interval):
+                prompt_data = self.poll()
+                if prompt_data is not None:
+                    try:
+                        on_change(prompt_data)
+                    except Exception:
+                        logger.exception("Failed to apply reloaded templates from %s", self.path)
+
+        self._thread = threading.Thread(target=run, name="template-watcher", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        """Stop the polling thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,150 @@
+"""Build an on-disk template store.
+
+Usage: python template_store.py SOURCE STORE
+
+SOURCE is a JSON or YAML template file, or a directory of them, as accepted
+by TEMPLATES_PATH. The templates are written to the SQLite file STORE, which
+replaces any existing file only once it is complete. Point TEMPLATE_STORE at
+it to serve the templates from disk.
+"""
+import argparse
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Dict, Iterator
+
+from template_source import load_templates
+from templates import CompiledTemplate
+
+
+class TemplateStore(Mapping):
+    """Read-only mapping of template keys to template text, backed by a SQLite file.
+
+    Opening the store reads every template's metadata (name, description,
+    examples and any other fields) in one query. That is all the UI and the
+    routers need. The template text itself is read when a template is
+    first used, compiled, and kept in a small LRU hot set, so a library of
+    thousands of templates costs little memory or startup time. Membership,
+    iteration and len() never touch the template text.
+    """
+
+    def __init__(self, path: str, hot_size: int = 64):
+        self.path = path
+        self.hot_size = max(1, hot_size)
+        self.hits = 0
+        self.misses = 0
+        self._hot: "OrderedDict[str, CompiledTemplate]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Read-only, so a missing file is an error instead of a new empty store
+        self._db = sqlite3.connect(f"{pathlib.Path(path).absolute().as_uri()}?mode=ro", uri=True,
+                                   check_same_thread=False)
+        self.index: Dict[str, dict] = {
+            key: json.loads(metadata)
+            for key, metadata in self._db.execute("SELECT key, metadata FROM templates ORDER BY position")
+        }
+
+    def compiled(self, key: str) -> CompiledTemplate:
+        """Return the compiled template for key, reading it from disk if it is not in the hot set."""
+        with self._lock:
+            template = self._hot.get(key)
+            if template is not None:
+                self._hot.move_to_end(key)
+                self.hits += 1
+                return template
+            row = self._db.execute("SELECT template FROM templates WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                raise KeyError(key)
+            self.misses += 1
+            template = CompiledTemplate(row[0])
+            self._hot[key] = template
+            while len(self._hot) > self.hot_size:
+                self._hot.popitem(last=False)
+            return template
+
+    @property
+    def compiled_templates(self) -> Mapping:
+        """A key -> CompiledTemplate view that reads through the hot set."""
+        return _CompiledTemplates(self)
+
+    def __getitem__(self, key: str) -> str:
+        return self.compiled(key).source
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hot-set hit/miss counters and sizes."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "hot": len(self._hot), "templates": len(self.index)}
+
+    def close(self) -> None:
+        """Close the SQLite file."""
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def build(path: str, prompt_data: Dict[str, dict]) -> None:
+        """Write prompt_data to a new store at path, replacing any existing file once complete."""
+        partial = f"{path}.partial"
+        if os.path.exists(partial):
+            os.remove(partial)
+        db = sqlite3.connect(partial)
+        try:
+            db.execute(
+                "CREATE TABLE templates (key TEXT PRIMARY KEY, position INTEGER NOT NULL, "
+                "metadata TEXT NOT NULL, template TEXT NOT NULL)"
+            )
+            db.executemany(
+                "INSERT INTO templates (key, position, metadata, template) VALUES (?, ?, ?, ?)",
+                (
+                    (key, position, json.dumps({k: v for k, v in data.items() if k != "template"}, ensure_ascii=False),
+                     data.get("template", "No template available"))
+                    for position, (key, data) in enumerate(prompt_data.items())
+                ),
+            )
+            db.commit()
+        finally:
+            db.close()
+        os.replace(partial, path)
+
+
+class _CompiledTemplates(Mapping):
+    def __init__(self, store: TemplateStore):
+        self._store = store
+
+    def __getitem__(self, key: str) -> CompiledTemplate:
+        return self._store.compiled(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._store
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._store)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="JSON/YAML template file or directory")
+    parser.add_argument("store", help="SQLite file to write")
+    args = parser.parse_args()
+
+    prompt_data = load_templates(args.source)
+    TemplateStore.build(args.store, prompt_data)
+    print(f"Wrote {len(prompt_data)} templates to {args.store}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import re
+from typing import Dict, Mapping, Optional, Union
+
+PROMPT_PLACEHOLDER = "[Insert initial prompt here]"
+DEFAULT_PLACEHOLDERS = {"prompt": PROMPT_PLACEHOLDER}
+
+
+class CompiledTemplate:
+    """A prompt template split once into literal segments around its placeholders.
+
+    `placeholders` maps names to the marker text they replace in the source, by
+    default just the initial-prompt marker. render(prompt=...) then joins the
+    precomputed segments with the given values instead of scanning and copying
+    the whole template on every call. Every occurrence of a marker is replaced,
+    like str.replace; markers with no value given are left as they are.
+    """
+
+    __slots__ = ("source", "placeholders", "_literals", "_names")
+
+    def __init__(self, source: str, placeholders: Optional[Mapping[str, str]] = None):
+        self.source = source
+        self.placeholders = dict(DEFAULT_PLACEHOLDERS if placeholders is None else placeholders)
+        by_marker = {marker: name for name, marker in self.placeholders.items()}
+        # Longest marker first so one marker that contains another wins
+        pattern = re.compile("|".join(re.escape(marker) for marker in sorted(by_marker, key=len, reverse=True)))
+        self._literals = []
+        self._names = []
+        position = 0
+        for match in pattern.finditer(source) if by_marker else ():
+            self._literals.append(source[position:match.start()])
+            self._names.append(by_marker[match.group()])
+            position = match.end()
+        self._literals.append(source[position:])
+
+    def render(self, **values: str) -> str:
+        """Fill the placeholders with values, leaving any without a value unchanged."""
+        if not self._names:
+            return self.source
+        if len(self._names) == 1:
+            value = values.get(self._names[0], self.placeholders[self._names[0]])
+            return self._literals[0] + value + self._literals[1]
+        parts = [self._literals[0]]
+        for name, literal in zip(self._names, self._literals[1:]):
+            parts.append(values[name] if name in values else self.placeholders[name])
+            parts.append(literal)
+        return "".join(parts)
+
+    def __bool__(self) -> bool:
+        return bool(self.source)
+
+    def __str__(self) -> str:
+        return self.source
+
+    def __repr__(self) -> str:
+        return f"CompiledTemplate({self.source[:40]!r}, placeholders={self._names})"
+
+
+def compile_templates(templates: Mapping[str, Union[str, CompiledTemplate]],
+                      placeholders: Optional[Mapping[str, str]] = None) -> Dict[str, CompiledTemplate]:
+    """Compile each template of a key -> template mapping, keeping already compiled ones."""
+    return {
+        key: template if isinstance(template, CompiledTemplate) else CompiledTemplate(template, placeholders)
+        for key, template in templates.items()
+    }
@@ -0,0 +1,26 @@
+from batch_refine import drop_partial_line, load_checkpoint, read_prompts
+
+
+def test_bad_lines_are_skipped(tmp_path):
+    path = tmp_path / "prompts.jsonl"
+    path.write_text('{"id": "a", "prompt": "first"}\n{not json\n{"id": "c"}\n42\n\n"bare"\n', encoding="utf-8")
+    assert list(read_prompts(str(path))) == [("a", "first"), ("6", "bare")]
+
+
+def test_partial_last_record_is_dropped(tmp_path):
+    path = tmp_path / "refined.jsonl"
+    complete = '{"id": "a", "metaprompt": "m", "error": null}\n'
+    path.write_text(complete + '{"id": "b", "metaprom', encoding="utf-8")
+    drop_partial_line(str(path), block_size=8)
+    assert path.read_text(encoding="utf-8") == complete
+    assert load_checkpoint(str(path)) == {("a", "m")}
+
+    drop_partial_line(str(path))
+    assert path.read_text(encoding="utf-8") == complete
+
+
+def test_partial_only_record_is_dropped(tmp_path):
+    path = tmp_path / "refined.jsonl"
+    path.write_text('{"id": "a"', encoding="utf-8")
+    drop_partial_line(str(path))
+    assert path.read_text(encoding="utf-8") == ""
@@ -0,0 +1,70 @@
+"""Load balancing across local stub servers, end to end through PromptRefiner."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from endpoint_pool import EndpointPool
+from mock_server import MockServer
+from prompt_refiner import PromptRefiner
+from retry_policy import RetryPolicy
+
+
+@pytest.fixture
+def servers():
+    started = {
+        "fast": MockServer(latency=0.01).start(),
+        "slow": MockServer(latency=0.15).start(),
+        "broken": MockServer(latency=0.01, status=503).start(),
+    }
+    yield started
+    for server in started.values():
+        server.stop()
+
+
+def apply_many(refiner, count, concurrency=8):
+    # Unique prompts, so nothing is cached or coalesced
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(
+            lambda i: refiner.apply_prompt(f"prompt {i} {time.time()}", "mock", use_cache=False), range(count)
+        ))
+
+
+def make_refiner(endpoints):
+    # One attempt per call, so every response is visible in the endpoint counts
+    return PromptRefiner(endpoints, None, {}, {}, retry_policy=RetryPolicy(max_attempts=1))
+
+
+def test_slow_endpoint_gets_fewer_requests(servers):
+    refiner = make_refiner([servers["fast"].url, servers["slow"].url])
+    try:
+        results = apply_many(refiner, 80)
+    finally:
+        refiner.close()
+    assert not [result for result in results if result.startswith("Error")]
+    assert servers["fast"].requests + servers["slow"].requests == 80
+    assert servers["slow"].requests < servers["fast"].requests / 2
+
+
+def test_failing_endpoint_is_ejected_and_tried_again_after_the_window(servers):
+    pool = EndpointPool([server.url for server in servers.values()], eject_after=3, eject_seconds=0.5)
+    refiner = make_refiner(pool)
+    broken = servers["broken"]
+    try:
+        apply_many(refiner, 40)
+        assert pool.snapshot()[2]["ejected"]
+        failed_requests = broken.requests
+        assert failed_requests >= 3
+
+        # Still ejected: no more traffic reaches it
+        apply_many(refiner, 20)
+        assert broken.requests == failed_requests
+
+        broken.status = None
+        time.sleep(0.6)
+        results = apply_many(refiner, 40)
+        assert broken.requests > failed_requests
+        assert not pool.snapshot()[2]["ejected"]
+        assert not [result for result in results if result.startswith("Error")]
+    finally:
+        refiner.close()
@@ -0,0 +1,84 @@
+import time
+
+from endpoint_pool import EndpointPool
+
+
+def test_picks_lowest_outstanding_times_latency():
+    pool = EndpointPool(["fast", "slow"])
+    fast, slow = pool.endpoints
+    fast.latency, slow.latency = 0.1, 0.4
+    # (0 + 1) * 0.1 < (0 + 1) * 0.4
+    assert pool.acquire() is fast
+    fast.outstanding = 4
+    # (4 + 1) * 0.1 = 0.5 > (0 + 1) * 0.4
+    assert pool.acquire() is slow
+
+
+def test_endpoint_without_latency_is_assumed_average():
+    pool = EndpointPool(["a", "b", "new"])
+    a, b, new = pool.endpoints
+    a.latency, b.latency = 0.1, 0.5
+    a.outstanding = b.outstanding = 2
+    # new counts as 0.3s with nothing outstanding: 0.3 < 3 * 0.1
+    assert pool.acquire() is new
+
+
+def test_consecutive_failures_eject_the_endpoint():
+    pool = EndpointPool(["bad", "good"], eject_after=2, eject_seconds=30)
+    bad, good = pool.endpoints
+    bad.latency = 0.1
+    bad.outstanding += 1
+    pool.release(bad, success=False)
+    assert bad.ejected_until == 0.0  # one failure is not enough
+    bad.outstanding += 1
+    pool.release(bad, success=False)
+    assert bad.ejected_until > time.monotonic()
+    assert bad.latency is None
+    assert all(pool.acquire() is good for _ in range(5))
+    assert pool.snapshot()[0]["ejected"]
+
+
+def test_ejected_endpoint_is_probed_again_after_the_ejection_period():
+    pool = EndpointPool(["bad", "good"], eject_after=1, eject_seconds=30)
+    bad, good = pool.endpoints
+    good.latency = 0.2
+    bad.outstanding += 1
+    pool.release(bad, success=False)
+    assert pool.acquire() is good
+    pool.release(good, 0.2)
+
+    bad.ejected_until = time.monotonic() - 1  # the ejection period is over
+    good.outstanding = 1
+    # No latency sample since it was ejected, so it counts as average and gets the next request
+    probe = pool.acquire()
+    assert probe is bad
+    pool.release(probe, 0.1)
+    assert bad.consecutive_failures == 0 and bad.latency == 0.1
+
+
+def test_only_a_success_clears_an_ejection():
+    pool = EndpointPool(["bad", "good"], eject_after=1, eject_seconds=30)
+    bad = pool.endpoints[0]
+    bad.outstanding += 1
+    pool.release(bad, success=False)
+    ejected_until = bad.ejected_until
+
+    # Cancelled requests and 4xx responses carry no health signal
+    for _ in range(3):
+        bad.outstanding += 1
+        pool.release(bad, success=None)
+    assert bad.ejected_until == ejected_until
+    assert bad.consecutive_failures == 1
+    assert bad.outstanding == 0
+
+    bad.outstanding += 1
+    pool.release(bad, 0.1)
+    assert bad.ejected_until == 0.0 and bad.consecutive_failures == 0
+
+
+def test_every_endpoint_ejected_uses_the_one_due_back_soonest():
+    pool = EndpointPool(["a", "b"], eject_after=1, eject_seconds=30)
+    a, b = pool.endpoints
+    now = time.monotonic()
+    a.ejected_until, b.ejected_until = now + 20, now + 10
+    assert pool.acquire() is b
@@ -0,0 +1,54 @@
+import json
+import random
+
+from json_parser import IncrementalFieldParser
+
+# Escapes, quotes, control characters, BMP and non-BMP text
+ALPHABET = list("abc xyz\"\\/\n\t\r\b\f") + ["é", "中", " ", "\x01", "😀", "𝄞", "🇫🇷"]
+
+
+def random_text(rng):
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 40)))
+
+
+def random_chunks(text, rng):
+    chunks, pos = [], 0
+    while pos < len(text):
+        size = rng.randint(1, 8)
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def test_random_chunkings_match_json_loads():
+    rng = random.Random(0)
+    for _ in range(2000):
+        document = {
+            "initial_prompt_evaluation": random_text(rng),
+            "refined_prompt": random_text(rng),
+            "explanation_of_refinements": random_text(rng),
+        }
+        encoded = json.dumps(document, ensure_ascii=rng.random() < 0.7)
+        parser = IncrementalFieldParser(("refined_prompt", "explanation_of_refinements"))
+        for chunk in random_chunks(f"<json>\n{encoded}\n</json>", rng):
+            parser.feed(chunk)
+            # Partial values must always be encodable, as Gradio serializes them
+            parser.value("refined_prompt").encode("utf-8")
+        expected = json.loads(encoded)
+        assert parser.value("refined_prompt") == expected["refined_prompt"]
+        assert parser.value("explanation_of_refinements") == expected["explanation_of_refinements"]
+        assert parser.is_complete("refined_prompt")
+
+
+def test_surrogate_pair_split_across_chunks():
+    parser = IncrementalFieldParser()
+    for chunk in ['{"refined_prompt": "a\\ud8', '3d', '\\u', 'de0', '0b"}']:
+        parser.feed(chunk)
+        parser.value().encode("utf-8")
+    assert parser.value() == "a😀b"
+
+
+def test_lone_surrogate_becomes_replacement_character():
+    parser = IncrementalFieldParser()
+    parser.feed('{"refined_prompt": "x\\ud83dy\\ude00"}')
+    assert parser.value() == "x�y�"
@@ -0,0 +1,62 @@
+import json
+import os
+
+import pytest
+
+from json_parser import extract_json, repair_json
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "parser_corpus")
+with open(os.path.join(CORPUS_DIR, "manifest.json"), encoding="utf-8") as manifest_file:
+    MANIFEST = json.load(manifest_file)
+
+
+def read_sample(name):
+    with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as sample:
+        return sample.read().strip()
+
+
+@pytest.mark.parametrize("name", sorted(MANIFEST))
+def test_corpus_sample_matches_the_manifest(name):
+    expected = MANIFEST[name]
+    result = extract_json(read_sample(name))
+    if expected["path"] == "json":
+        assert isinstance(result, dict)
+        assert result.get("refined_prompt", "")[:len(expected["refined_prompt_prefix"])] == expected["refined_prompt_prefix"]
+    else:
+        # The regex fallback handles these, so the JSON path must not claim them
+        assert not isinstance(result, dict)
+
+
+@pytest.mark.parametrize("name", sorted(MANIFEST))
+def test_every_truncation_of_a_corpus_sample_is_handled(name):
+    text = read_sample(name)
+    step = max(1, len(text) // 200)
+    for end in range(0, len(text), step):
+        # Neither raises, whatever the cut
+        repair_json(text[:end])
+        result = extract_json(text[:end])
+        assert result is None or isinstance(result, (dict, list, str, int, float, bool))
+
+
+def test_markdown_fence():
+    text = 'Here you go:\n```json\n{"refined_prompt": "Be specific", "explanation_of_refinements": "x"}\n```\nDone.'
+    assert extract_json(text) == {"refined_prompt": "Be specific", "explanation_of_refinements": "x"}
+
+
+def test_trailing_commas_and_bare_keys():
+    assert extract_json('{refined_prompt: "a", "items": [1, 2,],}') == {"refined_prompt": "a", "items": [1, 2]}
+
+
+def test_truncated_mid_string_and_mid_escape():
+    assert extract_json('<json>{"refined_prompt": "Write a story", "explanation": "Added det') == {
+        "refined_prompt": "Write a story", "explanation": "Added det"
+    }
+    assert extract_json('{"refined_prompt": "Say \\"hi\\') == {"refined_prompt": 'Say "hi'}
+    assert extract_json('{"items": [{"a": 1}, {"b": 2') == {"items": [{"a": 1}, {"b": 2}]}
+    # A key cut off before its value cannot be recovered, but is not an error either
+    assert extract_json('{"items": [{"a": 1}, {"b": ') is None
+
+
+def test_no_json():
+    assert extract_json("I could not refine this prompt.") is None
+    assert repair_json("no braces here") is None
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from load_shedding import AdaptiveConcurrencyLimiter, ConcurrencyLimitError
+
+
+def test_callers_over_the_limit_wait_for_a_slot():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=4, wait_timeout=5)
+    peak = 0
+    completed = []
+    lock = threading.Lock()
+
+    def call(i):
+        nonlocal peak
+        limiter.acquire()
+        with lock:
+            peak = max(peak, limiter.in_flight)
+        time.sleep(0.02)
+        limiter.release()
+        with lock:
+            completed.append(i)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(completed) == list(range(16))
+    assert peak <= 4
+    assert limiter.snapshot() == {"limit": 4, "in_flight": 0, "waiting": 0, "rejected": 0, "baseline_latency": None}
+
+
+def test_async_callers_over_the_limit_wait_for_a_slot():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=3, max_limit=3, wait_timeout=5)
+    peak = 0
+
+    async def call(i):
+        nonlocal peak
+        await limiter.acquire_async()
+        peak = max(peak, limiter.in_flight)
+        await asyncio.sleep(0.01)
+        limiter.release()
+        return i
+
+    async def main():
+        return await asyncio.gather(*(call(i) for i in range(12)))
+
+    assert asyncio.run(main()) == list(range(12))
+    assert peak <= 3
+    assert limiter.in_flight == 0
+    assert limiter.rejected == 0
+
+
+def test_caller_is_shed_when_no_slot_frees_up_in_time():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=1, wait_timeout=0.05)
+    limiter.acquire()
+    with pytest.raises(ConcurrencyLimitError):
+        limiter.acquire()
+    with pytest.raises(ConcurrencyLimitError):
+        asyncio.run(limiter.acquire_async())
+    limiter.release()
+    limiter.acquire()
+    assert limiter.snapshot()["waiting"] == 0
+    assert limiter.rejected == 2
+
+
+def test_cancelled_async_waiter_gives_its_slot_back():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=1, wait_timeout=5)
+
+    async def main():
+        await limiter.acquire_async()
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        limiter.release()
+        await limiter.acquire_async()
+
+    asyncio.run(main())
+    assert limiter.snapshot()["waiting"] == 0
+    assert limiter.in_flight == 1
@@ -0,0 +1,28 @@
+from local_router import LocalMetapromptRouter
+
+PROMPT_DATA = {
+    "code_review": {
+        "description": "Review source code for bugs and style",
+        "examples": ["Review this Python function for bugs"],
+    },
+    "story": {
+        "description": "Write creative fiction and short stories",
+        "examples": ["Write a short story about a dragon"],
+    },
+}
+
+
+def test_clear_match_is_selected():
+    router = LocalMetapromptRouter(PROMPT_DATA, min_confidence=0.3)
+    match = router.select("Review my Python code for bugs")
+    assert match is not None
+    assert match.key == "code_review"
+
+
+def test_one_incidental_shared_term_is_not_trusted():
+    router = LocalMetapromptRouter(PROMPT_DATA, min_confidence=0.3)
+    prompt = "Plan a weekly budget spreadsheet with categories, savings goals and a style guide"
+    match = router.route(prompt)
+    assert match is not None and match.key == "code_review"  # only "style" is shared
+    assert match.confidence < 0.3
+    assert router.select(prompt) is None
@@ -0,0 +1,69 @@
+import asyncio
+
+import response_cache
+from mock_server import MockServer
+from prompt_refiner import PromptRefiner
+from response_cache import ResponseCache
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def key(n=0):
+    return ResponseCache.make_key("endpoint", "model", MESSAGES, 0.0, n)
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(ttl=60)
+    cache.set(key(), {"v": 1})
+    now[0] += 59
+    assert cache.get(key()) == {"v": 1}
+    now[0] += 2
+    assert cache.get(key()) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.set(key(1), {"v": 1})
+    cache.set(key(2), {"v": 2})
+    cache.get(key(1))
+    cache.set(key(3), {"v": 3})
+    assert cache.get(key(2)) is None
+    assert cache.get(key(1)) == {"v": 1}
+    assert cache.get(key(3)) == {"v": 3}
+
+
+def test_sqlite_store_persists_across_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    first = ResponseCache(path=path)
+    first.set(key(1), {"v": 1})
+    asyncio.run(first.set_async(key(2), {"v": 2}))
+    first.close()
+
+    second = ResponseCache(path=path, max_entries=1)
+    assert second.get(key(1)) == {"v": 1}
+    assert asyncio.run(second.get_async(key(2))) == {"v": 2}
+    # Evicted from memory, still on disk
+    assert second.get(key(1)) == {"v": 1}
+    second.close()
+
+
+def test_sampled_responses_are_only_cached_with_cache_sampled():
+    assert ResponseCache().accepts(0.0)
+    assert not ResponseCache().accepts(0.8)
+    assert ResponseCache(cache_sampled=True).accepts(0.8)
+
+    with MockServer() as server:
+        for cache_sampled, expected_requests in ((False, 2), (True, 1)):
+            server.requests = 0
+            refiner = PromptRefiner(server.url, None, {}, {}, cache=ResponseCache(cache_sampled=cache_sampled))
+            try:
+                # Apply Prompts samples at temperature 0.8
+                first = refiner.apply_prompt("same prompt", "mock")
+                second = refiner.apply_prompt("same prompt", "mock")
+            finally:
+                refiner.close()
+            assert first == second
+            assert server.requests == expected_requests
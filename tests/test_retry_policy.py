@@ -0,0 +1,73 @@
+import httpx
+import pytest
+
+from retry_policy import RetryPolicy
+
+
+def status_error(status, headers=None):
+    request = httpx.Request("POST", "http://llm.test/v1/chat/completions")
+    response = httpx.Response(status, headers=headers, request=request)
+    return httpx.HTTPStatusError(f"HTTP {status}", request=request, response=response)
+
+
+def run(policy, outcomes):
+    """Drive policy.retrying() over a list of errors and results; return (result or error, attempts, sleeps)."""
+    retrying = policy.retrying()
+    sleeps = []
+    retrying.sleep = sleeps.append
+    attempts = 0
+    try:
+        for attempt in retrying:
+            with attempt:
+                outcome = outcomes[attempts]
+                attempts += 1
+                if isinstance(outcome, Exception):
+                    raise outcome
+                return outcome, attempts, sleeps
+    except Exception as e:
+        return e, attempts, sleeps
+
+
+def test_retry_after_is_honoured():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.1)
+    result, attempts, sleeps = run(policy, [status_error(429, {"Retry-After": "2"}), "ok"])
+    assert result == "ok" and attempts == 2
+    assert 2.0 <= sleeps[0] <= 2.1
+
+
+def test_other_4xx_is_not_retried():
+    policy = RetryPolicy(max_attempts=3)
+    result, attempts, sleeps = run(policy, [status_error(400), "ok"])
+    assert isinstance(result, httpx.HTTPStatusError) and attempts == 1
+    assert sleeps == []
+
+
+def test_transport_errors_and_5xx_are_retried_with_jittered_backoff():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=20)
+    result, attempts, sleeps = run(policy, [httpx.ConnectError("refused"), status_error(503), "ok"])
+    assert result == "ok" and attempts == 3
+    assert all(0.5 <= delay <= 20 for delay in sleeps)
+
+
+def test_no_retry_asked_to_wait_past_the_deadline():
+    policy = RetryPolicy(max_attempts=5, deadline=1.0)
+    result, attempts, sleeps = run(policy, [status_error(503, {"Retry-After": "5"}), "ok"])
+    assert isinstance(result, httpx.HTTPStatusError) and attempts == 1
+
+
+def test_waits_and_timeouts_are_capped_by_the_deadline():
+    policy = RetryPolicy(max_attempts=5, base_delay=10, max_delay=10, deadline=0.5)
+    result, attempts, sleeps = run(policy, [httpx.ConnectError("refused"), "ok"])
+    assert result == "ok"
+    assert sleeps[0] <= 0.5
+
+    retrying = policy.retrying()
+    for attempt in retrying:
+        with attempt:
+            timeout = policy.attempt_timeout(httpx.Timeout(120), attempt.retry_state)
+    assert timeout.read <= 0.5 and timeout.connect <= 0.5
+
+
+@pytest.mark.parametrize("status", [408, 425, 429, 500, 502, 503, 504])
+def test_retryable_statuses(status):
+    assert RetryPolicy().is_retryable(status_error(status))
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_followers_share_the_leaders_result():
+    flights = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {"answer": 42}
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(flights.do, "key", fetch) for _ in range(8)]
+        while flights.stats()["calls"] < 8:
+            time.sleep(0.005)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == [{"answer": 42}] * 8
+    assert len(calls) == 1
+    assert flights.stats() == {"calls": 8, "saved": 7, "in_flight": 0}
+
+
+def test_followers_get_the_leaders_exception():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def fetch():
+        release.wait(5)
+        raise ValueError("backend said no")
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(flights.do, "key", fetch) for _ in range(4)]
+        while flights.stats()["calls"] < 4:
+            time.sleep(0.005)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError, match="backend said no"):
+                future.result()
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_abandoned_leader_hands_over_to_a_follower():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch(delay):
+        calls.append(delay)
+        await asyncio.sleep(delay)
+        return "fresh"
+
+    async def main():
+        leader = asyncio.ensure_future(flights.do_async("key", lambda: fetch(5)))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.ensure_future(flights.do_async("key", lambda: fetch(0.01))) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.wait_for(asyncio.gather(*followers), 2)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return results
+
+    assert asyncio.run(main()) == ["fresh"] * 3
+    # The cancelled leader's call, then one follower took over for the rest
+    assert calls == [5, 0.01]
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_different_keys_do_not_share():
+    flights = SingleFlight()
+    assert flights.do("a", lambda: 1) == 1
+    assert flights.do("b", lambda: 2) == 2
+    assert flights.stats()["saved"] == 0
+
+
+def test_abandoned_stream_lets_a_waiting_thread_lead():
+    flights = SingleFlight()
+    leader, _ = flights.join("key")
+    assert leader
+    follower = ThreadPoolExecutor(max_workers=1).submit(flights.join, "key")
+    while flights.stats()["calls"] < 2:
+        time.sleep(0.005)
+    # The leader's consumer stopped reading the stream
+    flights.land("key", error=GeneratorExit())
+    assert follower.result(timeout=2) == (True, None)
+    flights.land("key", "done")
@@ -0,0 +1,36 @@
+import asyncio
+import time
+
+from mock_server import MockServer
+from prompt_refiner import AsyncPromptRefiner, PromptRefiner
+
+CONTENT = "word " * 400  # 125 streamed chunks
+
+
+def test_apply_stream_is_throttled_and_ends_with_the_full_output():
+    with MockServer(content=CONTENT, token_delay=0.002) as server:
+        refiner = PromptRefiner(server.url, None, {}, {})
+        try:
+            started = time.perf_counter()
+            outputs = list(refiner.apply_prompt_stream("prompt", "mock", use_cache=False))
+            elapsed = time.perf_counter() - started
+        finally:
+            refiner.close()
+    assert outputs[-1] == CONTENT.strip()
+    assert len(outputs) <= elapsed / refiner.stream_update_interval + 2
+    assert len(outputs) < 125
+
+
+def test_async_apply_stream_is_throttled_and_ends_with_the_full_output():
+    async def run():
+        refiner = AsyncPromptRefiner(server.url, None, {}, {})
+        try:
+            return [output async for output in refiner.apply_prompt_stream("prompt", "mock", use_cache=False)]
+        finally:
+            await refiner.close()
+
+    with MockServer(content=CONTENT, token_delay=0.002) as server:
+        outputs = asyncio.run(run())
+    assert outputs[-1] == CONTENT.strip()
+    assert 2 <= len(outputs) < 125
+    assert all(CONTENT.startswith(output) for output in outputs)
@@ -1,5 +1,7 @@
 import json
 import os
+from functools import cached_property
+from typing import Dict, List, Mapping, Optional
 
 # Default template if none provided
 default_templates = {
@@ -31,29 +33,111 @@ Provide the output in JSON format with the following structure:
     }
 }
 
-# Load templates from environment variable or use default
-templates_json = os.getenv("PROMPT_TEMPLATES")
 
-try:
-    # Parse JSON data with error handling if env var exists
-    prompt_data = json.loads(templates_json) if templates_json else default_templates
-except json.JSONDecodeError:
-    # Fallback to default templates if JSON is invalid
-    prompt_data = default_templates
+class TemplateConfig:
+    """The metaprompt templates and everything derived from them.
+
+    Templates come from the TEMPLATE_STORE SQLite file when it is set, then
+    from the TEMPLATES_PATH file or directory, otherwise from
+    PROMPT_TEMPLATES. Any of them can hold a large library, so nothing is
+    read until a value is first used, and each value is built once and
+    cached. With a store, prompt_data holds only each template's metadata,
+    and meta_prompts reads template text from disk on demand.
+    The module-level names (meta_prompts, metaprompt_explanations,
+    explanation_markdown, examples, ...) read from the shared instance, so
+    importing this module only reads the cheap scalar settings below.
+    """
+
+    def __init__(self, templates_json: Optional[str] = None, prompt_data: Optional[Dict[str, dict]] = None):
+        # With neither given, the templates come from the environment when first needed
+        self._templates_json = templates_json
+        # Templates already loaded, e.g. reloaded from TEMPLATES_PATH
+        self._prompt_data = prompt_data
+
+    @cached_property
+    def store(self):
+        """The TemplateStore named by TEMPLATE_STORE, unless templates were given directly."""
+        if self._templates_json is not None or self._prompt_data is not None or not template_store_path:
+            return None
+        from template_store import TemplateStore
+        return TemplateStore(template_store_path, hot_size=template_cache_size)
+
+    @cached_property
+    def prompt_data(self) -> Dict[str, dict]:
+        if self._prompt_data is not None:
+            return self._prompt_data
+        if self.store is not None:
+            return self.store.index
+        if self._templates_json is None and templates_path:
+            from template_source import load_templates
+            return load_templates(templates_path)
+        templates_json = self._templates_json if self._templates_json is not None else os.getenv("PROMPT_TEMPLATES")
+        try:
+            # Parse JSON data with error handling if env var exists
+            return json.loads(templates_json) if templates_json else default_templates
+        except json.JSONDecodeError:
+            # Fallback to default templates if JSON is invalid
+            return default_templates
+
+    @cached_property
+    def metaprompt_list(self) -> List[str]:
+        return list(self.prompt_data)
+
+    @cached_property
+    def metaprompt_explanations(self) -> Dict[str, str]:
+        return {
+            key: data.get("description", "No description available")
+            for key, data in self.prompt_data.items()
+        }
+
+    @cached_property
+    def explanation_markdown(self) -> str:
+        return "".join(f"- **{key}**: {value}\n" for key, value in self.metaprompt_explanations.items())
+
+    @cached_property
+    def meta_prompts(self) -> Mapping[str, str]:
+        if self.store is not None:
+            return self.store
+        return {
+            key: data.get("template", "No template available")
+            for key, data in self.prompt_data.items()
+        }
+
+    @cached_property
+    def examples(self) -> List[List[str]]:
+        """[example, template key] pairs for the UI, taken from the templates' examples."""
+        return [
+            [example[0], key] if isinstance(example, list) else [example, key]
+            for key, data in self.prompt_data.items()
+            for example in data.get("examples", [])
+        ]
+
+
+# Serve templates from a SQLite store built with template_store.py, reading template text on demand
+# and keeping the TEMPLATE_CACHE_SIZE most recently used templates in memory
+template_store_path = os.getenv("TEMPLATE_STORE")  # Optional
+template_cache_size = int(os.getenv("TEMPLATE_CACHE_SIZE", "64"))
+
+# Load templates from a JSON/YAML file or a directory of them instead of PROMPT_TEMPLATES,
+# re-reading them when they change (checked every TEMPLATES_RELOAD_INTERVAL seconds, 0 disables)
+templates_path = os.getenv("TEMPLATES_PATH")  # Optional
+templates_reload_interval = float(os.getenv("TEMPLATES_RELOAD_INTERVAL", "2"))
+
+template_config = TemplateConfig()
+_TEMPLATE_VALUES = frozenset(
+    ("prompt_data", "metaprompt_list", "metaprompt_explanations", "explanation_markdown", "meta_prompts", "examples")
+)
 
-metaprompt_list = [key for key in prompt_data.keys()] if prompt_data else []
-print(metaprompt_list)
 
-# Create explanations dictionary with safe access
-metaprompt_explanations = {
-  key: data.get("description", "No description available")
-  for key, data in prompt_data.items()
-} if prompt_data else {}
+def __getattr__(name: str):
+    # Build template-derived values on first access, including `from variables import meta_prompts`
+    if name in _TEMPLATE_VALUES:
+        return getattr(template_config, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Generate markdown explanation
-explanation_markdown = "".join(
-    [f"- **{key}**: {value}\n" for key, value in metaprompt_explanations.items()]
-)
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | _TEMPLATE_VALUES)
 
 # Define default models list - can be overridden by environment variable
 default_models = [
@@ -62,34 +146,104 @@ default_models = [
 ]
 models = json.loads(os.getenv("AVAILABLE_MODELS", json.dumps(default_models)))
 
-# Extract examples only from JSON templates
-examples = []
-for key, data in prompt_data.items():
-    template_examples = data.get("examples", [])
-    if template_examples:
-        examples.extend(
-            [
-                [example[0], key] if isinstance(example, list) else [example, key]
-                for example in template_examples
-            ]
-        )
-
-# Get API endpoint and optional key
-api_endpoint = os.getenv("OLLAMA_HOST", "http://localhost:11434")
-if api_endpoint:
-    api_endpoint = f"{api_endpoint.rstrip('/')}/v1/chat/completions"
+# Get API endpoints (comma-separated hosts are load balanced) and optional key
+api_endpoints = [
+    f"{host.strip().rstrip('/')}/v1/chat/completions"
+    for host in os.getenv("OLLAMA_HOST", "http://localhost:11434").split(",")
+    if host.strip()
+]
+api_endpoint = api_endpoints[0] if api_endpoints else None
+# Take an endpoint out of rotation after this many consecutive failures, for this many seconds
+endpoint_eject_after = int(os.getenv("ENDPOINT_EJECT_AFTER", "3"))
+endpoint_eject_seconds = float(os.getenv("ENDPOINT_EJECT_SECONDS", "30"))
 api_key = os.getenv("LLM_API_KEY")  # Optional
 
-# Create meta_prompts dictionary with safe access
-meta_prompts = {
-  key: data.get("template", "No template available")
-  for key, data in prompt_data.items()
-} if prompt_data else {}
+# HTTP client pool and timeouts (seconds) for the LLM API
+http_max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+http_max_keepalive_connections = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+http_keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+http2_enabled = os.getenv("HTTP2", "false").lower() in ("1", "true", "yes")  # Needs httpx[http2]
+http_connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+http_read_timeout = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+http_write_timeout = float(os.getenv("HTTP_WRITE_TIMEOUT", "30"))
+http_pool_timeout = float(os.getenv("HTTP_POOL_TIMEOUT", "30"))
+
+# Retries for failed LLM calls: jittered backoff within a per-call deadline (seconds, 0 disables)
+retry_max_attempts = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+retry_base_delay = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+retry_max_delay = float(os.getenv("RETRY_MAX_DELAY", "20"))
+retry_deadline = float(os.getenv("RETRY_DEADLINE", "300"))
+
+# Load shedding: open the circuit after this many consecutive backend failures (0 disables)
+breaker_failure_threshold = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+breaker_recovery_timeout = float(os.getenv("BREAKER_RECOVERY_TIMEOUT", "30"))
+
+# Logging: level name and "text" or "json" lines (written from a background thread)
+log_level = os.getenv("LOG_LEVEL", "INFO")
+log_format = os.getenv("LOG_FORMAT", "text").lower()
+
+# Serve Prometheus metrics at http://METRICS_HOST:METRICS_PORT/metrics (unset or 0 disables)
+metrics_port = int(os.getenv("METRICS_PORT", "0"))
+metrics_host = os.getenv("METRICS_HOST", "0.0.0.0")
+
+# Send metaprompts as a static system message with the user prompt last, so backends can reuse their KV cache
+prefix_reuse = os.getenv("PREFIX_REUSE", "false").lower() in ("1", "true", "yes")
+llm_keep_alive = os.getenv("LLM_KEEP_ALIVE")  # Optional, e.g. "30m" (Ollama)
+llm_cache_prompt = (
+    os.getenv("LLM_CACHE_PROMPT").lower() in ("1", "true", "yes") if os.getenv("LLM_CACHE_PROMPT") else None
+)  # Optional (llama.cpp server)
+
+# Gradio queue: events beyond QUEUE_MAX_SIZE are rejected at once (0 = unbounded).
+# Each button has its own concurrency group so slow apply calls cannot starve cheap routing calls (0 = no limit)
+queue_max_size = int(os.getenv("QUEUE_MAX_SIZE", "64"))
+route_concurrency = int(os.getenv("ROUTE_CONCURRENCY", "16"))
+refine_concurrency = int(os.getenv("REFINE_CONCURRENCY", "8"))
+apply_concurrency = int(os.getenv("APPLY_CONCURRENCY", "4"))
+queue_status_interval = float(os.getenv("QUEUE_STATUS_INTERVAL", "2"))  # Seconds between UI queue updates, 0 hides them
+
+# Adaptive (AIMD) limit on requests in flight to the LLM backend (max 0 disables). It starts at what the
+# UI's concurrency groups can send at once (apply makes two calls); calls over the limit wait for a slot
+# for up to CONCURRENCY_WAIT_TIMEOUT seconds before they are shed
+_ui_concurrency = (
+    route_concurrency + refine_concurrency + 2 * apply_concurrency
+    if min(route_concurrency, refine_concurrency, apply_concurrency) > 0 else 64
+)
+concurrency_initial_limit = int(os.getenv("CONCURRENCY_INITIAL_LIMIT", str(_ui_concurrency)))
+concurrency_min_limit = int(os.getenv("CONCURRENCY_MIN_LIMIT", "1"))
+concurrency_max_limit = int(os.getenv("CONCURRENCY_MAX_LIMIT", str(max(64, concurrency_initial_limit))))
+concurrency_latency_tolerance = float(os.getenv("CONCURRENCY_LATENCY_TOLERANCE", "3"))
+concurrency_wait_timeout = float(os.getenv("CONCURRENCY_WAIT_TIMEOUT", "30"))
+
+# Compare Several Refinements: metaprompts and samples per metaprompt refined at once, and whether
+# one judging call ranks the candidates instead of the local scorer (the UI's starting values)
+best_of_n_top_k = int(os.getenv("BEST_OF_N_TOP_K", "2"))
+best_of_n_samples = int(os.getenv("BEST_OF_N_SAMPLES", "1"))
+best_of_n_judge = os.getenv("BEST_OF_N_JUDGE", "false").lower() in ("1", "true", "yes")
+
+# Stream tokens to the UI as they are generated (set to "false" to wait for full responses)
+stream_responses = os.getenv("STREAM_RESPONSES", "true").lower() in ("1", "true", "yes")
+
+# Response cache for repeated LLM calls (CACHE_PATH enables the on-disk SQLite store)
+cache_enabled = os.getenv("CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+cache_max_entries = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+cache_ttl = float(os.getenv("CACHE_TTL", "3600"))  # Seconds, 0 disables expiry
+cache_path = os.getenv("CACHE_PATH")  # Optional
+# Also cache responses sampled at temperature > 0 (refine and apply); off so asking again gives a new draw
+cache_sampled = os.getenv("CACHE_SAMPLED", "false").lower() in ("1", "true", "yes")
+
+# Share one LLM call among concurrent identical requests
+coalesce_requests = os.getenv("COALESCE_REQUESTS", "true").lower() in ("1", "true", "yes")
+
+# Local metaprompt router; the LLM router is only called below this confidence
+local_router_enabled = os.getenv("LOCAL_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+local_router_min_confidence = float(os.getenv("LOCAL_ROUTER_MIN_CONFIDENCE", "0.3"))
+
+# Leave the template samples out of the LLM router prompt to save input tokens
+router_compact = os.getenv("ROUTER_COMPACT", "false").lower() in ("1", "true", "yes")
 
 prompt_refiner_model = os.getenv(
     "prompt_refiner_model", "dolphin3.0-r1-mistral-24b:q6_k_l"
 )
-print("prompt_refiner_model used :" + prompt_refiner_model)
 
 echo_prompt_refiner = os.getenv('echo_prompt_refiner')
 openai_metaprompt = os.getenv('openai_metaprompt')